@@ -0,0 +1,98 @@
+# Copyright (c) 2019, Open Source Robotics Foundation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Willow Garage, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Benchmark of the compression of the cache files of the sources cache.
+
+Loads every cache file of a sources cache (by default the one of the
+current user, as written by ``rosdep update``) and writes it in each
+of the compressions selectable with ``rosdep update
+--cache-compression``.  For each compression the bytes on disk, the
+time to write the cache files and the time to load them (read,
+decompress and unpickle) are shown.
+
+Usage::
+
+    python benchmark/cache_compression.py [SOURCES_CACHE_DIR]
+"""
+
+from __future__ import print_function
+
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+
+from rosdep2.sources_list import PICKLE_CACHE_EXT, decompress_cache_data, get_cache_compressions, \
+    get_sources_cache_dir, load_cached_sources_list, write_cache_file
+
+REPEAT = 5
+
+
+def measure_load(filepaths):
+    """
+    :returns: best time in seconds of *REPEAT* loads of all *filepaths*
+    """
+    durations = []
+    for _ in range(REPEAT):
+        start = time.time()
+        for filepath in filepaths:
+            with open(filepath, 'rb') as f:
+                pickle.loads(decompress_cache_data(f.read()))
+        durations.append(time.time() - start)
+    return min(durations)
+
+
+def main(argv):
+    sources_cache_dir = argv[0] if argv else get_sources_cache_dir()
+    sources = load_cached_sources_list(sources_cache_dir=sources_cache_dir)
+    if not sources:
+        print('no cached sources in %s, run rosdep update first' % (sources_cache_dir), file=sys.stderr)
+        return 1
+    data = [(s.url, s.rosdep_data) for s in sources]
+    print('%d sources, %d rosdep keys' % (len(data), sum(len(d) for _, d in data if isinstance(d, dict))))
+
+    print('%-10s %12s %12s %12s' % ('variant', 'disk [kB]', 'write [ms]', 'load [ms]'))
+    for compression in get_cache_compressions():
+        tempdir = tempfile.mkdtemp()
+        try:
+            start = time.time()
+            filepaths = [write_cache_file(tempdir, url, rosdep_data, compression=compression) + PICKLE_CACHE_EXT
+                         for url, rosdep_data in data]
+            write_duration = time.time() - start
+            size = sum(os.path.getsize(filepath) for filepath in filepaths)
+            load_duration = measure_load(filepaths)
+        finally:
+            shutil.rmtree(tempdir)
+        print('%-10s %12d %12.1f %12.1f' % (compression, size / 1024, write_duration * 1000, load_duration * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,109 @@
+# Copyright (c) 2019, Open Source Robotics Foundation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Willow Garage, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Memory benchmark for the sharing of equal subtrees and strings in the
+sources cache.
+
+Loads every cache file of a sources cache (by default the one of the
+current user, as written by ``rosdep update``) in two variants: as
+written with :func:`rosdep2.sources_list.share_rosdep_data` and with
+every container and string as a separate object, as cache files were
+written before.  For each variant the size of the pickles, the time to
+unpickle them and the memory allocated for the loaded data are shown.
+
+Usage::
+
+    python benchmark/cache_memory.py [SOURCES_CACHE_DIR]
+
+Requires Python 3 for :mod:`tracemalloc`.
+"""
+
+from __future__ import print_function
+
+import os
+import pickle
+import sys
+import time
+import tracemalloc
+
+from rosdep2.sources_list import get_sources_cache_dir, load_cached_sources_list, \
+    share_rosdep_data
+
+
+def unshare(value):
+    """
+    :returns: deep copy of *value* in which no container or string is
+      referenced twice
+    """
+    if isinstance(value, dict):
+        return dict((unshare(k), unshare(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [unshare(v) for v in value]
+    if isinstance(value, str) and len(value) > 1:
+        # slicing and concatenating creates a new string object
+        return value[:1] + value[1:]
+    return value
+
+
+def measure(pickles):
+    """
+    :returns: (seconds, allocated bytes) to unpickle all *pickles*
+    """
+    tracemalloc.start()
+    start = time.time()
+    loaded = [pickle.loads(p) for p in pickles]
+    duration = time.time() - start
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del loaded
+    return duration, allocated
+
+
+def main(argv):
+    sources_cache_dir = argv[0] if argv else get_sources_cache_dir()
+    sources = load_cached_sources_list(sources_cache_dir=sources_cache_dir)
+    if not sources:
+        print('no cached sources in %s, run rosdep update first' % (sources_cache_dir), file=sys.stderr)
+        return 1
+    data = [s.rosdep_data for s in sources]
+    print('%d sources, %d rosdep keys' % (len(data), sum(len(d) for d in data if isinstance(d, dict))))
+
+    variants = [
+        ('unshared', [pickle.dumps(unshare(d), 2) for d in data]),
+        ('shared', [pickle.dumps(share_rosdep_data(d), 2) for d in data]),
+    ]
+    print('%-10s %12s %12s %14s' % ('variant', 'pickle [kB]', 'load [ms]', 'memory [kB]'))
+    for name, pickles in variants:
+        duration, allocated = measure(pickles)
+        print('%-10s %12d %12.1f %14d' % (
+            name, sum(len(p) for p in pickles) / 1024, duration * 1000, allocated / 1024))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,169 @@
+# Copyright (c) 2019, Open Source Robotics Foundation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Willow Garage, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Throughput benchmark for the pipelined fetch, parse and write stages
+of ``rosdep update``.
+
+Serves generated rosdep YAML files from a local HTTP server, with an
+optional delay per response standing in for network latency, and
+updates a temporary sources cache from them twice: once with every
+source downloaded, parsed and written one after the other, and once
+through the update pipeline of :mod:`rosdep2.sources_list`.
+
+Usage::
+
+    python benchmark/update_pipeline.py [--sources N] [--keys N] [--latency SECONDS] [--jobs N]
+
+Requires Python 3.
+"""
+
+from __future__ import print_function
+
+import argparse
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import yaml
+
+from rosdep2.sources_list import CACHE_COMPRESSION_NONE, DataSource, TYPE_YAML, _SourceUpdate, _fetch_source, \
+    _parse_source, _persist_source, _run_update_pipeline
+
+
+def generate_rosdep_yaml(keys, seed):
+    """
+    :returns: rosdep YAML with *keys* rules in the style of
+      ``base.yaml``, ``bytes``
+    """
+    data = {}
+    for i in range(keys):
+        name = 'key%d_%d' % (seed, i)
+        data[name] = {
+            'arch': ['lib%s' % name],
+            'debian': {'buster': ['lib%s-dev' % name], 'bullseye': ['lib%s-dev' % name]},
+            'fedora': ['%s-devel' % name],
+            'gentoo': ['dev-libs/%s' % name],
+            'ubuntu': {
+                'focal': ['lib%s-dev' % name],
+                'jammy': ['lib%s-dev' % name],
+                'noble': {'pip': {'packages': [name]}},
+            },
+        }
+    return yaml.safe_dump(data).encode('utf-8')
+
+
+def start_server(files, latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            body = files.get(self.path)
+            if body is None:
+                self.send_error(404)
+                return
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def update_serial(sources_cache_dir, updates):
+    for update in updates:
+        update = _fetch_source(sources_cache_dir, CACHE_COMPRESSION_NONE, update)
+        _persist_source(sources_cache_dir, CACHE_COMPRESSION_NONE, _parse_source(update))
+    return updates
+
+
+def update_pipelined(sources_cache_dir, updates, jobs):
+    return _run_update_pipeline(
+        updates,
+        lambda update: _fetch_source(sources_cache_dir, CACHE_COMPRESSION_NONE, update),
+        _parse_source,
+        lambda update: _persist_source(sources_cache_dir, CACHE_COMPRESSION_NONE, update),
+        jobs)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sources', type=int, default=8, help='number of sources lists entries')
+    parser.add_argument('--keys', type=int, default=5000, help='number of rosdep keys per source')
+    parser.add_argument('--latency', type=float, default=0.1, help='seconds before each response')
+    parser.add_argument('--jobs', type=int, default=4, help='parallel downloads of the pipeline')
+    args = parser.parse_args(argv)
+
+    files = dict(('/%d.yaml' % i, generate_rosdep_yaml(args.keys, i)) for i in range(args.sources))
+    server = start_server(files, args.latency)
+    base_url = 'http://127.0.0.1:%d' % server.server_address[1]
+    total_bytes = sum(len(body) for body in files.values())
+    print('%d sources, %.1f MB of YAML, %.3fs latency' % (args.sources, total_bytes / 1e6, args.latency))
+
+    variants = [
+        ('serial', lambda cache_dir, updates: update_serial(cache_dir, updates)),
+        ('pipelined', lambda cache_dir, updates: update_pipelined(cache_dir, updates, args.jobs)),
+    ]
+    print('%-10s %10s %8s %10s %10s %10s' % ('variant', 'time [s]', 'MB/s', 'fetch [s]', 'parse [s]', 'write [s]'))
+    try:
+        for name, update in variants:
+            sources_cache_dir = tempfile.mkdtemp()
+            try:
+                updates = [_SourceUpdate(DataSource(TYPE_YAML, base_url + path, [])) for path in sorted(files)]
+                start = time.time()
+                update(sources_cache_dir, updates)
+                duration = time.time() - start
+            finally:
+                shutil.rmtree(sources_cache_dir)
+            errors = [u.error for u in updates if u.error is not None]
+            if errors:
+                print('%s: %s' % (name, errors[0]), file=sys.stderr)
+                return 1
+            # summed over all sources, the stages overlap in the pipeline
+            totals = [sum(u.stats.get(k, 0) for u in updates) for k in ('transfer_time', 'parse_time', 'write_time')]
+            print('%-10s %10.2f %8.1f %10.2f %10.2f %10.2f' % (
+                (name, duration, total_bytes / 1e6 / duration) + tuple(totals)))
+    finally:
+        server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
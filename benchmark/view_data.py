@@ -0,0 +1,93 @@
+# Copyright (c) 2019, Open Source Robotics Foundation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Willow Garage, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Benchmark for loading the sources cache into a
+:class:`rosdep2.model.RosdepDatabase`.
+
+Loads every source of a sources cache (by default the one of the
+current user, as written by ``rosdep update``) into a database twice:
+copying the data of each source, as :meth:`set_view_data` did before,
+and sharing it through a read-only view.  For each variant the time
+and the memory allocated for the database entries are shown.
+
+Usage::
+
+    python benchmark/view_data.py [SOURCES_CACHE_DIR]
+
+Requires Python 3 for :mod:`tracemalloc`.
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import tracemalloc
+
+from rosdep2.model import RosdepDatabase, read_only_mapping
+from rosdep2.sources_list import get_sources_cache_dir, load_cached_sources_list
+
+
+def measure(sources, wrap):
+    """
+    :returns: (seconds, allocated bytes) to load all *sources*
+    """
+    tracemalloc.start()
+    start = time.time()
+    db = RosdepDatabase()
+    for source in sources:
+        db.set_view_data(source.url, wrap(source.rosdep_data), [], source.url)
+    duration = time.time() - start
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del db
+    return duration, allocated
+
+
+def main(argv):
+    sources_cache_dir = argv[0] if argv else get_sources_cache_dir()
+    sources = load_cached_sources_list(sources_cache_dir=sources_cache_dir)
+    sources = [s for s in sources if isinstance(s.rosdep_data, dict)]
+    if not sources:
+        print('no cached sources in %s, run rosdep update first' % (sources_cache_dir), file=sys.stderr)
+        return 1
+    print('%d sources, %d rosdep keys' % (len(sources), sum(len(s.rosdep_data) for s in sources)))
+
+    variants = [
+        # plain dicts are copied by set_view_data
+        ('copied', lambda data: data),
+        ('shared', read_only_mapping),
+    ]
+    print('%-10s %12s %14s' % ('variant', 'load [ms]', 'memory [kB]'))
+    for name, wrap in variants:
+        duration, allocated = measure(sources, wrap)
+        print('%-10s %12.1f %14d' % (name, duration * 1000, allocated / 1024))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,278 @@
+# Copyright (c) 2019, Open Source Robotics Foundation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Willow Garage, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Export the sources cache into a single compressed bundle and install
+such a bundle as the sources cache of another host, so that a cache
+built by one ``rosdep update`` can be used without network access or
+parsing on many hosts.
+
+A bundle is a gzipped tar file with all files of the sources cache
+and a manifest listing the checksum and modification time of each
+file.  Modification times are restored on import, as the snapshot,
+key index and rule tables are only used while the files they were
+computed from are unchanged.
+"""
+
+from __future__ import print_function
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+
+from .cache_generations import SourcesCacheLock, create_generation, discard_generation, \
+    get_current_generation, publish_generation, supports_generations
+from .core import CachePermissionError, InvalidData
+from .sources_list import CACHE_INDEX, SYSTEM_CACHE_PREFIX
+
+# name of the manifest in a bundle
+BUNDLE_MANIFEST = 'bundle.json'
+BUNDLE_VERSION = 1
+
+# chunk size for copying and hashing files
+_CHUNK_SIZE = 1024 * 1024
+
+
+def _compute_file_hash(filepath):
+    sha_hash = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            sha_hash.update(chunk)
+    return sha_hash.hexdigest()
+
+
+def _list_cache_files(sources_cache_dir):
+    """
+    :returns: paths of all files of the sources cache relative to
+      *sources_cache_dir*, ``[str]``.  Temporary files of writes in
+      progress are skipped.
+    """
+    names = []
+    for dirpath, dirnames, filenames in os.walk(sources_cache_dir):
+        for filename in filenames:
+            if '.tmp.' in filename:
+                continue
+            filepath = os.path.join(dirpath, filename)
+            if os.path.isfile(filepath):
+                names.append(os.path.relpath(filepath, sources_cache_dir).replace(os.sep, '/'))
+    return sorted(names)
+
+
+def _check_exportable(sources_cache_dir):
+    cache_index = os.path.join(sources_cache_dir, CACHE_INDEX)
+    try:
+        with open(cache_index, 'r') as f:
+            cache_data = f.read()
+    except (IOError, OSError):
+        raise InvalidData('no sources cache to export', origin=sources_cache_dir)
+    if any(line.startswith(SYSTEM_CACHE_PREFIX) for line in cache_data.splitlines()):
+        raise InvalidData('sources cache refers to the system cache, export the system cache instead', origin=cache_index)
+
+
+def export_cache_bundle(sources_cache_dir, filepath):
+    """
+    Write all files of the sources cache into the bundle *filepath*.
+
+    :returns: number of exported files
+    :raises: :exc:`InvalidData` if there is no sources cache or it
+      reads sources from the system cache, whose files would be
+      missing in the bundle
+    :raises: :exc:`CachePermissionError` if the bundle cannot be written
+    """
+    sources_cache_dir = get_current_generation(sources_cache_dir)
+    _check_exportable(sources_cache_dir)
+    names = _list_cache_files(sources_cache_dir)
+    files = {}
+    for name in names:
+        stat = os.stat(os.path.join(sources_cache_dir, name))
+        files[name] = {
+            'sha256': _compute_file_hash(os.path.join(sources_cache_dir, name)),
+            'mtime': stat.st_mtime,
+            # exact value, st_mtime loses precision
+            'mtime_ns': getattr(stat, 'st_mtime_ns', None),
+        }
+    manifest = json.dumps({'version': BUNDLE_VERSION, 'files': files}, indent=2, sort_keys=True).encode()
+
+    dirname = os.path.dirname(os.path.abspath(filepath))
+    try:
+        fd, filepath_tmp = tempfile.mkstemp(prefix=os.path.basename(filepath) + '.tmp.', dir=dirname)
+        os.close(fd)
+    except OSError as e:
+        raise CachePermissionError('Failed to write bundle: ' + str(e))
+    try:
+        with tarfile.open(filepath_tmp, 'w:gz') as tar:
+            info = tarfile.TarInfo(BUNDLE_MANIFEST)
+            info.size = len(manifest)
+            tar.addfile(info, io.BytesIO(manifest))
+            for name in names:
+                tar.add(os.path.join(sources_cache_dir, name), arcname=name, recursive=False)
+        os.rename(filepath_tmp, filepath)
+    except (IOError, OSError) as e:
+        try:
+            os.unlink(filepath_tmp)
+        except OSError:
+            pass
+        raise CachePermissionError('Failed to write bundle: ' + str(e))
+    return len(names)
+
+
+def _read_manifest(tar, origin):
+    try:
+        manifest = json.loads(tar.extractfile(BUNDLE_MANIFEST).read().decode())
+    except (KeyError, AttributeError, ValueError):
+        raise InvalidData('bundle has no valid manifest', origin=origin)
+    if not isinstance(manifest, dict) or manifest.get('version') != BUNDLE_VERSION or \
+            not isinstance(manifest.get('files'), dict):
+        raise InvalidData('unsupported bundle manifest', origin=origin)
+    for name in manifest['files']:
+        # never write outside of the cache directory
+        if os.path.isabs(name) or name != os.path.normpath(name).replace(os.sep, '/') or \
+                name.startswith('..') or name == BUNDLE_MANIFEST:
+            raise InvalidData('invalid file name in bundle: %s' % (name), origin=origin)
+    return manifest
+
+
+def _extract_file(tar, name, info, target_dir, origin):
+    try:
+        member = tar.getmember(name)
+    except KeyError:
+        raise InvalidData('file missing in bundle: %s' % (name), origin=origin)
+    if not member.isfile():
+        raise InvalidData('not a regular file in bundle: %s' % (name), origin=origin)
+    filepath = os.path.join(target_dir, *name.split('/'))
+    if not os.path.exists(os.path.dirname(filepath)):
+        os.makedirs(os.path.dirname(filepath))
+    sha_hash = hashlib.sha256()
+    src = tar.extractfile(member)
+    with open(filepath, 'wb') as f:
+        for chunk in iter(lambda: src.read(_CHUNK_SIZE), b''):
+            sha_hash.update(chunk)
+            f.write(chunk)
+    if sha_hash.hexdigest() != info.get('sha256'):
+        raise InvalidData('checksum mismatch for %s' % (name), origin=origin)
+    if info.get('mtime_ns') is not None:
+        try:
+            os.utime(filepath, ns=(info['mtime_ns'], info['mtime_ns']))
+            return
+        except TypeError:
+            # Python 2
+            pass
+    os.utime(filepath, (info['mtime'], info['mtime']))
+
+
+def _extract_bundle(filepath, target_dir):
+    try:
+        with tarfile.open(filepath, 'r:gz') as tar:
+            manifest = _read_manifest(tar, filepath)
+            for name, info in sorted(manifest['files'].items()):
+                _extract_file(tar, name, info, target_dir, filepath)
+    except (tarfile.TarError, EOFError) as e:
+        raise InvalidData('invalid bundle: %s' % (e), origin=filepath)
+    return len(manifest['files'])
+
+
+def _swap_dirs(new_dir, target_dir):
+    """
+    Move *new_dir* to *target_dir*, moving an existing *target_dir*
+    out of the way.
+
+    :returns: directory holding the previous *target_dir*, to be
+      removed by the caller, or ``None``
+    """
+    parent_dir, basename = os.path.split(target_dir)
+    old_dir = None
+    if os.path.exists(target_dir):
+        old_dir = tempfile.mkdtemp(prefix=basename + '.old.', dir=parent_dir)
+        os.rename(target_dir, os.path.join(old_dir, basename))
+    try:
+        os.rename(new_dir, target_dir)
+    except OSError:
+        if old_dir is not None:
+            # put the previous directory back
+            os.rename(os.path.join(old_dir, basename), target_dir)
+        raise
+    return old_dir
+
+
+def _import_generation(filepath, sources_cache_dir):
+    try:
+        with SourcesCacheLock(sources_cache_dir):
+            generation_dir = create_generation(sources_cache_dir, populate=False)
+            try:
+                count = _extract_bundle(filepath, generation_dir)
+                publish_generation(sources_cache_dir, generation_dir)
+            except BaseException:
+                discard_generation(generation_dir)
+                raise
+    except (IOError, OSError) as e:
+        raise CachePermissionError('Failed to write cache file: ' + str(e))
+    return count
+
+
+def import_cache_bundle(filepath, sources_cache_dir):
+    """
+    Replace the sources cache with the content of the bundle
+    *filepath*.  The bundle is extracted and verified into a new
+    generation of the sources cache, which is then published while
+    holding the update lock (see :mod:`rosdep2.cache_generations`).
+    Where generations are not supported, it is extracted next to the
+    sources cache, which is then swapped with the extracted directory.
+    The sources cache is left untouched if the bundle is invalid.
+
+    :returns: number of imported files
+    :raises: :exc:`InvalidData` if the bundle is invalid or corrupt
+    :raises: :exc:`CachePermissionError` if the cache cannot be written
+    """
+    if not os.path.isfile(filepath):
+        raise InvalidData('bundle does not exist', origin=filepath)
+    sources_cache_dir = os.path.abspath(sources_cache_dir)
+    if supports_generations():
+        return _import_generation(filepath, sources_cache_dir)
+    parent_dir, basename = os.path.split(sources_cache_dir)
+    try:
+        if not os.path.exists(parent_dir):
+            os.makedirs(parent_dir)
+        import_dir = tempfile.mkdtemp(prefix=basename + '.import.', dir=parent_dir)
+    except OSError as e:
+        raise CachePermissionError('Failed to write cache file: ' + str(e))
+    old_dir = None
+    try:
+        count = _extract_bundle(filepath, import_dir)
+        # mkdtemp creates the directory only accessible by the owner
+        os.chmod(import_dir, 0o755)
+        old_dir = _swap_dirs(import_dir, sources_cache_dir)
+    except (IOError, OSError) as e:
+        raise CachePermissionError('Failed to write cache file: ' + str(e))
+    finally:
+        shutil.rmtree(import_dir, ignore_errors=True)
+        if old_dir is not None:
+            shutil.rmtree(old_dir, ignore_errors=True)
+    return count
@@ -0,0 +1,238 @@
+# Copyright (c) 2019, Open Source Robotics Foundation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Willow Garage, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Locking and generations of the sources cache.
+
+``rosdep update`` writes each new version of the sources cache into a
+separate generation directory next to it, and then atomically points
+the sources cache path, a symlink, at the new generation.  Readers
+which resolve the symlink once (see :func:`get_current_generation`)
+see a consistent cache even while an update runs.  Updates hold an
+exclusive lock, so that concurrent updates of a shared cache wait for
+each other instead of repeating the same downloads.
+
+Where ``fcntl`` is not available (Windows), the sources cache is
+updated in place, without locking.
+"""
+
+import errno
+import os
+import shutil
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# suffix of the directory holding the generations of a sources cache
+GENERATIONS_SUFFIX = '.generations'
+# suffix of the lock file of a sources cache
+LOCK_SUFFIX = '.lock'
+
+
+def supports_generations():
+    """
+    :returns: ``True`` if the sources cache can be locked and updated
+        in generations on this platform
+    """
+    return fcntl is not None and hasattr(os, 'symlink')
+
+
+def get_current_generation(sources_cache_dir):
+    """
+    :returns: directory of the current generation of the sources
+        cache.  Its content does not change when later updates publish
+        new generations.
+    """
+    return os.path.realpath(sources_cache_dir)
+
+
+class SourcesCacheLock(object):
+    """
+    Exclusive lock of a sources cache, held by the process writing it.
+    The lock file is stored next to the sources cache, as the sources
+    cache itself is replaced on update.
+    """
+
+    def __init__(self, sources_cache_dir):
+        self.filepath = os.path.abspath(sources_cache_dir) + LOCK_SUFFIX
+        #: ``True`` if acquiring the lock had to wait for another process
+        self.waited = False
+        self._fd = None
+
+    def acquire(self):
+        """
+        Acquire the lock, waiting for another process holding it.
+
+        :raises: :exc:`OSError` if the lock file cannot be created
+        """
+        parent_dir = os.path.dirname(self.filepath)
+        if not os.path.exists(parent_dir):
+            os.makedirs(parent_dir)
+        self._fd = os.open(self.filepath, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                self.release()
+                raise
+            print('Waiting for another update of the sources cache to finish')
+            self.waited = True
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def release(self):
+        if self._fd is not None:
+            # closing the file releases the lock
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def _link_tree(src_dir, dst_dir):
+    for name in os.listdir(src_dir):
+        src = os.path.join(src_dir, name)
+        dst = os.path.join(dst_dir, name)
+        if os.path.isdir(src):
+            os.mkdir(dst)
+            _link_tree(src, dst)
+            continue
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+
+def create_generation(sources_cache_dir, populate=True):
+    """
+    Create the directory of a new generation of the sources cache.
+    Cache files are always replaced by renaming, never modified in
+    place, so the new generation can share the unchanged files of the
+    current one through hard links.
+
+    :param populate: link the files of the current generation into the
+        new one
+    :returns: path of the new generation directory
+    :raises: :exc:`OSError` if the directory cannot be created
+    """
+    sources_cache_dir = os.path.abspath(sources_cache_dir)
+    generations_dir = sources_cache_dir + GENERATIONS_SUFFIX
+    if not os.path.exists(generations_dir):
+        os.makedirs(generations_dir)
+    generation_dir = tempfile.mkdtemp(prefix='gen-', dir=generations_dir)
+    # mkdtemp creates the directory only accessible by the owner
+    os.chmod(generation_dir, 0o755)
+    if populate and os.path.isdir(sources_cache_dir):
+        try:
+            _link_tree(get_current_generation(sources_cache_dir), generation_dir)
+        except (IOError, OSError):
+            discard_generation(generation_dir)
+            raise
+    return generation_dir
+
+
+def discard_generation(generation_dir):
+    """
+    Remove a generation directory which has not been published.
+    """
+    shutil.rmtree(generation_dir, ignore_errors=True)
+
+
+def _get_generation_name(generations_dir, path):
+    return os.path.relpath(path, generations_dir).split(os.sep)[0]
+
+
+def _replace_in_place(generation_dir, target_dir):
+    # file by file, like the cache was updated before generations
+    names = os.listdir(generation_dir)
+    for name in os.listdir(target_dir):
+        if name not in names:
+            # removed by the update, e.g. the shards of a distribution
+            path = os.path.join(target_dir, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+    for name in names:
+        src = os.path.join(generation_dir, name)
+        dst = os.path.join(target_dir, name)
+        if os.path.isdir(src):
+            if not os.path.isdir(dst):
+                os.mkdir(dst)
+            _replace_in_place(src, dst)
+            continue
+        dst_tmp = dst + '.tmp.%d' % os.getpid()
+        shutil.copy2(src, dst_tmp)
+        os.rename(dst_tmp, dst)
+
+
+def publish_generation(sources_cache_dir, generation_dir):
+    """
+    Atomically make *generation_dir* the current generation of the
+    sources cache.  Older generations are removed, except for the
+    previous one, which readers may still be using.
+
+    A sources cache directory that cannot be moved (e.g. a mount
+    point) is updated in place instead, and the generation is removed.
+
+    :raises: :exc:`OSError` if the sources cache cannot be replaced
+    """
+    sources_cache_dir = os.path.abspath(sources_cache_dir)
+    generations_dir = sources_cache_dir + GENERATIONS_SUFFIX
+    parent_dir, basename = os.path.split(sources_cache_dir)
+    keep = [_get_generation_name(generations_dir, generation_dir)]
+    if os.path.islink(sources_cache_dir):
+        keep.append(_get_generation_name(generations_dir, get_current_generation(sources_cache_dir)))
+    elif os.path.isdir(sources_cache_dir):
+        # a cache written in place can only be moved out of the way
+        # before the symlink replaces it
+        legacy_dir = tempfile.mkdtemp(prefix='legacy-', dir=generations_dir)
+        try:
+            os.rename(sources_cache_dir, os.path.join(legacy_dir, basename))
+        except OSError:
+            shutil.rmtree(legacy_dir, ignore_errors=True)
+            _replace_in_place(generation_dir, sources_cache_dir)
+            discard_generation(generation_dir)
+            return
+        keep.append(_get_generation_name(generations_dir, legacy_dir))
+
+    link_tmp = os.path.join(parent_dir, '%s.tmp.%d' % (basename, os.getpid()))
+    if os.path.lexists(link_tmp):
+        os.unlink(link_tmp)
+    os.symlink(os.path.relpath(generation_dir, parent_dir), link_tmp)
+    os.rename(link_tmp, sources_cache_dir)
+
+    for name in os.listdir(generations_dir):
+        if name not in keep:
+            shutil.rmtree(os.path.join(generations_dir, name), ignore_errors=True)
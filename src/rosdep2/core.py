@@ -29,6 +29,7 @@ from __future__ import print_function
 
 import os
 import sys
+import tempfile
 import traceback
 
 
@@ -48,6 +49,45 @@ def print_bold(msg):
         print('\033[1m%s\033[0m' % msg)
 
 
+def add_stats(stats, **values):
+    """
+    Add *values* to the counters of the same name in *stats*.
+
+    :param stats: ``dict`` of counters, or ``None`` to not count
+    """
+    if stats is not None:
+        for name, value in values.items():
+            stats[name] = stats.get(name, 0) + value
+
+
+def write_atomic(filepath, data, binary=False):
+    # write data to new file
+    fd, filepath_tmp = tempfile.mkstemp(prefix=os.path.basename(filepath) + '.tmp.', dir=os.path.dirname(filepath))
+
+    if (binary):
+        fmode = 'wb'
+    else:
+        fmode = 'w'
+
+    with os.fdopen(fd, fmode) as f:
+        f.write(data)
+        f.close()
+
+    try:
+        # switch file atomically (if supported)
+        os.rename(filepath_tmp, filepath)
+    except OSError:
+        # fall back to non-atomic operation
+        try:
+            os.unlink(filepath)
+        except OSError:
+            pass
+        try:
+            os.rename(filepath_tmp, filepath)
+        except OSError:
+            os.unlink(filepath_tmp)
+
+
 class InvalidData(Exception):
     """
     Data is not in valid rosdep format.
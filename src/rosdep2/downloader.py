@@ -0,0 +1,723 @@
+# Copyright (c) 2019, Open Source Robotics Foundation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Willow Garage, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Downloads of rosdep data over HTTP(S).
+
+All downloads of a rosdep process share one pool of keep-alive
+connections, so that fetching many files from the same host (e.g. the
+sources and the rosdistro files on raw.githubusercontent.com) only pays
+for the TCP and TLS handshakes once.  Proxies are taken from the
+``http_proxy``, ``https_proxy`` and ``no_proxy`` environment variables.
+Responses are requested gzip or deflate compressed and decompressed
+while they are received.  URLs with other schemes (e.g. ``file://``) are opened with urllib.
+
+Content available from several mirrors is downloaded with
+:func:`urlopen_mirrors`, which prefers the mirror with the lowest
+latency seen so far and sends a hedged request to the next mirror if
+the first one does not respond within its usual latency.
+"""
+
+import base64
+import hashlib
+import io
+import socket
+import threading
+import time
+import zlib
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # py2
+
+try:
+    from urllib.request import getproxies, proxy_bypass
+    from urllib.request import urlopen as _urllib_urlopen
+    from urllib.request import Request
+    from urllib.error import HTTPError
+    from urllib.error import URLError
+except ImportError:
+    from urllib import getproxies, proxy_bypass
+    from urllib2 import urlopen as _urllib_urlopen
+    from urllib2 import Request
+    from urllib2 import HTTPError
+    from urllib2 import URLError
+
+try:
+    import urlparse
+except ImportError:
+    import urllib.parse as urlparse  # py3k
+
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib  # py3k
+
+from ._version import __version__
+from .core import add_stats
+
+# seconds to wait before aborting a download
+DOWNLOAD_TIMEOUT = 15.0
+
+MAX_REDIRECTS = 10
+
+# idle connections kept per host
+MAX_IDLE_CONNECTIONS = 4
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+USER_AGENT = 'rosdep/%s' % __version__
+
+ACCEPT_ENCODING = 'gzip, deflate'
+
+# bytes read from a response at a time
+READ_CHUNK_SIZE = 64 * 1024
+
+# seconds to wait for the response of a mirror without latency
+# measurements before sending a hedged request to the next mirror
+DEFAULT_HEDGE_DELAY = 2.0
+# lower bound of the adaptive hedge delay, in seconds
+MIN_HEDGE_DELAY = 0.1
+# weights of the latest measurement in the smoothed latency and its
+# deviation, as for the TCP retransmission timeout (RFC 6298)
+LATENCY_ALPHA = 0.125
+LATENCY_BETA = 0.25
+
+
+class Response(object):
+    """
+    Completely read response of a download.  Provides the subset of
+    the interface of the objects returned by urllib's ``urlopen`` that
+    rosdep uses.
+    """
+
+    def __init__(self, url, code, headers, data):
+        self.url = url
+        self.code = code
+        self.headers = headers
+        self._data = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self._data.read(size)
+
+    def info(self):
+        return self.headers
+
+    def getcode(self):
+        return self.code
+
+    def geturl(self):
+        return self.url
+
+    def close(self):
+        self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _get_proxy(scheme, host):
+    """
+    :returns: URL of the proxy to use for *host*, or ``None``
+    """
+    proxy = getproxies().get(scheme)
+    if not proxy or proxy_bypass(host):
+        return None
+    if '://' not in proxy:
+        proxy = 'http://' + proxy
+    return proxy
+
+
+def _get_proxy_headers(proxy):
+    """
+    :returns: headers authenticating with *proxy*, ``dict``
+    """
+    parsed = urlparse.urlsplit(proxy)
+    if parsed.username is None:
+        return {}
+    credentials = '%s:%s' % (urlparse.unquote(parsed.username), urlparse.unquote(parsed.password or ''))
+    token = base64.b64encode(credentials.encode('utf-8')).decode('ascii')
+    return {'Proxy-Authorization': 'Basic ' + token}
+
+
+def _create_connection(scheme, host, port, proxy, timeout):
+    if proxy is None:
+        connection_class = httplib.HTTPSConnection if scheme == 'https' else httplib.HTTPConnection
+        return connection_class(host, port, timeout=timeout)
+    parsed = urlparse.urlsplit(proxy)
+    proxy_port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    if scheme == 'https':
+        # tunnel through the proxy with CONNECT
+        connection = httplib.HTTPSConnection(parsed.hostname, proxy_port, timeout=timeout)
+        connection.set_tunnel(host, port, headers=_get_proxy_headers(proxy))
+        return connection
+    return httplib.HTTPConnection(parsed.hostname, proxy_port, timeout=timeout)
+
+
+def _create_decompressor(content_encoding):
+    """
+    :returns: ``zlib`` decompression object for *content_encoding*, or
+      ``None`` if the content is not encoded
+    :raises: :exc:`ValueError` for unsupported encodings
+    """
+    encoding = (content_encoding or 'identity').strip().lower()
+    if encoding == 'identity':
+        return None
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        return _DeflateDecompressor()
+    raise ValueError('unsupported Content-Encoding: %s' % content_encoding)
+
+
+class _DeflateDecompressor(object):
+    """
+    Decompressor for the deflate content encoding, which some servers
+    send as raw deflate data instead of the zlib format.
+    """
+
+    def __init__(self):
+        self._decompressor = zlib.decompressobj()
+        # data received until zlib has checked the header, ``None``
+        # once the format is known
+        self._received = b''
+
+    def decompress(self, data):
+        if self._received is None:
+            return self._decompressor.decompress(data)
+        self._received += data
+        try:
+            result = self._decompressor.decompress(data)
+        except zlib.error:
+            # not in the zlib format, decompress all of it as raw deflate data
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            result = self._decompressor.decompress(self._received)
+            self._received = None
+            return result
+        if len(self._received) >= 2:
+            # the zlib header is two bytes long
+            self._received = None
+        return result
+
+    def flush(self):
+        return self._decompressor.flush()
+
+
+def _read_body(response):
+    """
+    Read the body of *response*, decompressing it while it is
+    received.
+
+    :returns: (data, received bytes) tuple
+    :raises: :exc:`ValueError` if the body cannot be decoded
+    """
+    decompressor = _create_decompressor(response.getheader('Content-Encoding'))
+    chunks = []
+    received = 0
+    while True:
+        chunk = response.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        received += len(chunk)
+        chunks.append(decompressor.decompress(chunk) if decompressor is not None else chunk)
+    if decompressor is not None:
+        try:
+            chunks.append(decompressor.flush())
+        except zlib.error as e:
+            raise ValueError(str(e))
+    return b''.join(chunks), received
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe pool of keep-alive HTTP(S) connections, keyed by scheme,
+    host, port and proxy.
+    """
+
+    def __init__(self, max_idle=MAX_IDLE_CONNECTIONS):
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}  # {(scheme, host, port, proxy): [connection]}
+        self.requests = 0
+        self.connections = 0
+        self.reused = 0
+
+    def get_stats(self):
+        """
+        :returns: dictionary with the number of ``requests`` made, the
+          number of ``connections`` opened and the number of requests
+          that ``reused`` an open connection.
+        """
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'connections': self.connections,
+                'reused': self.reused,
+            }
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def _acquire(self, key, timeout):
+        """
+        :returns: (connection, reused) tuple
+        """
+        with self._lock:
+            connections = self._idle.get(key)
+            if connections:
+                self.reused += 1
+                return connections.pop(), True
+            self.connections += 1
+        return _create_connection(key[0], key[1], key[2], key[3], timeout), False
+
+    def _release(self, key, connection):
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self.max_idle:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def _request_once(self, url, headers, timeout, stats, on_response):
+        """
+        Send a single GET request, without following redirects.
+
+        :returns: (response, reason) tuple
+        :raises: :exc:`URLError` if the server cannot be reached
+        """
+        parsed = urlparse.urlsplit(url)
+        scheme = parsed.scheme
+        port = parsed.port or (443 if scheme == 'https' else 80)
+        proxy = _get_proxy(scheme, parsed.hostname)
+        key = (scheme, parsed.hostname, port, proxy)
+        request_headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': ACCEPT_ENCODING}
+        request_headers.update(headers)
+        if proxy is not None and scheme == 'http':
+            # plain HTTP proxies expect the absolute URL
+            path = urlparse.urlunsplit((scheme, parsed.netloc, parsed.path or '/', parsed.query, ''))
+            request_headers.update(_get_proxy_headers(proxy))
+        else:
+            path = urlparse.urlunsplit(('', '', parsed.path or '/', parsed.query, ''))
+
+        while True:
+            connection, reused = self._acquire(key, timeout)
+            try:
+                start = time.time()
+                if connection.sock is None:
+                    connection.connect()
+                    add_stats(stats, connect_time=time.time() - start)
+                    start = time.time()
+                else:
+                    connection.sock.settimeout(timeout)
+                connection.request('GET', path, headers=request_headers)
+                response = connection.getresponse()
+                if on_response is not None:
+                    on_response()
+                data, received = _read_body(response)
+                add_stats(stats, transfer_time=time.time() - start, requests=1, bytes=received)
+            except (zlib.error, ValueError) as e:
+                connection.close()
+                raise URLError('invalid response from %s: %s' % (parsed.netloc, e))
+            except (httplib.HTTPException, socket.error) as e:
+                connection.close()
+                # the server may have closed an idle connection,
+                # retry on a new one
+                if reused and not isinstance(e, socket.timeout):
+                    continue
+                raise URLError(e)
+            with self._lock:
+                self.requests += 1
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(key, connection)
+            return Response(url, response.status, response.msg, data), response.reason
+
+    def request(self, url, headers=None, timeout=DOWNLOAD_TIMEOUT, stats=None, on_response=None):
+        """
+        Download *url*, following redirects.
+
+        :param headers: additional request headers, ``dict``
+        :param stats: ``dict`` to add the ``connect_time`` and
+            ``transfer_time`` (in seconds), the number of ``requests``
+            and the ``bytes`` received to, see :func:`add_stats`.
+            Compressed responses count with their compressed size.
+        :param on_response: function called without arguments when the
+            headers of a response are received, before its body
+        :returns: :class:`Response` of a successful (2xx) request,
+          with the body already decompressed
+        :raises: :exc:`HTTPError` for any other HTTP status (including
+          ``304 Not Modified``)
+        :raises: :exc:`URLError` if the server cannot be reached
+        """
+        headers = headers or {}
+        for _ in range(MAX_REDIRECTS + 1):
+            response, reason = self._request_once(url, headers, timeout, stats, on_response)
+            location = response.headers.get('Location')
+            if response.code in REDIRECT_CODES and location:
+                url = urlparse.urljoin(url, location)
+                continue
+            break
+        else:
+            reason = 'too many redirects'
+        if not 200 <= response.code < 300 or response.code in REDIRECT_CODES:
+            raise HTTPError(url, response.code, reason, response.headers, io.BytesIO(response.read()))
+        return response
+
+
+_pool = ConnectionPool()
+
+
+def get_connection_pool():
+    """
+    :returns: the :class:`ConnectionPool` shared by all downloads
+    """
+    return _pool
+
+
+def urlopen(url, headers=None, timeout=DOWNLOAD_TIMEOUT, stats=None, on_response=None):
+    """
+    Download *url*, reusing pooled connections for HTTP(S) URLs.
+
+    :param headers: additional request headers, ``dict``
+    :param stats: ``dict`` to add measurements to, see
+        :meth:`ConnectionPool.request`
+    :param on_response: function called when the response headers are
+        received, see :meth:`ConnectionPool.request`
+    :returns: file-like :class:`Response`
+    :raises: :exc:`HTTPError`, :exc:`URLError`
+    """
+    if urlparse.urlsplit(url).scheme in ('http', 'https'):
+        return _pool.request(url, headers=headers, timeout=timeout, stats=stats, on_response=on_response)
+    start = time.time()
+    f = _urllib_urlopen(Request(url, headers=headers or {}), timeout=timeout)
+    if on_response is not None:
+        on_response()
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    add_stats(stats, transfer_time=time.time() - start, requests=1, bytes=len(data))
+    return Response(f.geturl(), f.getcode(), f.info(), data)
+
+
+def get_mirror_key(url):
+    """
+    :returns: name of the mirror serving *url*, its scheme and host
+    """
+    parsed = urlparse.urlsplit(url)
+    return '%s://%s' % (parsed.scheme, parsed.netloc)
+
+
+class MirrorSelector(object):
+    """
+    Thread-safe record of the latency of mirrors, i.e. the time until
+    the headers of their responses are received, as smoothed mean and
+    mean deviation.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = {}  # {mirror key: (smoothed latency, deviation)}
+
+    def record(self, url, latency):
+        """
+        Record a *latency* (in seconds) of the mirror serving *url*.
+        Requests which got no response or an error response should be
+        recorded with the timeout.
+        """
+        key = get_mirror_key(url)
+        with self._lock:
+            if key not in self._latencies:
+                self._latencies[key] = (latency, latency / 2.0)
+                return
+            smoothed, deviation = self._latencies[key]
+            deviation = (1 - LATENCY_BETA) * deviation + LATENCY_BETA * abs(smoothed - latency)
+            smoothed = (1 - LATENCY_ALPHA) * smoothed + LATENCY_ALPHA * latency
+            self._latencies[key] = (smoothed, deviation)
+
+    def get_latency(self, url):
+        """
+        :returns: smoothed latency of the mirror serving *url* in
+          seconds, or ``None`` if it was not measured yet
+        """
+        with self._lock:
+            latency = self._latencies.get(get_mirror_key(url))
+        return latency[0] if latency is not None else None
+
+    def order(self, urls):
+        """
+        :returns: *urls* ordered by the latency of their mirrors, the
+          fastest first.  Mirrors which were not measured yet come
+          first, in the given order, so that each of them is tried.
+        """
+        positions = dict((url, i) for i, url in reversed(list(enumerate(urls))))
+        return sorted(urls, key=lambda url: (self.get_latency(url) or 0.0, positions[url]))
+
+    def get_hedge_delay(self, url, timeout=DOWNLOAD_TIMEOUT):
+        """
+        :returns: seconds to wait for a response of the mirror serving
+          *url* before sending a hedged request to another mirror
+        """
+        with self._lock:
+            latency = self._latencies.get(get_mirror_key(url))
+        if latency is None:
+            delay = DEFAULT_HEDGE_DELAY
+        else:
+            delay = latency[0] + 4 * latency[1]
+        return min(max(delay, MIN_HEDGE_DELAY), timeout)
+
+    def get_state(self):
+        """
+        :returns: JSON-serializable latencies, see :meth:`set_state`
+        """
+        with self._lock:
+            return dict((key, list(value)) for key, value in self._latencies.items())
+
+    def set_state(self, state):
+        """
+        Restore latencies returned by :meth:`get_state`, e.g. of a
+        previous process.  Invalid entries are ignored.
+        """
+        latencies = {}
+        for key, value in (state or {}).items():
+            try:
+                latencies[key] = (float(value[0]), float(value[1]))
+            except (TypeError, ValueError, IndexError):
+                continue
+        with self._lock:
+            self._latencies.update(latencies)
+
+
+_mirror_selector = MirrorSelector()
+
+
+def get_mirror_selector():
+    """
+    :returns: the :class:`MirrorSelector` shared by all downloads
+    """
+    return _mirror_selector
+
+
+class _HedgedDownload(object):
+    """
+    Download of the same content from a list of mirrors.  Requests run
+    in worker threads.  The first successful response wins, a request
+    which is still running is left to finish in the background.
+    """
+
+    def __init__(self, selector, headers, timeout, stats, mirror_headers=None):
+        self.selector = selector
+        self.headers = headers
+        self.mirror_headers = mirror_headers or {}
+        self.timeout = timeout
+        self.stats = stats
+        self._results = queue.Queue()
+
+    def get_headers(self, url):
+        """
+        :returns: request headers for the mirror *url*, ``dict``
+        """
+        headers = dict(self.headers or {})
+        headers.update(self.mirror_headers.get(url, {}))
+        return headers
+
+    def _start(self, url):
+        """
+        :returns: ``threading.Event`` set once the mirror responded
+        """
+        responded = threading.Event()
+        thread = threading.Thread(target=self._fetch, args=(url, responded))
+        thread.daemon = True
+        thread.start()
+        return responded
+
+    def _fetch(self, url, responded):
+        start = time.time()
+        stats = {}
+        latencies = []
+
+        def on_response():
+            latencies.append(time.time() - start)
+            responded.set()
+        try:
+            response = urlopen(url, headers=self.get_headers(url), timeout=self.timeout, stats=stats, on_response=on_response)
+        except URLError as e:
+            # 304 Not Modified is a valid answer to a conditional request
+            if getattr(e, 'code', None) == 304:
+                self.selector.record(url, latencies[0] if latencies else time.time() - start)
+            else:
+                # unreachable or failing, make the mirror the last choice
+                self.selector.record(url, self.timeout)
+            self._results.put((None, e, stats))
+            return
+        # only the latency of successful responses counts, a mirror
+        # which quickly answers with errors is no good choice
+        self.selector.record(url, latencies[0])
+        response.mirror_url = url
+        self._results.put((response, None, stats))
+
+    def run(self, urls):
+        remaining = list(urls)
+        url = remaining.pop(0)
+        responded = self._start(url)
+        pending = 1
+        error = None
+        while pending:
+            delay = None
+            if remaining and not responded.is_set():
+                delay = self.selector.get_hedge_delay(url, self.timeout)
+            try:
+                response, error, stats = self._results.get(timeout=delay)
+            except queue.Empty:
+                if not responded.is_set():
+                    # slower than usual, ask the next mirror as well
+                    url = remaining.pop(0)
+                    responded = self._start(url)
+                    pending += 1
+                    add_stats(self.stats, hedged=1)
+                continue
+            pending -= 1
+            add_stats(self.stats, **stats)
+            # 304 Not Modified is a valid answer to a conditional request
+            if error is None or getattr(error, 'code', None) == 304:
+                break
+            if not pending and remaining:
+                # fail over to the next mirror
+                url = remaining.pop(0)
+                responded = self._start(url)
+                pending = 1
+        if error is not None:
+            raise error
+        return response
+
+
+def urlopen_mirrors(urls, headers=None, timeout=DOWNLOAD_TIMEOUT, stats=None, mirror_headers=None):
+    """
+    Download the same content from one of the mirrors *urls*.  The
+    mirrors are tried in the order of their latency (see
+    :class:`MirrorSelector`).  If a mirror does not respond within its
+    usual latency, a hedged request is sent to the next one and the
+    first response is used.  If a mirror fails, the next one is tried.
+
+    :param urls: URLs of the content on each mirror, ``[str]``
+    :param stats: ``dict`` to add measurements to, see
+        :meth:`ConnectionPool.request`, and the number of ``hedged``
+        requests
+    :param mirror_headers: additional request headers for the
+        mirrors by URL, ``{str: dict}``
+    :returns: file-like :class:`Response`, with the URL of the mirror
+        which answered as ``mirror_url``
+    :raises: :exc:`HTTPError`, :exc:`URLError` of the last mirror
+      tried, if no mirror succeeded
+    """
+    download = _HedgedDownload(_mirror_selector, headers, timeout, stats, mirror_headers)
+    if len(urls) == 1:
+        response = urlopen(urls[0], headers=download.get_headers(urls[0]), timeout=timeout, stats=stats)
+        response.mirror_url = urls[0]
+        return response
+    return download.run(_mirror_selector.order(urls))
+
+
+def get_conditional_headers(cache_meta):
+    """
+    :returns: HTTP request headers for revalidating a previous
+        download described by *cache_meta*, ``dict``
+    """
+    headers = {}
+    if cache_meta:
+        if cache_meta.get('etag'):
+            headers['If-None-Match'] = cache_meta['etag']
+        if cache_meta.get('last_modified'):
+            headers['If-Modified-Since'] = cache_meta['last_modified']
+    return headers
+
+
+def download_if_modified(url, cache_meta=None, timeout=DOWNLOAD_TIMEOUT, stats=None, mirrors=None):
+    """
+    Download *url*, sending a conditional request based on the
+    validators of a previous download.
+
+    The validators are only sent to the mirror which produced them,
+    the content downloaded from other mirrors is compared by digest.
+
+    :param cache_meta: metadata of a previous download as returned by
+        this function, or ``None`` to download unconditionally
+    :param stats: ``dict`` to add measurements to, see
+        :meth:`ConnectionPool.request`
+    :param mirrors: URLs of the same content on other mirrors, to
+        download from with :func:`urlopen_mirrors`
+    :returns: (data, cache_meta) tuple.  *data* is ``None`` if the
+        server reports that the content has not been modified since
+        the previous download, or if the downloaded content is
+        identical to it.
+    :raises: :exc:`HTTPError`, :exc:`URLError`
+    """
+    urls = [url] + list(mirrors or [])
+    headers = get_conditional_headers(cache_meta)
+    mirror_headers = {}
+    if headers:
+        # metadata written before validators were keyed by mirror
+        # comes from *url*
+        validated_mirror = cache_meta.get('mirror') or get_mirror_key(cache_meta.get('url') or url)
+        mirror_headers = dict((u, headers) for u in urls if get_mirror_key(u) == validated_mirror)
+    try:
+        f = urlopen_mirrors(urls, timeout=timeout, stats=stats, mirror_headers=mirror_headers)
+    except HTTPError as e:
+        if e.code == 304 and mirror_headers:
+            return None, cache_meta
+        raise
+    try:
+        data = f.read()
+        info = f.info()
+    finally:
+        f.close()
+    new_cache_meta = {
+        'url': url,
+        'mirror': get_mirror_key(f.mirror_url),
+        'etag': info.get('ETag'),
+        'last_modified': info.get('Last-Modified'),
+        'content_length': len(data),
+        'digest': hashlib.sha256(data).hexdigest(),
+    }
+    # servers without validators (and file:// mirrors) resend
+    # identical content, which does not need to be processed again
+    if cache_meta and cache_meta.get('digest') == new_cache_meta['digest']:
+        return None, new_cache_meta
+    return data, new_cache_meta
@@ -1,7 +1,3 @@
-try:
-    from urllib.request import urlopen
-except ImportError:
-    from urllib2 import urlopen
 import yaml
 try:
     import urlparse
@@ -15,6 +11,7 @@ from rospkg.os_detect import OS_OSX
 from rospkg.os_detect import OS_UBUNTU
 
 from .core import InvalidData, DownloadFailure
+from .downloader import urlopen
 from .platforms.debian import APT_INSTALLER
 from .platforms.osx import BREW_INSTALLER
 from .platforms.redhat import YUM_INSTALLER
@@ -142,42 +139,54 @@ def gbprepo_to_rosdep_data(gbpdistro_data, targets_data, url=''):
 
 # REP137 compliant
 
-def get_gbprepo_as_rosdep_data(gbpdistro):
+def get_gbprepo_as_rosdep_data(gbpdistro, platforms=None):
     """
+    :param platforms: OS names to generate rules for, ``[str]``.
+      Defaults to all platforms of the distribution and OS X.
     :raises: :exc:`InvalidData`
     """
     distro_file = get_release_file(gbpdistro)
     ctx = create_default_installer_context()
     release_name = gbpdistro
 
+    os_names = [os_name for os_name in distro_file.platforms
+                if platforms is None or os_name in platforms]
     rosdep_data = {}
     default_installers = {}
     gbp_repos = distro_file.repositories
     for rosdep_key, repo in gbp_repos.items():
-        for pkg in repo.package_names:
-            rosdep_data[pkg] = {}
-
+        # rules that do not depend on the package are shared by all
+        # packages of the repository
+        osx_rules = None
+        if platforms is None or OS_OSX in platforms:
             # following rosdep pull #17, use env var instead of github organization name
             tap = os.environ.get('ROSDEP_HOMEBREW_TAP', 'ros')
             # Do generation for empty OS X entries
             homebrew_name = '%s/%s/%s' % (tap, release_name, rosdep_key)
-            rosdep_data[pkg][OS_OSX] = {
+            osx_rules = {
                 BREW_INSTALLER: {'packages': [homebrew_name]}
             }
 
+        for pkg in repo.package_names:
+            rosdep_data[pkg] = {}
+            if osx_rules is not None:
+                rosdep_data[pkg][OS_OSX] = osx_rules
+
             # - package name: underscores must be dashes
             package_name = 'ros-%s-%s' % (release_name, pkg)
             package_name = package_name.replace('_', '-')
 
-            for os_name in distro_file.platforms:
+            for os_name in os_names:
                 if os_name not in rosdep_data[pkg]:
                     rosdep_data[pkg][os_name] = {}
                 if os_name not in default_installers:
                     default_installers[os_name] = ctx.get_default_os_installer_key(os_name)
+                # the rule is the same for all codenames of the OS
+                rule = {
+                    default_installers[os_name]: {'packages': [package_name]}
+                }
                 for os_code_name in distro_file.platforms[os_name]:
-                    rosdep_data[pkg][os_name][os_code_name] = {
-                        default_installers[os_name]: {'packages': [package_name]}
-                    }
+                    rosdep_data[pkg][os_name][os_code_name] = rule
 
             rosdep_data[pkg]['_is_ros'] = True
     return rosdep_data
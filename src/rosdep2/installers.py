@@ -29,6 +29,7 @@
 
 from __future__ import print_function
 
+import hashlib
 import os
 import subprocess
 import traceback
@@ -243,6 +244,24 @@ class InstallerContext(object):
         except KeyError:
             return None
 
+    def get_platform_fingerprint(self):
+        """
+        Get a fingerprint of the configuration used to resolve rosdep
+        keys in this context: the OS name and version, the installers
+        registered for the OS, the default OS installer and the keys of
+        all registered installers.  Data precomputed for one context is
+        only valid for contexts with the same fingerprint.
+
+        :returns: hex digest, ``str``
+        :raises: :exc:`KeyError`: if no information for the OS is registered.
+        """
+        os_name, os_version = self.get_os_name_and_version()
+        data = repr((os_name, os_version,
+                     self.get_os_installer_keys(os_name),
+                     self.get_default_os_installer_key(os_name),
+                     sorted(self.get_installer_keys())))
+        return hashlib.sha1(data.encode()).hexdigest()
+
 
 class Installer(object):
     """
@@ -400,7 +419,8 @@ class PackageManagerInstaller(Installer):
           dependencies.
         """
         if self.supports_depends and type(rosdep_args) == dict:
-            return rosdep_args.get('depends', [])
+            # copy, the rule data may be shared with other rules
+            return list(rosdep_args.get('depends', []))
         return []  # Default return empty list
 
 
@@ -32,7 +32,7 @@ from __future__ import print_function
 import sys
 import yaml
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 from rospkg import RosPack, RosStack, ResourceNotFound
 
@@ -46,6 +46,10 @@ from .sources_list import SourcesListLoader
 from . import catkin_packages
 
 
+# maximum number of results cached by RosdepLookup.resolve
+DEFAULT_RESOLVE_CACHE_SIZE = 10000
+
+
 class RosdepDefinition(object):
     """
     Single rosdep dependency definition.  This data is stored as the
@@ -66,6 +70,8 @@ class RosdepDefinition(object):
             raise InvalidData('rosdep data for [%s] must be a dictionary' % (self.rosdep_key), origin=origin)
         self.data = data
         self.origin = origin
+        # {(os_name, os_version, installer_keys, default_installer_key): (installer_key, rule)}
+        self._rule_cache = {}
 
     def reverse_merge(self, new_data, origin='<dynamic>', verbose=False):
         """
@@ -81,9 +87,19 @@ class RosdepDefinition(object):
                 if verbose:
                     print('[%s] adding rules for os [%s] to [%s]' % (origin, os_name, self.rosdep_key), file=sys.stderr)
                 self.data[os_name] = rules
+                self._rule_cache.clear()
             elif verbose:
                 print('[%s] ignoring [%s] for os [%s], already loaded' % (origin, self.rosdep_key, os_name), file=sys.stderr)
 
+    def set_rule_for_platform(self, os_name, os_version, installer_keys, default_installer_key, rule):
+        """
+        Set the result of :meth:`get_rule_for_platform` for the
+        specified platform, e.g. from a precomputed table.
+
+        :param rule: (installer_key, rosdep_args_dict), ``(str, dict)``
+        """
+        self._rule_cache[(os_name, os_version, tuple(installer_keys), default_installer_key)] = rule
+
     def get_rule_for_platform(self, os_name, os_version, installer_keys, default_installer_key):
         """
         Get installer_key and rule for the specified rule.  See REP 111 for precedence rules.
@@ -97,6 +113,12 @@ class RosdepDefinition(object):
         :raises: :exc:`ResolutionError` If no rule is available
         :raises: :exc:`InvalidData` If rule data is not valid
         """
+        cache_key = (os_name, os_version, tuple(installer_keys), default_installer_key)
+        if cache_key not in self._rule_cache:
+            self._rule_cache[cache_key] = self._get_rule_for_platform(os_name, os_version, installer_keys, default_installer_key)
+        return self._rule_cache[cache_key]
+
+    def _get_rule_for_platform(self, os_name, os_version, installer_keys, default_installer_key):
         rosdep_key = self.rosdep_key
         data = self.data
 
@@ -180,27 +202,117 @@ class RosdepView(object):
     which stores :class:`RosdepDatabaseEntry` data for all stacks, a
     view merges entries for a particular stack.  This view can then be
     queried to lookup and resolve individual rosdep dependencies.
+
+    Merged entries are kept as raw data in precedence order and a
+    :class:`RosdepDefinition` is only built when a rosdep name is
+    looked up.
     """
 
     def __init__(self, name):
         self.name = name
-        self.rosdep_defs = {}  # {str: RosdepDefinition}
+        self._layers = []  # [(rosdep_data, origin, override)]
+        self._definitions = {}  # {str: RosdepDefinition}
+        self._rosdep_defs = None
+        self._keys = None
+        self._verbose = False
+        self._platform_rules = None  # (platform, {str: (installer_key, rule)})
 
     def __str__(self):
-        return '\n'.join(['%s: %s' % val for val in self.rosdep_defs.items()])
+        return '\n'.join(['%s: %s' % (key, self.lookup(key)) for key in self.keys()])
+
+    @property
+    def rosdep_defs(self):
+        """
+        Definitions of all rosdep names in this view,
+        ``{str: RosdepDefinition}``.  The first access builds the
+        definition of every rosdep name, use :meth:`lookup` to get
+        single ones.
+        """
+        if self._rosdep_defs is None:
+            self._rosdep_defs = dict((key, self.lookup(key)) for key in self.keys())
+        return self._rosdep_defs
+
+    @rosdep_defs.setter
+    def rosdep_defs(self, rosdep_defs):
+        # each definition becomes a layer of its own, so that later
+        # merges keep the first-one-wins rules
+        self._layers = [({key: definition.data}, definition.origin, False)
+                        for key, definition in rosdep_defs.items()]
+        self._definitions = dict(rosdep_defs)
+        self._rosdep_defs = None
+        self._keys = None
+
+    def set_platform_rules(self, os_name, os_version, installer_keys, default_installer_key, rules):
+        """
+        Use precomputed rules for one platform.  Definitions returned
+        by :meth:`lookup` will return these rules from
+        :meth:`RosdepDefinition.get_rule_for_platform` for that
+        platform instead of walking their data.
+
+        :param rules: map of rosdep names to (installer_key, rule)
+          tuples, ``{str: (str, dict)}``.  Rosdep names that are not
+          in the map are resolved from their data as usual.
+        """
+        platform = (os_name, os_version, installer_keys, default_installer_key)
+        self._platform_rules = platform, rules
+        self._rosdep_defs = None
 
     def lookup(self, rosdep_name):
         """
         :returns: :class:`RosdepDefinition`
         :raises: :exc:`KeyError` If *rosdep_name* is not declared
-        """
-        return self.rosdep_defs[rosdep_name]
+        :raises: :exc:`InvalidData` If the data of *rosdep_name* is not valid
+        """
+        definition = self._definitions.get(rosdep_name)
+        if definition is None:
+            definition = self._build_definition(rosdep_name)
+            self._definitions[rosdep_name] = definition
+        if self._platform_rules is not None:
+            platform, rules = self._platform_rules
+            if rosdep_name in rules:
+                os_name, os_version, installer_keys, default_installer_key = platform
+                definition.set_rule_for_platform(os_name, os_version, installer_keys, default_installer_key, rules[rosdep_name])
+        return definition
+
+    def _build_definition(self, rosdep_name):
+        layers = [(data[rosdep_name], origin, override) for data, origin, override in self._layers if rosdep_name in data]
+        if not layers:
+            raise KeyError(rosdep_name)
+        # first rule wins unless a later entry overrides it
+        start = 0
+        for i, (_, _, override) in enumerate(layers):
+            if override:
+                start = i
+        dep_data, origin, _ = layers[start]
+        for data, update_origin, _ in layers[:start]:
+            if not isinstance(data, dict):
+                raise InvalidData('rosdep data for [%s] must be a dictionary' % (rosdep_name), origin=update_origin)
+        remaining = layers[start + 1:]
+        if remaining and isinstance(dep_data, dict):
+            # copy before merging so that the entry data is not modified
+            dep_data = dict(dep_data)
+        definition = RosdepDefinition(rosdep_name, dep_data, origin)
+        for data, update_origin, _ in remaining:
+            if not isinstance(data, dict):
+                raise InvalidData('rosdep data for [%s] must be a dictionary' % (rosdep_name), origin=update_origin)
+            definition.reverse_merge(data, update_origin, verbose=self._verbose)
+        return definition
 
     def keys(self):
         """
-        :returns: list of rosdep names in this view
+        :returns: list of rosdep names in this view, in the order they
+          were first declared
         """
-        return self.rosdep_defs.keys()
+        if self._keys is None:
+            keys = []
+            seen = set()
+            for data, _, _ in self._layers:
+                for key in data:
+                    if key not in seen:
+                        seen.add(key)
+                        keys.append(key)
+            self._keys = keys
+        return self._keys
 
     def merge(self, update_entry, override=False, verbose=False):
         """
@@ -209,21 +321,20 @@ class RosdepView(object):
         conflicts.  This rule logic is modelled after the apt sources
         list.
 
+        The data of *update_entry* is only referenced; definitions are
+        merged when they are looked up.
+
         :param override: Ignore first-one-wins rules and instead
             always use rules from update_entry
         """
         if verbose:
             print('view[%s]: merging from cache of [%s]' % (self.name, update_entry.origin))
-        db = self.rosdep_defs
-
-        for dep_name, dep_data in update_entry.rosdep_data.items():
-            # convert data into RosdepDefinition model
-            update_definition = RosdepDefinition(dep_name, dep_data, update_entry.origin)
-            # First rule wins or override, no rule-merging.
-            if override or dep_name not in db:
-                db[dep_name] = update_definition
-            elif dep_name in db:
-                db[dep_name].reverse_merge(dep_data, update_entry.origin, verbose=verbose)
+            self._verbose = True
+        self._layers.append((update_entry.rosdep_data, update_entry.origin, override))
+        self._rosdep_defs = None
+        self._keys = None
+        if self._definitions:
+            self._definitions = {}
 
 
 def prune_catkin_packages(rosdep_keys, verbose=False):
@@ -257,6 +368,80 @@ def prune_skipped_packages(rosdep_keys, skipped_keys, verbose=False):
     return rosdep_keys
 
 
+class ResolveCache(object):
+    """
+    Bounded cache of the results of :meth:`RosdepLookup.resolve`,
+    evicting the least recently used entry when full.  Entries are
+    keyed by rosdep key, OS name, OS version, view name and a
+    fingerprint of the installer context, so resolving a key for
+    several platforms or views does not evict the other results.
+    """
+
+    def __init__(self, max_size=DEFAULT_RESOLVE_CACHE_SIZE):
+        """
+        :param max_size: maximum number of cached resolutions, ``int``
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        :returns: cached value of *key*, or ``None`` if not cached
+        """
+        try:
+            # move to the end, which is the most recently used entry
+            value = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries[key] = value
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self):
+        """
+        :returns: counters of the cache, ``{str: int}`` with the keys
+          ``size``, ``max_size``, ``hits``, ``misses`` and ``evictions``
+        """
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+def get_installer_context_fingerprint(installer_context, os_name):
+    """
+    :returns: hashable value which changes when the installers used
+      to resolve rosdep keys for *os_name* in *installer_context*
+      change.  It references the installers, so the fingerprint of a
+      replaced installer is never reused.
+    :raises: :exc:`KeyError` if no installers are registered for *os_name*
+    """
+    installer_keys = tuple(installer_context.get_os_installer_keys(os_name))
+    default_key = installer_context.get_default_os_installer_key(os_name)
+    installers = tuple(installer_context.installers.get(key) for key in installer_keys + (default_key,))
+    return installer_keys, default_key, installers
+
+
 class RosdepLookup(object):
     """
     Lookup rosdep definitions.  Provides API for most
@@ -277,7 +462,11 @@ class RosdepLookup(object):
         self.loader = loader
 
         self._view_cache = {}  # {str: {RosdepView}}
-        self._resolve_cache = {}  # {str : (os_name, os_version, installer_key, resolution, dependencies)}
+        #: :class:`ResolveCache` of {(rosdep_key, os_name, os_version, view_name, fingerprint): (installer_key, resolution, dependencies)}
+        self.resolve_cache = ResolveCache()
+        #: optional :class:`rosdep2.resolution_cache.ResolutionCache`
+        #: which keeps resolutions across invocations
+        self.persistent_resolve_cache = None
 
         # some APIs that deal with the entire environment save errors
         # in to self.errors instead of raising them in order to be
@@ -402,6 +591,8 @@ class RosdepLookup(object):
                         depend_graph[rosdep_key]['installer_key'] = installer_key
                         depend_graph[rosdep_key]['install_keys'] = list(resolution)
                         depend_graph[rosdep_key]['dependencies'] = list(dependencies)
+                        # the returned list may be cached, do not modify it
+                        dependencies = list(dependencies)
                         while dependencies:
                             depend_rosdep_key = dependencies.pop()
                             # prevent infinite loop
@@ -462,26 +653,20 @@ class RosdepLookup(object):
             rd_debug(view)
             raise ResolutionError(rosdep_key, None, os_name, os_version, 'Cannot locate rosdep definition for [%s]' % (rosdep_key))
 
-        # check cache: the main motivation for the cache is that
-        # source rosdeps are expensive to resolve
-        if rosdep_key in self._resolve_cache:
-            cache_value = self._resolve_cache[rosdep_key]
-            cache_os_name = cache_value[0]
-            cache_os_version = cache_value[1]
-            cache_view_name = cache_value[2]
-            if (
-                cache_os_name == os_name and
-                cache_os_version == os_version and
-                cache_view_name == view.name
-            ):
-                return cache_value[3:]
-
         # get the rosdep data for the platform
         try:
-            installer_keys = installer_context.get_os_installer_keys(os_name)
-            default_key = installer_context.get_default_os_installer_key(os_name)
+            fingerprint = get_installer_context_fingerprint(installer_context, os_name)
         except KeyError:
             raise ResolutionError(rosdep_key, definition.data, os_name, os_version, 'Unsupported OS [%s]' % (os_name))
+        installer_keys, default_key, _ = fingerprint
+
+        # check cache: the main motivation for the cache is that
+        # source rosdeps are expensive to resolve
+        cache_key = rosdep_key, os_name, os_version, view.name, fingerprint
+        cache_value = self.resolve_cache.get(cache_key)
+        if cache_value is not None:
+            return cache_value
+
         installer_key, rosdep_args_dict = definition.get_rule_for_platform(os_name, os_version, installer_keys, default_key)
 
         # resolve the rosdep data for the platform
@@ -489,15 +674,32 @@ class RosdepLookup(object):
             installer = installer_context.get_installer(installer_key)
         except KeyError:
             raise ResolutionError(rosdep_key, definition.data, os_name, os_version, 'Unsupported installer [%s]' % (installer_key))
-        resolution = installer.resolve(rosdep_args_dict)
-        dependencies = installer.get_depends(rosdep_args_dict)
+        resolution, dependencies = self.resolve_rule(definition, os_name, os_version, installer_key, installer, rosdep_args_dict)
 
         # cache value
         # the dependencies list is copied to prevent mutation before next cache hit
-        self._resolve_cache[rosdep_key] = os_name, os_version, view.name, installer_key, resolution, list(dependencies)
+        self.resolve_cache.set(cache_key, (installer_key, resolution, list(dependencies)))
 
         return installer_key, resolution, dependencies
 
+    def resolve_rule(self, definition, os_name, os_version, installer_key, installer, rosdep_args_dict):
+        """
+        Resolve the rule of *definition* for a platform with
+        *installer*, using :attr:`persistent_resolve_cache` if set.
+
+        :param rosdep_args_dict: rule as returned by
+          :meth:`RosdepDefinition.get_rule_for_platform`
+        :returns: *(resolution, dependencies)*, see :meth:`resolve`
+        """
+        persistent_cache = self.persistent_resolve_cache
+        if persistent_cache is None:
+            return installer.resolve(rosdep_args_dict), installer.get_depends(rosdep_args_dict)
+        value = persistent_cache.get(definition, os_name, os_version, installer_key)
+        if value is None:
+            value = installer.resolve(rosdep_args_dict), installer.get_depends(rosdep_args_dict)
+            persistent_cache.set(definition, os_name, os_version, installer_key, *value)
+        return value
+
     def _load_all_views(self, loader):
         """
         Load all available view keys.  In general, this is equivalent
@@ -33,7 +33,10 @@ Command-line interface to rosdep library
 
 from __future__ import print_function
 
+import json
 import os
+import re
+import subprocess
 import sys
 import traceback
 try:
@@ -58,15 +61,20 @@ import rospkg
 
 from . import create_default_installer_context, get_default_installer
 from . import __version__
+from .cache_bundle import export_cache_bundle, import_cache_bundle
 from .core import RosdepInternalError, InstallFailed, UnsupportedOs, InvalidData, CachePermissionError, DownloadFailure
+from .downloader import get_connection_pool
 from .installers import normalize_uninstalled_to_list
 from .installers import RosdepInstaller
 from .lookup import RosdepLookup, ResolutionError
+from .platform_tables import apply_platform_table, write_platform_table
+from .resolution_cache import ResolutionCache, prune_resolution_cache
 from .rospkg_loader import DEFAULT_VIEW_KEY
 from .sources_list import update_sources_list, get_sources_cache_dir,\
     download_default_sources_list, SourcesListLoader, CACHE_INDEX,\
     get_sources_list_dir, get_default_sources_list_file,\
-    DEFAULT_SOURCES_LIST_URL
+    DEFAULT_SOURCES_LIST_URL, DataSourceMatcher, get_sources_cache_age, get_cache_compressions
+from .sources_list import get_readable_sources_cache_dir, get_system_sources_cache_dir
 from .rosdistrohelper import PreRep137Warning
 
 from .catkin_packages import find_catkin_packages_in
@@ -112,6 +120,13 @@ rosdep where-defined <rosdeps>...
   print a list of yaml files that declare a rosdep on (at least
   one of) <rosdeps>
 
+rosdep cache export <file>
+  write the local rosdep database into a compressed bundle.
+
+rosdep cache import <file>
+  replace the local rosdep database with the content of a bundle
+  written by 'rosdep cache export'.
+
 rosdep fix-permissions
   Recursively change the permissions of the user's ros home directory.
   May require sudo.  Can be useful to fix permissions after calling
@@ -119,17 +134,27 @@ rosdep fix-permissions
 """
 
 
-def _get_default_RosdepLookup(options):
+def _get_default_RosdepLookup(options, use_snapshot=True, rosdep_keys=None):
     """
     Helper routine for converting command-line options into
     appropriate RosdepLookup instance.
+
+    :param use_snapshot: load the merged snapshot of the sources
+        cache if it is up to date.  Commands that report per-source
+        information must pass ``False``.
+    :param rosdep_keys: if set, the lookup is only used for these
+        rosdep keys and may only load their data.
     """
     os_override = convert_os_override_option(options.os_override)
     sources_loader = SourcesListLoader.create_default(sources_cache_dir=options.sources_cache_dir,
                                                       os_override=os_override,
-                                                      verbose=options.verbose)
+                                                      verbose=options.verbose,
+                                                      use_snapshot=use_snapshot,
+                                                      rosdep_keys=rosdep_keys)
     lookup = RosdepLookup.create_from_rospkg(sources_loader=sources_loader)
     lookup.verbose = options.verbose
+    if options.resolution_cache:
+        lookup.persistent_resolve_cache = ResolutionCache.open(options.sources_cache_dir, verbose=options.verbose)
     return lookup
 
 
@@ -200,7 +225,8 @@ def check_for_sources_list_init(sources_cache_dir):
     If check fails, tell user how to resolve and sys exit.
     """
     commands = []
-    filename = os.path.join(sources_cache_dir, CACHE_INDEX)
+    # the system cache is used until the user updated the default cache
+    filename = os.path.join(get_readable_sources_cache_dir(sources_cache_dir), CACHE_INDEX)
     if os.path.exists(filename):
         return
     else:
@@ -334,6 +360,84 @@ def _rosdep_main(args):
                       help="Affects the 'update' verb. "
                            'If specified end-of-life distros are being '
                            'fetched too.')
+    parser.add_option('--shard-platforms', dest='shard_platforms',
+                      default=False, action='store_true',
+                      help="Affects the 'update' verb. "
+                           'If specified the rules generated for the '
+                           'rosdistro distributions are cached separately '
+                           'for each OS, so that only the rules for the '
+                           'current OS are loaded.')
+    parser.add_option('--platform', dest='platforms',
+                      default=[], action='append', metavar='OS_NAME',
+                      help="Affects the 'update' verb. "
+                           'Only generate rules for the rosdistro '
+                           'distributions for the specified OS. '
+                           'Can be specified multiple times.')
+    parser.add_option('--only-matching', dest='only_matching',
+                      default=False, action='store_true',
+                      help="Affects the 'update' verb. "
+                           'Only fetch the sources and rosdistro '
+                           'distributions used on this host, taking '
+                           '--os and --rosdistro into account.')
+    parser.add_option('--system-cache', dest='system_cache',
+                      default=False, action='store_true',
+                      help="Affects the 'update' verb. "
+                           'Update the system-wide sources cache in %s, '
+                           'which all users read below their own sources '
+                           'cache.  Later updates by users only fetch the '
+                           'sources which are not in the system cache.' % (get_system_sources_cache_dir()))
+    parser.add_option('--cache-compression', dest='cache_compression',
+                      default=None, type='choice', choices=get_cache_compressions(),
+                      help="Affects the 'update' verb. "
+                           'Compress the cache files of the sources with '
+                           'the specified format (%s).  The selection is '
+                           'kept by later updates of the cache.' % ', '.join(get_cache_compressions()))
+    parser.add_option('--platform-table', dest='platform_table',
+                      default=False, action='store_true',
+                      help="Affects the 'update' verb. "
+                           'If specified the rules of all rosdep keys are '
+                           'precomputed for the current (or --os) platform, '
+                           "which speeds up 'db', 'check' and 'install'.")
+    parser.add_option('--no-snapshot', dest='snapshot',
+                      default=True, action='store_false',
+                      help="Affects the 'update' verb. "
+                           'If specified the merged snapshot of the '
+                           'sources used on this host is not written, '
+                           "so 'resolve', 'check' and 'install' merge "
+                           'the sources when they are loaded.')
+    parser.add_option('--stats', dest='stats', default=False, action='store_true',
+                      help="Affects the 'update' verb. "
+                           'Print the download, parse and write times and '
+                           'sizes of each source.')
+    parser.add_option('--stats-json', dest='stats_json', default=None,
+                      metavar='FILE',
+                      help="Affects the 'update' verb. "
+                           'Write the measurements of each source to FILE '
+                           'as JSON.')
+    parser.add_option('--jobs', '-j', dest='jobs', default=None,
+                      type='int', metavar='N',
+                      help="Affects the 'update' verb. "
+                           'Maximum number of sources to fetch in parallel.')
+    parser.add_option('--if-older-than', dest='if_older_than', default=None,
+                      metavar='AGE',
+                      help="Affects the 'update' verb. "
+                           'Only update if the local index is older than '
+                           'AGE, in seconds or with a unit suffix '
+                           '(s, m, h, d), e.g. 6h.')
+    parser.add_option('--stale-while-revalidate', dest='stale_while_revalidate',
+                      default=None, metavar='AGE',
+                      help="Affects the 'resolve', 'check' and 'install' "
+                           'verbs. If the local index is older than AGE, '
+                           "use it but run 'rosdep update' in the "
+                           'background.')
+    parser.add_option('--resolution-cache', dest='resolution_cache',
+                      default=False, action='store_true',
+                      help="Affects the 'resolve', 'check' and 'install' "
+                           'verbs. Keep the resolved rosdep keys in the '
+                           'sources cache, so later invocations do not '
+                           'resolve them again, e.g. download the '
+                           "manifests of source rosdeps, until 'rosdep "
+                           "update' changes the cache.")
 
     options, args = parser.parse_args(args)
     if options.print_version or options.print_all_versions:
@@ -384,12 +488,22 @@ def _rosdep_main(args):
     # Convert list of keys to dictionary
     options.as_root = dict((k, str_to_bool(v)) for k, v in key_list_to_dict(options.as_root).items())
 
-    if command not in ['init', 'update', 'fix-permissions']:
+    try:
+        options.if_older_than = parse_age(options.if_older_than)
+        options.stale_while_revalidate = parse_age(options.stale_while_revalidate)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if command not in ['init', 'update', 'fix-permissions', 'cache']:
         check_for_sources_list_init(options.sources_cache_dir)
-    elif command not in ['fix-permissions']:
+    elif command not in ['fix-permissions', 'cache']:
         setup_proxy_opener()
+    if command in ['resolve', 'check', 'install'] and options.stale_while_revalidate is not None:
+        revalidate_sources_cache(options)
     if command in _command_rosdep_args:
         return _rosdep_args_handler(command, parser, options, args)
+    elif command == 'cache':
+        return _cache_args_handler(command, parser, options, args)
     elif command in _command_no_args:
         return _no_args_handler(command, parser, options, args)
     else:
@@ -414,6 +528,13 @@ def _rosdep_args_handler(command, parser, options, args):
         return command_handlers[command](args, options)
 
 
+def _cache_args_handler(command, parser, options, args):
+    if len(args) != 2 or args[0] not in ['export', 'import']:
+        parser.error("usage: rosdep cache export|import <file>")
+    else:
+        return command_handlers[command](args, options)
+
+
 def _package_args_handler(command, parser, options, args):
     if options.rosdep_all:
         if args:
@@ -492,6 +613,50 @@ def _package_args_handler(command, parser, options, args):
     return command_handlers[command](lookup, packages, options)
 
 
+def parse_age(age):
+    """
+    Convert an age like ``90``, ``30m`` or ``6h`` into seconds.
+
+    :returns: age in seconds, ``float``, or ``None`` if *age* is ``None``
+    :raises: :exc:`ValueError` if *age* is not valid
+    """
+    if age is None:
+        return None
+    match = re.match(r'^(\d+(?:\.\d+)?)([smhd]?)$', age.strip())
+    if match is None:
+        raise ValueError('invalid age [%s], expected a number of seconds with an optional unit s, m, h or d' % (age))
+    factors = {'': 1, 's': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+    return float(match.group(1)) * factors[match.group(2)]
+
+
+def revalidate_sources_cache(options):
+    """
+    Start 'rosdep update' as a detached background process if the
+    sources cache is older than the --stale-while-revalidate age.  The
+    current command keeps using the current cache.
+    """
+    age = get_sources_cache_age(options.sources_cache_dir)
+    if age is None or age < options.stale_while_revalidate:
+        return
+    if os.path.abspath(options.sources_cache_dir) != os.path.abspath(get_sources_cache_dir()):
+        # 'rosdep update' only writes the default sources cache
+        if options.verbose:
+            print('not updating stale sources cache %s' % (options.sources_cache_dir), file=sys.stderr)
+        return
+    # the background update skips the update if another one was faster
+    command = [sys.executable, '-c', 'from rosdep2.main import rosdep_main; rosdep_main()',
+               'update', '--if-older-than', '%d' % (options.stale_while_revalidate)]
+    if options.os_override:
+        command += ['--os', options.os_override]
+    if options.include_eol_distros:
+        command.append('--include-eol-distros')
+    if options.verbose:
+        print('sources cache is %d seconds old, updating it in the background' % (age), file=sys.stderr)
+    with open(os.devnull, 'r+') as devnull:
+        subprocess.Popen(command, stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True,
+                         preexec_fn=getattr(os, 'setsid', None))
+
+
 def convert_os_override_option(options_os_override):
     """
     Convert os_override option flag to ``(os_name, os_version)`` tuple, or
@@ -510,6 +675,42 @@ def convert_os_override_option(options_os_override):
     return os_name, os_version
 
 
+def _get_default_matcher(options):
+    return DataSourceMatcher.create_default(os_override=convert_os_override_option(options.os_override))
+
+
+def _use_platform_table(lookup, installer_context, options):
+    """
+    Make the default view of *lookup* use the rule table precomputed
+    by 'rosdep update --platform-table', if it is up to date.
+    """
+    view = lookup.get_rosdep_view(DEFAULT_VIEW_KEY, verbose=options.verbose)
+    if apply_platform_table(view, options.sources_cache_dir, _get_default_matcher(options), installer_context):
+        if options.verbose:
+            print('using precomputed rule table', file=sys.stderr)
+
+
+def _write_platform_table(sources_cache_dir, options):
+    """
+    Write the rule table of the platform into the new sources cache in
+    *sources_cache_dir*.  Failures are reported but do not fail the
+    update, the table is only an optimization.
+    """
+    installer_context = create_default_installer_context(verbose=options.verbose)
+    configure_installer_context(installer_context, options)
+    try:
+        filepath = write_platform_table(sources_cache_dir, _get_default_matcher(options), installer_context)
+    except KeyError:
+        os_name = installer_context.get_os_name_and_version()[0]
+        print('ERROR: not writing rule table for unsupported OS [%s]' % (os_name), file=sys.stderr)
+        return
+    except CachePermissionError as e:
+        print('ERROR: not writing rule table: %s' % (e), file=sys.stderr)
+        return
+    if filepath:
+        print('wrote rule table %s' % (filepath))
+
+
 def configure_installer_context(installer_context, options):
     """
     Configure the *installer_context* from *options*.
@@ -563,16 +764,97 @@ def command_init(options):
         os.umask(old_umask)
 
 
+def _warn_if_root():
+    try:
+        if os.geteuid() == 0:
+            print("Warning: running 'rosdep update' as root is not recommended.", file=sys.stderr)
+            print("  You should run 'sudo rosdep fix-permissions' and invoke 'rosdep update' again without sudo.", file=sys.stderr)
+    except AttributeError:
+        # nothing we wanna do under Windows
+        pass
+
+
+def _is_sources_cache_fresh(sources_cache_dir, options):
+    """
+    :param sources_cache_dir: sources cache to update
+    """
+    if options.if_older_than is None:
+        return False
+    age = get_sources_cache_age(sources_cache_dir)
+    if age is None or age >= options.if_older_than:
+        return False
+    print('sources cache was updated %d seconds ago, skipping update' % (age))
+    return True
+
+
+UPDATE_STATS_FIELDS = ['requests', 'bytes', 'connect_time', 'transfer_time', 'parse_time', 'pickle_bytes', 'write_time']
+
+
+def _get_update_stats_record(data_source, error=None):
+    urls = data_source.url if isinstance(data_source.url, list) else [data_source.url]
+    record = dict((field, 0) for field in UPDATE_STATS_FIELDS)
+    record.update(data_source.stats or {})
+    record.update({'url': ' '.join(urls), 'tags': data_source.tags, 'error': str(error) if error else None})
+    return record
+
+
+def format_update_stats(records):
+    """
+    :param records: measurements of the updated sources, as collected
+      by :func:`command_update`
+    :returns: table of the measurements, ``str``
+    """
+    row_format = '%8d %10d %7.3fs %7.3fs %7.3fs %10d %7.3fs  %s'
+    lines = ['%8s %10s %8s %8s %8s %10s %8s  %s' % (
+        'requests', 'bytes', 'connect', 'transfer', 'parse', 'pickle', 'write', 'source')]
+    totals = dict((field, 0) for field in UPDATE_STATS_FIELDS)
+    for record in records:
+        for field in UPDATE_STATS_FIELDS:
+            totals[field] += record[field]
+        lines.append(row_format % (tuple(record[field] for field in UPDATE_STATS_FIELDS) + (record['url'],)))
+    lines.append(row_format % (tuple(totals[field] for field in UPDATE_STATS_FIELDS) + ('total',)))
+    return '\n'.join(lines)
+
+
+def _write_update_stats(options, records):
+    if options.stats:
+        print(format_update_stats(records))
+    if options.stats_json:
+        data = {'sources': records, 'connection_pool': get_connection_pool().get_stats()}
+        with open(options.stats_json, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+
+
 def command_update(options):
     error_occured = []
+    hits = []
+    unchanged = []
+    stats_records = []
 
     def update_success_handler(data_source):
-        print('Hit %s' % (data_source.url))
+        record = _get_update_stats_record(data_source)
+        print('Hit %s' % (record['url']))
+        hits.append(data_source)
+        stats_records.append(record)
+
+    def update_unchanged_handler(data_source):
+        unchanged.append(data_source)
 
     def update_error_handler(data_source, exc):
         error_string = 'ERROR: unable to process source [%s]:\n\t%s' % (data_source.url, exc)
         print(error_string, file=sys.stderr)
         error_occured.append(error_string)
+        stats_records.append(_get_update_stats_record(data_source, exc))
+    if options.jobs is not None and options.jobs < 1:
+        raise UsageError('--jobs must be a positive number')
+    if options.system_cache:
+        sources_cache_dir = get_system_sources_cache_dir()
+        if sources_cache_dir is None:
+            raise UsageError('the system cache is disabled')
+    else:
+        sources_cache_dir = options.sources_cache_dir
+    if _is_sources_cache_fresh(sources_cache_dir, options):
+        return 0
     sources_list_dir = get_sources_list_dir()
 
     # disable deprecation warnings when using the command-line tool
@@ -588,17 +870,34 @@ def command_update(options):
         return 1
     try:
         print('reading in sources list data from %s' % (sources_list_dir))
-        sources_cache_dir = get_sources_cache_dir()
-        try:
-            if os.geteuid() == 0:
-                print("Warning: running 'rosdep update' as root is not recommended.", file=sys.stderr)
-                print("  You should run 'sudo rosdep fix-permissions' and invoke 'rosdep update' again without sudo.", file=sys.stderr)
-        except AttributeError:
-            # nothing we wanna do under Windows
-            pass
-        update_sources_list(success_handler=update_success_handler,
+        if not options.system_cache:
+            _warn_if_root()
+
+        def write_platform_table_handler(new_cache_dir):
+            # written into the new cache before it is published
+            _write_platform_table(new_cache_dir, options)
+        cache_handler = write_platform_table_handler if options.platform_table else None
+        update_sources_list(sources_cache_dir=sources_cache_dir,
+                            success_handler=update_success_handler,
                             error_handler=update_error_handler,
-                            skip_eol_distros=not options.include_eol_distros)
+                            skip_eol_distros=not options.include_eol_distros,
+                            jobs=options.jobs,
+                            unchanged_handler=update_unchanged_handler,
+                            os_override=convert_os_override_option(options.os_override),
+                            platforms=options.platforms or None,
+                            shard_platforms=options.shard_platforms,
+                            only_matching=options.only_matching,
+                            compression=options.cache_compression,
+                            cache_handler=cache_handler,
+                            snapshot=options.snapshot)
+        if hits:
+            # nothing was fetched if the result of a concurrent update was reused
+            print('%d of %d sources unchanged' % (len(unchanged), len(hits)))
+        pool_stats = get_connection_pool().get_stats()
+        if pool_stats['requests']:
+            print('%(requests)d downloads over %(connections)d connections (%(reused)d reused)' % pool_stats)
+        _write_update_stats(options, stats_records)
+        prune_resolution_cache(sources_cache_dir)
         print('updated cache in %s' % (sources_cache_dir))
     except InvalidData as e:
         print('ERROR: invalid sources list file:\n\t%s' % (e), file=sys.stderr)
@@ -634,6 +933,7 @@ def command_check(lookup, packages, options):
 
     installer_context = create_default_installer_context(verbose=verbose)
     configure_installer_context(installer_context, options)
+    _use_platform_table(lookup, installer_context, options)
     installer = RosdepInstaller(installer_context, lookup)
 
     uninstalled, errors = installer.get_uninstalled(packages, implicit=options.recursive, verbose=verbose)
@@ -677,6 +977,7 @@ def command_install(lookup, packages, options):
     # setup installer
     installer_context = create_default_installer_context(verbose=options.verbose)
     configure_installer_context(installer_context, options)
+    _use_platform_table(lookup, installer_context, options)
     installer = RosdepInstaller(installer_context, lookup)
 
     if options.reinstall:
@@ -742,6 +1043,7 @@ def command_db(options):
     errors = []
     print('DB [key -> resolution]')
     # db does not leverage the resource-based API
+    _use_platform_table(lookup, installer_context, options)
     view = lookup.get_rosdep_view(DEFAULT_VIEW_KEY, verbose=options.verbose)
     for rosdep_name in view.keys():
         try:
@@ -782,7 +1084,8 @@ def command_what_needs(args, options):
 
 
 def command_where_defined(args, options):
-    lookup = _get_default_RosdepLookup(options)
+    # the snapshot merges all sources, so it cannot tell where keys are defined
+    lookup = _get_default_RosdepLookup(options, use_snapshot=False, rosdep_keys=args)
     locations = []
     for rosdep_name in args:
         locations.extend(lookup.get_views_that_define(rosdep_name))
@@ -798,7 +1101,7 @@ def command_where_defined(args, options):
 
 
 def command_resolve(args, options):
-    lookup = _get_default_RosdepLookup(options)
+    lookup = _get_default_RosdepLookup(options, rosdep_keys=args)
     installer_context = create_default_installer_context(verbose=options.verbose)
     configure_installer_context(installer_context, options)
 
@@ -819,7 +1122,7 @@ def command_resolve(args, options):
         rule_installer, rule = d.get_rule_for_platform(os_name, os_version, installer_keys, default_key)
 
         installer = installer_context.get_installer(rule_installer)
-        resolved = installer.resolve(rule)
+        resolved, _ = lookup.resolve_rule(d, os_name, os_version, rule_installer, installer, rule)
         print('#%s' % (rule_installer))
         print(' '.join([str(r) for r in resolved]))
 
@@ -833,6 +1136,20 @@ def command_resolve(args, options):
         return 1  # error exit code
 
 
+def command_cache(args, options):
+    action, filepath = args
+    try:
+        if action == 'export':
+            count = export_cache_bundle(options.sources_cache_dir, filepath)
+            print('exported %d files of %s to %s' % (count, options.sources_cache_dir, filepath))
+        else:
+            count = import_cache_bundle(filepath, options.sources_cache_dir)
+            print('imported %d files from %s to %s' % (count, filepath, options.sources_cache_dir))
+    except InvalidData as e:
+        print('ERROR: %s: %s' % (e.origin, e), file=sys.stderr)
+        return 1
+
+
 def command_fix_permissions(options):
     import os
     import pwd
@@ -888,6 +1205,7 @@ command_handlers = {
     'init': command_init,
     'update': command_update,
     'fix-permissions': command_fix_permissions,
+    'cache': command_cache,
 
     # backwards compat
     'what_needs': command_what_needs,
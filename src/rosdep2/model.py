@@ -38,20 +38,51 @@ combine these rosdep dependency maps and view dependencies together
 into a combined view on which queries can be made.
 """
 
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping  # py2
+try:
+    from types import MappingProxyType
+except ImportError:
+    MappingProxyType = None  # py2
+
+
+def read_only_mapping(data):
+    """
+    :param data: rosdep data, ``dict``
+    :returns: read-only view of *data* which does not copy it.  On
+      Python 2, which has no such view, *data* itself is returned.
+    """
+    if MappingProxyType is None or isinstance(data, MappingProxyType):
+        return data
+    return MappingProxyType(data)
+
+
+def is_read_only_mapping(data):
+    """
+    :returns: ``True`` if *data* is a view created by
+      :func:`read_only_mapping`
+    """
+    return MappingProxyType is not None and isinstance(data, MappingProxyType)
+
 
 class RosdepDatabaseEntry(object):
     """
-    Stores rosdep data and metadata for a single view.
+    Stores rosdep data and metadata for a single view.  The rosdep
+    data is only accessible through a read-only view, so entries can
+    share the data of their source without copying it.
     """
 
     def __init__(self, rosdep_data, view_dependencies, origin):
         """
-        :param rosdep_data: raw rosdep dictionary map for view
+        :param rosdep_data: raw rosdep dictionary map for view.  This
+          is referenced, not copied.
         :param view_dependencies: list of view dependency names
         :param origin: name of where data originated, e.g. filename
         """
-        assert isinstance(rosdep_data, dict), 'RosdepDatabaseEntry() rosdep_data is not a dict: %s' % rosdep_data
-        self.rosdep_data = rosdep_data
+        assert isinstance(rosdep_data, Mapping), 'RosdepDatabaseEntry() rosdep_data is not a dict: %s' % rosdep_data
+        self.rosdep_data = read_only_mapping(rosdep_data)
         self.view_dependencies = view_dependencies
         self.origin = origin
 
@@ -63,6 +94,7 @@ class RosdepDatabase(object):
 
     def __init__(self):
         self._rosdep_db = {}  # {view_name: RosdepDatabaseEntry}
+        self._view_dependencies = {}  # {view_name: [str]}, transitive closures
 
     def is_loaded(self, view_name):
         """
@@ -86,10 +118,16 @@ class RosdepDatabase(object):
         :class:`RosdepDatabaseEntry`.
 
         :param rosdep_data: rosdep data map to associated with view.
-          This will be copied.
+          This will be copied unless it is already read-only, see
+          :func:`read_only_mapping`.
         :param origin: origin of view data, e.g. filepath of ``rosdep.yaml``
         """
-        self._rosdep_db[view_name] = RosdepDatabaseEntry(rosdep_data.copy(), view_dependencies, origin)
+        if not is_read_only_mapping(rosdep_data):
+            # the caller may still modify the dict
+            rosdep_data = rosdep_data.copy()
+        self._rosdep_db[view_name] = RosdepDatabaseEntry(rosdep_data, view_dependencies, origin)
+        # the closure of every view depending on this one may change
+        self._view_dependencies.clear()
 
     def get_view_names(self):
         """
@@ -107,18 +145,45 @@ class RosdepDatabase(object):
 
     def get_view_dependencies(self, view_name):
         """
+        :returns: all views *view_name* depends on, directly or
+          transitively, with the dependencies of a view before the
+          view itself, ``[str]``.
+
         :raises: :exc:`KeyError` if *view_name* is not an entry, or if
           all of view's dependencies have not been properly loaded.
+        :raises: :exc:`RuntimeError` if the view dependencies are cyclic
         """
-        entry = self.get_view_data(view_name)
-        dependencies = entry.view_dependencies[:]
-        # compute full set of dependencies by iterating over
-        # dependencies in reverse order and prepending.
-        for s in reversed(entry.view_dependencies):
-            dependencies = self.get_view_dependencies(s) + dependencies
-        # make unique preserving order
-        unique_deps = []
-        for d in dependencies:
-            if d not in unique_deps:
-                unique_deps.append(d)
-        return unique_deps
+        if view_name not in self._view_dependencies:
+            self._compute_view_dependencies(view_name)
+        return list(self._view_dependencies[view_name])
+
+    def _compute_view_dependencies(self, view_name):
+        # depth-first traversal with an explicit stack so that deeply
+        # layered views are not limited by the recursion depth.  The
+        # closure of a view is the closures of its dependencies
+        # followed by its own dependencies, unique in order of first
+        # occurrence.
+        closures = self._view_dependencies
+        in_progress = set([view_name])
+        stack = [(view_name, self.get_view_data(view_name).view_dependencies, 0)]
+        while stack:
+            name, dependencies, index = stack[-1]
+            if index < len(dependencies):
+                stack[-1] = (name, dependencies, index + 1)
+                dependency = dependencies[index]
+                if dependency in closures:
+                    continue
+                if dependency in in_progress:
+                    raise RuntimeError('view dependencies of [%s] are cyclic' % (dependency))
+                in_progress.add(dependency)
+                stack.append((dependency, self.get_view_data(dependency).view_dependencies, 0))
+                continue
+            stack.pop()
+            in_progress.discard(name)
+            unique_deps = []
+            seen = set()
+            for d in [d for s in dependencies for d in closures[s]] + list(dependencies):
+                if d not in seen:
+                    seen.add(d)
+                    unique_deps.append(d)
+            closures[name] = unique_deps
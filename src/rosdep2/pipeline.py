@@ -0,0 +1,143 @@
+# Copyright (c) 2019, Open Source Robotics Foundation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Willow Garage, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Streaming pipeline of processing stages connected by bounded queues.
+
+Each stage runs in its own worker threads, so that different items are
+in different stages at the same time, e.g. one item is written to disk
+while the next one is parsed and further ones are downloaded.  The
+bounded queues keep a fast stage from running far ahead of a slow one
+and limit the number of intermediate results held in memory.
+"""
+
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # py2
+
+# maximum number of items waiting for a stage
+DEFAULT_QUEUE_SIZE = 4
+
+_DONE = object()
+
+
+class _Stage(object):
+
+    def __init__(self, func, workers, queue_size):
+        self.func = func
+        self.workers = workers
+        self.queue = queue.Queue(queue_size)
+        self.next_stage = None
+        self._running = workers
+        self._lock = threading.Lock()
+
+    def close(self):
+        """
+        Let the workers of the stage exit once the queued items are
+        processed.
+        """
+        for _ in range(self.workers):
+            self.queue.put(_DONE)
+
+    def run(self, results, errors, fatal_errors):
+        try:
+            while True:
+                task = self.queue.get()
+                if task is _DONE:
+                    break
+                if fatal_errors:
+                    # drop the remaining items, but keep draining the
+                    # queue so that the previous stage does not block
+                    continue
+                index, value = task
+                try:
+                    value = self.func(value)
+                except Exception as e:
+                    # the item is dropped, the error is raised once all
+                    # other items are processed
+                    errors.append(e)
+                    continue
+                except BaseException as e:
+                    # e.g. KeyboardInterrupt, abort the pipeline
+                    fatal_errors.append(e)
+                    continue
+                if self.next_stage is None:
+                    results[index] = value
+                else:
+                    self.next_stage.queue.put((index, value))
+        finally:
+            with self._lock:
+                self._running -= 1
+                last = self._running == 0
+            if last and self.next_stage is not None:
+                self.next_stage.close()
+
+
+def run_pipeline(items, stages, queue_size=DEFAULT_QUEUE_SIZE):
+    """
+    Pass each of *items* through a sequence of stages.
+
+    :param items: list of items to process
+    :param stages: list of (func, workers) pairs.  *func* is called
+        with the result of the previous stage for an item (the item
+        itself for the first stage) in one of *workers* threads.
+    :param queue_size: maximum number of items waiting for a stage
+    :returns: list of the results of the last stage in the same order
+        as *items*
+    :raises: the first exception raised by a stage function, after
+        all other items are processed.  Exceptions which are not
+        derived from :exc:`Exception`, e.g. :exc:`KeyboardInterrupt`,
+        stop the processing of further items and are raised first.
+    """
+    results = [None] * len(items)
+    errors = []
+    fatal_errors = []
+    pipeline = [_Stage(func, max(1, workers), queue_size) for func, workers in stages]
+    for stage, next_stage in zip(pipeline, pipeline[1:]):
+        stage.next_stage = next_stage
+    threads = []
+    for stage in pipeline:
+        for _ in range(stage.workers):
+            thread = threading.Thread(target=stage.run, args=(results, errors, fatal_errors))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+    for task in enumerate(items):
+        if fatal_errors:
+            break
+        pipeline[0].queue.put(task)
+    pipeline[0].close()
+    for thread in threads:
+        thread.join()
+    if fatal_errors:
+        raise fatal_errors[0]
+    if errors:
+        raise errors[0]
+    return results
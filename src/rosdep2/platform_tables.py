@@ -0,0 +1,198 @@
+# Copyright (c) 2019, Open Source Robotics Foundation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Willow Garage, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Per-platform rule tables precomputed from the sources cache.
+
+A rule table maps every rosdep key of the merged sources data to the
+(installer_key, rule) pair that
+:meth:`rosdep2.lookup.RosdepDefinition.get_rule_for_platform` returns
+for one platform.  Tables are written by ``rosdep update`` and are only
+used as long as neither the sources cache nor the installer context
+they were computed for have changed.
+"""
+
+import os
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from .cache_generations import get_current_generation
+from .core import CachePermissionError, InvalidData
+from .lookup import RosdepDefinition, ResolutionError
+from .sources_list import SourcesListLoader, PICKLE_CACHE_EXT, \
+    compute_cache_digest, merge_sources_data, write_atomic
+
+# sources cache subdirectory holding the rule tables
+PLATFORM_TABLES_DIR = 'platforms'
+
+
+def get_platform_table_path(sources_cache_dir, installer_context):
+    """
+    :returns: path of the rule table for the platform of *installer_context*
+    """
+    return os.path.join(sources_cache_dir, PLATFORM_TABLES_DIR,
+                        installer_context.get_platform_fingerprint() + PICKLE_CACHE_EXT)
+
+
+def _get_platform(installer_context):
+    os_name, os_version = installer_context.get_os_name_and_version()
+    installer_keys = installer_context.get_os_installer_keys(os_name)
+    default_key = installer_context.get_default_os_installer_key(os_name)
+    return os_name, os_version, installer_keys, default_key
+
+
+def compute_platform_rules(rosdep_data, os_name, os_version, installer_keys, default_installer_key):
+    """
+    :param rosdep_data: merged rosdep data, ``dict``
+    :returns: map of rosdep keys to (installer_key, rule) tuples for
+      all keys that can be resolved on the platform, ``{str: (str, dict)}``
+    """
+    rules = {}
+    for rosdep_key, data in rosdep_data.items():
+        try:
+            definition = RosdepDefinition(rosdep_key, data)
+            rules[rosdep_key] = definition.get_rule_for_platform(os_name, os_version, installer_keys, default_installer_key)
+        except (ResolutionError, InvalidData):
+            # leave it to the regular resolution to report the error
+            pass
+    return rules
+
+
+# errors of unpickling a corrupt or truncated rule table
+_CORRUPT_TABLE_ERRORS = (pickle.UnpicklingError, EOFError, ValueError)
+
+
+def _read_header(filepath):
+    """
+    :returns: header of the rule table, ``dict``, or ``None`` if the
+      table is corrupt
+    """
+    with open(filepath, 'rb') as f:
+        try:
+            header = pickle.load(f)
+        except _CORRUPT_TABLE_ERRORS:
+            return None
+    return header if isinstance(header, dict) else None
+
+
+def _remove_stale_tables(tables_dir, digest):
+    if not os.path.exists(tables_dir):
+        os.makedirs(tables_dir)
+    for filename in os.listdir(tables_dir):
+        if not filename.endswith(PICKLE_CACHE_EXT):
+            continue
+        header = _read_header(os.path.join(tables_dir, filename))
+        if header is None or header.get('digest') != digest:
+            os.unlink(os.path.join(tables_dir, filename))
+
+
+def write_platform_table(sources_cache_dir, matcher, installer_context):
+    """
+    Compute and store the rule table for the platform of
+    *installer_context*, based on the sources matching *matcher*.
+    Tables of other platforms that no longer match the sources cache
+    are removed.
+
+    :returns: path of the rule table, or ``None`` if the sources data
+      is invalid
+    :raises: :exc:`KeyError` if the OS of *installer_context* is not supported
+    :raises: :exc:`CachePermissionError` if the table cannot be written
+    """
+    os_name, os_version, installer_keys, default_key = _get_platform(installer_context)
+    digest = compute_cache_digest(sources_cache_dir)
+    try:
+        _remove_stale_tables(os.path.join(sources_cache_dir, PLATFORM_TABLES_DIR), digest)
+    except OSError as e:
+        raise CachePermissionError('Failed to write cache file: ' + str(e))
+
+    sources = SourcesListLoader.create_default(matcher, sources_cache_dir=sources_cache_dir).sources
+    try:
+        rosdep_data = merge_sources_data(sources)
+    except InvalidData:
+        return None
+    rules = compute_platform_rules(rosdep_data, os_name, os_version, installer_keys, default_key)
+    header = {
+        'digest': digest,
+        'tags': sorted(matcher.tags),
+        'fingerprint': installer_context.get_platform_fingerprint(),
+    }
+    filepath = get_platform_table_path(sources_cache_dir, installer_context)
+    try:
+        write_atomic(filepath, pickle.dumps(header, 2) + pickle.dumps(rules, 2), True)
+    except OSError as e:
+        raise CachePermissionError('Failed to write cache file: ' + str(e))
+    return filepath
+
+
+def load_platform_table(sources_cache_dir, matcher, installer_context):
+    """
+    Load the rule table written by :func:`write_platform_table`.
+
+    :returns: map of rosdep keys to (installer_key, rule) tuples, or
+      ``None`` if there is no up-to-date table for the platform of
+      *installer_context* and the tags of *matcher*, or if the table
+      is corrupt
+    :raises: :exc:`KeyError` if the OS of *installer_context* is not supported
+    """
+    sources_cache_dir = get_current_generation(sources_cache_dir)
+    filepath = get_platform_table_path(sources_cache_dir, installer_context)
+    if not os.path.exists(filepath):
+        return None
+    with open(filepath, 'rb') as f:
+        try:
+            header = pickle.load(f)
+            if not isinstance(header, dict) or \
+                    header.get('tags') != sorted(matcher.tags) or \
+                    header.get('fingerprint') != installer_context.get_platform_fingerprint() or \
+                    header.get('digest') != compute_cache_digest(sources_cache_dir):
+                return None
+            return pickle.load(f)
+        except _CORRUPT_TABLE_ERRORS:
+            return None
+
+
+def apply_platform_table(view, sources_cache_dir, matcher, installer_context):
+    """
+    Make *view* use the precomputed rule table of the platform of
+    *installer_context*, if there is an up-to-date one.  *view* must
+    be based on the sources matching *matcher*.
+
+    :returns: ``True`` if a rule table is used
+    """
+    try:
+        rules = load_platform_table(sources_cache_dir, matcher, installer_context)
+        if rules is None:
+            return False
+        os_name, os_version, installer_keys, default_key = _get_platform(installer_context)
+    except KeyError:
+        # unsupported OS, resolution reports it
+        return False
+    view.set_platform_rules(os_name, os_version, installer_keys, default_key, rules)
+    return True
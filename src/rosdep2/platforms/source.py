@@ -31,11 +31,9 @@ from __future__ import print_function
 
 import os
 try:
-    from urllib.request import urlopen
     from urllib.request import urlretrieve
     from urllib.error import URLError
 except ImportError:
-    from urllib2 import urlopen
     from urllib import urlretrieve
     from urllib2 import URLError
 import hashlib
@@ -43,6 +41,7 @@ import hashlib
 import yaml
 
 from ..core import rd_debug, InvalidData
+from ..downloader import urlopen
 from ..installers import PackageManagerInstaller, InstallFailed
 from ..shell_utils import create_tempfile_from_string_and_execute
 
@@ -245,7 +244,8 @@ class SourceInstaller(PackageManagerInstaller):
         return commands
 
     def get_depends(self, rosdep_args):
-        deps = rosdep_args.get('depends', [])
+        # copy, the rule data may be shared with other rules
+        deps = list(rosdep_args.get('depends', []))
         for r in self.resolve(rosdep_args):
             deps.extend(r.dependencies)
         return deps
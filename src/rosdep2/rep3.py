@@ -25,14 +25,11 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-try:
-    from urllib.request import urlopen
-except ImportError:
-    from urllib2 import urlopen
 import yaml
 import warnings
 
 from .core import DownloadFailure
+from .downloader import urlopen
 from .rosdistrohelper import PreRep137Warning
 
 # location of targets file for processing gbpdistro files
@@ -0,0 +1,216 @@
+# Copyright (c) 2019, Open Source Robotics Foundation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Willow Garage, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Persistent cache of the results of :meth:`rosdep2.lookup.RosdepLookup.resolve`,
+stored next to the sources cache.  Resolutions of source rosdeps
+download rdmanifests, which this cache saves for later invocations of
+rosdep until ``rosdep update`` changes the sources cache.
+
+The cache file is not part of the generations of the sources cache,
+which are never modified in place, and it is not exported with them.
+"""
+
+from __future__ import print_function
+
+import hashlib
+import os
+import sqlite3
+import sys
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from ._version import __version__
+from .sources_list import compute_cache_digest, get_readable_sources_cache_dir, get_sources_cache_dir
+
+# suffix of the cache file, which is stored next to the sources cache
+RESOLUTION_CACHE_SUFFIX = '.resolutions.sqlite'
+
+# seconds to wait for another rosdep process writing the cache
+RESOLUTION_CACHE_TIMEOUT = 2.0
+
+
+def get_resolution_cache_path(sources_cache_dir=None):
+    """
+    :param sources_cache_dir: override sources cache directory
+    :returns: path of the resolution cache of *sources_cache_dir*
+    """
+    return os.path.abspath(sources_cache_dir or get_sources_cache_dir()) + RESOLUTION_CACHE_SUFFIX
+
+
+def compute_definition_hash(data):
+    """
+    :param data: raw rosdep data of a definition, ``dict``
+    :returns: hex digest of *data*, ``str``
+    """
+    return hashlib.sha1(repr(data).encode('utf-8')).hexdigest()
+
+
+class ResolutionCache(object):
+    """
+    On-disk cache of resolutions, keyed by the digest of the sources
+    cache, the rosdep version, the content hash of the rosdep
+    definition, the OS name and version and the installer key.
+    Entries of other digests are removed by :func:`prune_resolution_cache`.
+    """
+
+    def __init__(self, conn, digest):
+        """
+        :param conn: :class:`sqlite3.Connection` to the cache file
+        :param digest: digest of the sources cache, see
+          :func:`rosdep2.sources_list.compute_cache_digest`
+        """
+        self._conn = conn
+        self._digest = digest
+        self._writable = True
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def open(sources_cache_dir=None, verbose=False):
+        """
+        :param sources_cache_dir: override sources cache directory.
+          The resolutions are keyed by the cache which is read for it,
+          which may be the system cache, see
+          :func:`rosdep2.sources_list.get_readable_sources_cache_dir`.
+        :returns: :class:`ResolutionCache`, or ``None`` if there is no
+            sources cache or the cache file cannot be opened.
+        """
+        digest = compute_cache_digest(get_readable_sources_cache_dir(sources_cache_dir))
+        if digest is None:
+            return None
+        filepath = get_resolution_cache_path(sources_cache_dir)
+        conn = _connect(filepath, verbose)
+        if conn is None:
+            return None
+        cache = ResolutionCache(conn, digest)
+        try:
+            # losing entries on a crash only costs resolving them again
+            conn.execute('PRAGMA synchronous = OFF')
+            _create_table(conn)
+        except sqlite3.Error as e:
+            # e.g. the cache of another user, which can still be read
+            if verbose:
+                print('resolution cache %s is read-only: %s' % (filepath, e), file=sys.stderr)
+            cache._writable = False
+        if verbose:
+            print('using resolution cache %s' % (filepath), file=sys.stderr)
+        return cache
+
+    def close(self):
+        self._conn.close()
+
+    def _get_key(self, definition, os_name, os_version, installer_key):
+        return self._digest, __version__, compute_definition_hash(definition.data), os_name, str(os_version), installer_key
+
+    def get(self, definition, os_name, os_version, installer_key):
+        """
+        :param definition: :class:`rosdep2.lookup.RosdepDefinition` which was resolved
+        :returns: *(resolution, dependencies)* as stored by :meth:`set`,
+          or ``None`` if not cached
+        """
+        try:
+            row = self._conn.execute(
+                'SELECT value FROM resolutions WHERE digest = ? AND version = ? AND definition_hash = ? '
+                'AND os_name = ? AND os_version = ? AND installer_key = ?',
+                self._get_key(definition, os_name, os_version, installer_key)).fetchone()
+            value = pickle.loads(bytes(row[0])) if row is not None else None
+        except Exception:
+            # unreadable or written by an incompatible version
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, definition, os_name, os_version, installer_key, resolution, dependencies):
+        """
+        Store the resolution of *definition*.  Resolutions which cannot
+        be pickled are not stored, neither is anything if the cache
+        file is not writable.
+        """
+        if not self._writable:
+            return
+        try:
+            value = sqlite3.Binary(pickle.dumps((resolution, list(dependencies)), 2))
+        except Exception:
+            return
+        try:
+            self._conn.execute('INSERT OR REPLACE INTO resolutions VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               self._get_key(definition, os_name, os_version, installer_key) + (value,))
+            self._conn.commit()
+        except sqlite3.Error:
+            self._writable = False
+
+
+def _connect(filepath, verbose):
+    try:
+        parent_dir = os.path.dirname(filepath)
+        if not os.path.isdir(parent_dir):
+            os.makedirs(parent_dir)
+        return sqlite3.connect(filepath, timeout=RESOLUTION_CACHE_TIMEOUT)
+    except (OSError, sqlite3.Error) as e:
+        if verbose:
+            print('not using resolution cache %s: %s' % (filepath, e), file=sys.stderr)
+        return None
+
+
+def _create_table(conn):
+    conn.execute('CREATE TABLE IF NOT EXISTS resolutions '
+                 '(digest TEXT, version TEXT, definition_hash TEXT, os_name TEXT, os_version TEXT, installer_key TEXT, value BLOB, '
+                 'PRIMARY KEY (digest, version, definition_hash, os_name, os_version, installer_key))')
+    conn.commit()
+
+
+def prune_resolution_cache(sources_cache_dir=None):
+    """
+    Remove the entries of other sources caches or rosdep versions from
+    the resolution cache, e.g. after ``rosdep update``.  Processes
+    which still read an older sources cache resolve their keys again.
+
+    :param sources_cache_dir: override sources cache directory
+    """
+    filepath = get_resolution_cache_path(sources_cache_dir)
+    if not os.path.exists(filepath):
+        return
+    digest = compute_cache_digest(get_readable_sources_cache_dir(sources_cache_dir))
+    try:
+        conn = sqlite3.connect(filepath, timeout=RESOLUTION_CACHE_TIMEOUT)
+    except sqlite3.Error:
+        return
+    try:
+        _create_table(conn)
+        conn.execute('DELETE FROM resolutions WHERE digest IS NOT ? OR version != ?', (digest, __version__))
+        conn.commit()
+    except sqlite3.Error:
+        pass
+    finally:
+        conn.close()
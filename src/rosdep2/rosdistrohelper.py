@@ -27,7 +27,39 @@
 
 # Author Paul Mathieu/paul@osrfoundation.org
 
+import hashlib
+import json
+import os
+import socket
+import time
+
+try:
+    import urlparse
+except ImportError:
+    import urllib.parse as urlparse  # py3k
+try:
+    from urllib.error import HTTPError, URLError
+except ImportError:
+    from urllib2 import HTTPError, URLError
+try:
+    ConnectionError
+except NameError:
+    ConnectionError = socket.error  # py2
+
 import rosdistro
+import rosdistro.distribution_file
+import yaml
+
+from .core import CachePermissionError, write_atomic
+from .downloader import download_if_modified
+
+# directory in the sources cache for downloaded rosdistro files
+ROSDISTRO_CACHE_DIR = 'rosdistro'
+
+# retries of downloads failing with a transient error, and seconds to
+# wait before each, like rosdistro.loader.load_url()
+DOWNLOAD_RETRIES = 2
+DOWNLOAD_RETRY_PERIOD = 1.0
 
 
 class PreRep137Warning(UserWarning):
@@ -38,6 +70,8 @@ class _RDCache:
     index_url = None
     index = None
     release_files = {}
+    digests = {}  # {distro: digest of distribution files}
+    cache_dir = None
 
 
 class ReleaseFile(object):
@@ -51,11 +85,125 @@ class ReleaseFile(object):
         self.platforms = dist_file.release_platforms
 
 
+def _reset_cache():
+    _RDCache.index = None
+    _RDCache.release_files = {}
+    _RDCache.digests = {}
+
+
 def _check_cache():
     if _RDCache.index_url != rosdistro.get_index_url():
         _RDCache.index_url = rosdistro.get_index_url()
-        _RDCache.index = None
-        _RDCache.release_files = {}
+        _reset_cache()
+
+
+def set_cache_dir(cache_dir):
+    """
+    Keep downloaded index and distribution files in *cache_dir* and
+    revalidate them with conditional requests instead of downloading
+    them again.  Files loaded so far are dropped, so that they are
+    revalidated on next access.
+
+    :param cache_dir: existing directory to store the files in, or
+        ``None`` to not store them
+    """
+    _RDCache.cache_dir = cache_dir
+    _reset_cache()
+
+
+def _read_cache_meta(filepath):
+    if not os.path.exists(filepath):
+        return None
+    try:
+        with open(filepath + '.meta', 'r') as f:
+            cache_meta = json.loads(f.read())
+    except (IOError, OSError, ValueError):
+        return None
+    return cache_meta if isinstance(cache_meta, dict) else None
+
+
+def get_cache_dir():
+    """
+    :returns: directory set by :func:`set_cache_dir`, or ``None``
+    """
+    return _RDCache.cache_dir
+
+
+def _is_transient_error(e):
+    if isinstance(e, HTTPError):
+        return e.code in (500, 502, 503)
+    if isinstance(e, URLError):
+        return isinstance(e.reason, (socket.timeout, ConnectionError))
+    return isinstance(e, socket.timeout)
+
+
+def _download_if_modified(url, cache_meta=None, stats=None):
+    # retry transient errors of the rosdistro server
+    retries = DOWNLOAD_RETRIES
+    while True:
+        try:
+            return download_if_modified(url, cache_meta, stats=stats)
+        except (URLError, socket.timeout) as e:
+            if not retries or not _is_transient_error(e):
+                raise
+        retries -= 1
+        time.sleep(DOWNLOAD_RETRY_PERIOD)
+
+
+def _load_url(url, stats=None):
+    """
+    Download *url*, or revalidate the copy in the cache directory.
+
+    :param stats: ``dict`` to add download measurements to
+
+    :returns: (content, digest of content) tuple
+    :raises: :exc:`CachePermissionError` if the cache cannot be written
+    """
+    if _RDCache.cache_dir is None:
+        data, cache_meta = _download_if_modified(url, stats=stats)
+        return data, cache_meta['digest']
+    filepath = os.path.join(_RDCache.cache_dir, hashlib.sha1(url.encode()).hexdigest())
+    old_cache_meta = _read_cache_meta(filepath)
+    data, cache_meta = _download_if_modified(url, old_cache_meta, stats=stats)
+    try:
+        if data is None:
+            with open(filepath, 'rb') as f:
+                data = f.read()
+        else:
+            write_atomic(filepath, data, True)
+        if cache_meta != old_cache_meta:
+            write_atomic(filepath + '.meta', json.dumps(cache_meta))
+    except (IOError, OSError) as e:
+        raise CachePermissionError('Failed to write cache file: ' + str(e))
+    return data, cache_meta['digest']
+
+
+def _read_cached_url(url):
+    """
+    :returns: content of the copy of *url* in the cache directory
+    :raises: :exc:`IOError` if there is no copy
+    """
+    with open(os.path.join(_RDCache.cache_dir, hashlib.sha1(url.encode()).hexdigest()), 'rb') as f:
+        return f.read()
+
+
+def _load_yaml_url(url):
+    return yaml.safe_load(_load_url(url)[0].decode('utf-8'))
+
+
+def _load_index(url):
+    # like rosdistro.get_index(), but downloading through the shared
+    # connection pool
+    return rosdistro.Index(_load_yaml_url(url), os.path.dirname(url),
+                           url_query=urlparse.urlparse(url).query)
+
+
+def _get_distribution_urls(distro):
+    index = get_index()
+    if distro not in index.distributions:
+        raise RuntimeError("Unknown release: '{0}'. Valid release names are: {1}".format(
+            distro, ', '.join(sorted(index.distributions.keys()))))
+    return index.distributions[distro]['distribution']
 
 
 def get_index_url():
@@ -66,14 +214,55 @@ def get_index_url():
 def get_index():
     _check_cache()
     if _RDCache.index is None:
-        _RDCache.index = rosdistro.get_index(_RDCache.index_url)
+        _RDCache.index = _load_index(_RDCache.index_url)
     return _RDCache.index
 
 
+def get_release_file_digest(distro, stats=None):
+    """
+    Download the distribution file of *distro*, without parsing it.
+
+    :param stats: ``dict`` to add download measurements to, if the
+        file is downloaded
+    :returns: digest of the content of the distribution file(s), ``str``
+    :raises: :exc:`RuntimeError` if *distro* is not in the index
+    """
+    _check_cache()
+    if distro not in _RDCache.digests:
+        _load_distribution_data(distro, stats)
+    return _RDCache.digests[distro]
+
+
+def _load_distribution_data(distro, stats=None):
+    """
+    Download the distribution file(s) of *distro* and record their
+    digest.  Files already revalidated since the cache directory was
+    set are read from it instead.
+
+    :returns: content of the distribution file(s), ``[bytes]``
+    """
+    urls = _get_distribution_urls(distro)
+    urls = urls if isinstance(urls, list) else [urls]
+    if distro in _RDCache.digests and _RDCache.cache_dir is not None:
+        try:
+            return [_read_cached_url(url) for url in urls]
+        except (IOError, OSError):
+            pass
+    loaded = [_load_url(url, stats) for url in urls]
+    _RDCache.digests[distro] = hashlib.sha256(
+        ' '.join(digest for _, digest in loaded).encode()).hexdigest()
+    return [data for data, _ in loaded]
+
+
 def get_release_file(distro):
     _check_cache()
     if distro not in _RDCache.release_files:
-        dist_file = rosdistro.get_distribution_file(get_index(), distro)
+        # like rosdistro.get_distribution_file(), but downloading
+        # through the shared connection pool
+        data = [yaml.safe_load(d.decode('utf-8')) for d in _load_distribution_data(distro)]
+        if not isinstance(_get_distribution_urls(distro), list):
+            data = data[0]
+        dist_file = rosdistro.distribution_file.create_distribution_file(distro, data)
         _RDCache.release_files[distro] = ReleaseFile(dist_file)
     return _RDCache.release_files[distro]
 
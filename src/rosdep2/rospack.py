@@ -36,9 +36,11 @@ from __future__ import print_function
 
 import subprocess
 
-from .main import _get_default_RosdepLookup
+from .lookup import RosdepView
+from .main import _get_default_RosdepLookup, convert_os_override_option
+from .model import RosdepDatabaseEntry
 from .rospkg_loader import DEFAULT_VIEW_KEY
-from .sources_list import get_sources_cache_dir
+from .sources_list import get_sources_cache_dir, get_readable_sources_cache_dir, DataSourceMatcher, SourcesKeyIndex
 
 
 def call_pkg_config(option, pkg_name):
@@ -56,12 +58,70 @@ def init_rospack_interface():
             self.os_override = None
             self.sources_cache_dir = get_sources_cache_dir()
             self.verbose = False
-    lookup = _get_default_RosdepLookup(Options())
+            self.resolution_cache = False
+    options = Options()
+    matcher = DataSourceMatcher.create_default(os_override=convert_os_override_option(options.os_override))
+    # the system cache is used until the user updates their own cache
+    key_index = SourcesKeyIndex.open(get_readable_sources_cache_dir(options.sources_cache_dir))
+    if key_index is not None:
+        return _KeyIndexView(DEFAULT_VIEW_KEY, key_index, matcher)
+    lookup = _get_default_RosdepLookup(options)
     return lookup.get_rosdep_view(DEFAULT_VIEW_KEY)
 
 
+class _KeyIndexView(RosdepView):
+    """
+    View on the sources cache that loads the definition of a rosdep
+    name from the key index on its first lookup, instead of loading
+    all sources up front.
+    """
+
+    def __init__(self, name, key_index, matcher):
+        RosdepView.__init__(self, name)
+        self._key_index = key_index
+        self._matcher = matcher
+        self._loaded = set()
+        self._source_data = None  # [rosdep data of the layer of each source]
+
+    def lookup(self, rosdep_name):
+        if rosdep_name not in self._loaded:
+            self._loaded.add(rosdep_name)
+            self._load(rosdep_name)
+        return RosdepView.lookup(self, rosdep_name)
+
+    def _load(self, rosdep_name):
+        sources = self._key_index.get_sources(self._matcher, [rosdep_name])
+        if self._source_data is None:
+            # one layer per source, merged in index order which keeps
+            # the precedence of the sources
+            self._source_data = []
+            for source in sources:
+                data = dict(source.rosdep_data)
+                self._source_data.append(data)
+                self.merge(RosdepDatabaseEntry(data, [], source.url))
+            return
+        # the index returns the same sources on each query, add the
+        # data of the rosdep name to their layers
+        for data, source in zip(self._source_data, sources):
+            data.update(source.rosdep_data)
+        self._definitions.pop(rosdep_name, None)
+        self._rosdep_defs = None
+
+    def merge(self, update_entry, override=False, verbose=False):
+        # the entries only hold the data of the rosdep name they were
+        # loaded for, so the definitions of the other names are kept
+        definitions = self._definitions
+        RosdepView.merge(self, update_entry, override=override, verbose=verbose)
+        for rosdep_name in update_entry.rosdep_data:
+            definitions.pop(rosdep_name, None)
+        self._definitions = definitions
+
+    def keys(self):
+        return self._key_index.get_keys(self._matcher)
+
+
 def is_view_empty(view):
-    return len(view.rosdep_defs) == 0
+    return len(view.keys()) == 0
 
 
 def is_ros_package(view, rosdep_name):
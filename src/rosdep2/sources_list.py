@@ -29,24 +29,36 @@
 
 from __future__ import print_function
 
+import bz2
+import gzip
+import io
 import os
 import sys
 import tempfile
+import time
 import yaml
 import hashlib
+import json
+import sqlite3
 try:
-    from urllib.request import urlopen
     from urllib.error import URLError
 except ImportError:
-    from urllib2 import urlopen
     from urllib2 import URLError
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
+try:
+    import lzma
+except ImportError:
+    lzma = None  # py2
 
-from .core import InvalidData, DownloadFailure, CachePermissionError
+from .cache_generations import SourcesCacheLock, create_generation, discard_generation, \
+    get_current_generation, publish_generation, supports_generations
+from .core import InvalidData, DownloadFailure, CachePermissionError, add_stats, write_atomic
+from .downloader import download_if_modified, get_mirror_selector, urlopen
 from .gbpdistro_support import get_gbprepo_as_rosdep_data, download_gbpdistro_as_rosdep_data
+from .pipeline import run_pipeline
 
 try:
     import urlparse
@@ -58,11 +70,20 @@ try:
 except ImportError:
     import http.client as httplib  # py3k
 
+try:
+    from urllib.request import pathname2url
+except ImportError:
+    from urllib import pathname2url
+
 import rospkg
 import rospkg.distro
+import rospkg.os_detect
 
 from .loader import RosdepLoader
-from .rosdistrohelper import get_index, get_index_url
+from .model import read_only_mapping
+from ._version import __version__
+from .rosdistrohelper import get_index, get_index_url, get_release_file_digest, set_cache_dir, ROSDISTRO_CACHE_DIR
+from .rosdistrohelper import get_cache_dir as get_rosdistro_cache_dir
 
 # default file to download with 'init' command in order to bootstrap
 # rosdep
@@ -71,14 +92,56 @@ DEFAULT_SOURCES_LIST_URL = 'https://raw.githubusercontent.com/ros/rosdistro/mast
 # seconds to wait before aborting download of rosdep data
 DOWNLOAD_TIMEOUT = 15.0
 
+# default number of sources fetched in parallel by 'update'
+DEFAULT_UPDATE_JOBS = 4
+
+# maximum number of downloaded sources waiting to be parsed, and of
+# parsed sources waiting to be written, during 'update'
+UPDATE_QUEUE_SIZE = 4
+
 SOURCES_LIST_DIR = 'sources.list.d'
 SOURCES_CACHE_DIR = 'sources.cache'
 
+# sources cache maintained by root and read by all users, below the
+# sources cache of the user
+SYSTEM_SOURCES_CACHE_DIR = os.path.join('/var/cache/ros/rosdep', SOURCES_CACHE_DIR)
+# overrides SYSTEM_SOURCES_CACHE_DIR, an empty value disables the system cache
+SYSTEM_CACHE_ENV = 'ROSDEP_SYSTEM_CACHE_DIR'
+
 # name of index file for sources cache
 CACHE_INDEX = 'index'
 
+# file in the sources cache with the digest of the sources list and
+# options of the update which wrote it
+UPDATE_FINGERPRINT_FILE = 'update_fingerprint'
+
+# separator of the URLs of the mirrors of a sources list entry
+MIRROR_SEPARATOR = '|'
+
+# latencies of the mirrors measured by the last update
+MIRRORS_FILE = 'mirrors.json'
+
+# prefix of cache index entries whose data is read from the system cache
+SYSTEM_CACHE_PREFIX = '#system '
+
+# prefix of cache index entries of sources skipped by the last update
+NOT_FETCHED_PREFIX = '#not-fetched '
+
+# name of the precompiled merged view of the sources cache
+SNAPSHOT_CACHE = 'snapshot'
+
+# name of the random-access index of the rosdep keys of all cached sources
+KEY_INDEX = 'keys.sqlite'
+
 # extension for binary cache
 PICKLE_CACHE_EXT = '.pickle'
+# extension for the metadata (HTTP validators) stored next to a cache file
+META_CACHE_EXT = '.meta'
+
+# compression of the cache files of the sources, selected per sources
+# cache and stored in this file of it
+CACHE_COMPRESSION_FILE = 'compression'
+CACHE_COMPRESSION_NONE = 'none'
 SOURCE_PATH_ENV = 'ROSDEP_SOURCE_PATH'
 
 
@@ -119,6 +182,78 @@ def get_sources_cache_dir():
     return os.path.join(ros_home, 'rosdep', SOURCES_CACHE_DIR)
 
 
+def get_system_sources_cache_dir():
+    """
+    :returns: path of the system-wide sources cache, or ``None`` if it
+        is disabled
+    """
+    return os.environ.get(SYSTEM_CACHE_ENV, SYSTEM_SOURCES_CACHE_DIR) or None
+
+
+def _is_default_sources_cache_dir(sources_cache_dir):
+    return sources_cache_dir is None or \
+        os.path.abspath(sources_cache_dir) == os.path.abspath(get_sources_cache_dir())
+
+
+def _get_system_cache_generation():
+    """
+    :returns: current generation of the system cache, or ``None`` if
+        there is no system cache
+    """
+    system_cache_dir = get_system_sources_cache_dir()
+    if system_cache_dir is None:
+        return None
+    system_cache_dir = get_current_generation(system_cache_dir)
+    if not os.path.exists(os.path.join(system_cache_dir, CACHE_INDEX)):
+        return None
+    return system_cache_dir
+
+
+def _is_system_sources_cache_dir(sources_cache_dir):
+    system_cache_dir = get_system_sources_cache_dir()
+    return system_cache_dir is not None and \
+        os.path.abspath(sources_cache_dir) == os.path.abspath(system_cache_dir)
+
+
+def _get_system_cache_layer(sources_cache_dir):
+    """
+    :returns: current generation of the system cache if it is layered
+        below *sources_cache_dir*, else ``None``
+    """
+    if not _is_default_sources_cache_dir(sources_cache_dir) or \
+            _is_system_sources_cache_dir(sources_cache_dir or get_sources_cache_dir()):
+        return None
+    return _get_system_cache_generation()
+
+
+def _make_readable_if_shared(sources_cache_dir, target_dir):
+    """
+    Make the files written to *target_dir* readable by all users if
+    *sources_cache_dir* is the system cache.  The cache files are
+    created only accessible by the owner.
+    """
+    if not _is_system_sources_cache_dir(sources_cache_dir):
+        return
+    for dirpath, dirnames, filenames in os.walk(target_dir):
+        os.chmod(dirpath, 0o755)
+        for filename in filenames:
+            os.chmod(os.path.join(dirpath, filename), 0o644)
+
+
+def get_readable_sources_cache_dir(sources_cache_dir=None):
+    """
+    :param sources_cache_dir: override sources cache directory
+    :returns: current generation of the sources cache to read.  This
+        is the system cache if *sources_cache_dir* is the default
+        sources cache of the user and it was not updated yet.
+    """
+    user_cache = _is_default_sources_cache_dir(sources_cache_dir)
+    sources_cache_dir = get_current_generation(sources_cache_dir or get_sources_cache_dir())
+    if user_cache and not os.path.exists(os.path.join(sources_cache_dir, CACHE_INDEX)):
+        return _get_system_cache_generation() or sources_cache_dir
+    return sources_cache_dir
+
+
 # Default rosdep.yaml format.  For now this is the only valid type and
 # is specified for future compatibility.
 TYPE_YAML = 'yaml'
@@ -129,7 +264,14 @@ VALID_TYPES = [TYPE_YAML, TYPE_GBPDISTRO]
 
 class DataSource(object):
 
-    def __init__(self, type_, url, tags, origin=None):
+    #: measurements of the last update of the source, ``dict``, see
+    #: :func:`update_sources_list`
+    stats = None
+
+    #: URLs of the same data on other mirrors, ``[str]``
+    mirrors = ()
+
+    def __init__(self, type_, url, tags, origin=None, mirrors=None):
         """
         :param type_: data source type, e.g. TYPE_YAML, TYPE_GBPDISTRO
 
@@ -139,15 +281,18 @@ class DataSource(object):
 
         :param tags: tags for matching data source to configurations
         :param origin: filename or other indicator of where data came from for debugging.
+        :param mirrors: URLs of the same data on other mirrors, which
+          must validate like *url*.  The data is cached under *url*.
 
         :raises: :exc:`ValueError` if parameters do not validate
         """
         # validate inputs
         if type_ not in VALID_TYPES:
             raise ValueError('type must be one of [%s]' % (','.join(VALID_TYPES)))
-        parsed = urlparse.urlparse(url)
-        if not parsed.scheme or (parsed.scheme != 'file' and not parsed.netloc) or parsed.path in ('', '/'):
-            raise ValueError('url must be a fully-specified URL with scheme, hostname, and path: %s' % (str(url)))
+        for u in [url] + list(mirrors or []):
+            parsed = urlparse.urlparse(u)
+            if not parsed.scheme or (parsed.scheme != 'file' and not parsed.netloc) or parsed.path in ('', '/'):
+                raise ValueError('url must be a fully-specified URL with scheme, hostname, and path: %s' % (str(u)))
         if not type(tags) == list:
             raise ValueError('tags must be a list: %s' % (str(tags)))
 
@@ -155,6 +300,7 @@ class DataSource(object):
         self.tags = tags
 
         self.url = url
+        self.mirrors = list(mirrors or [])
         self.origin = origin
 
     def __eq__(self, other):
@@ -162,13 +308,15 @@ class DataSource(object):
             self.type == other.type and \
             self.tags == other.tags and \
             self.url == other.url and \
+            list(self.mirrors) == list(other.mirrors) and \
             self.origin == other.origin
 
     def __str__(self):
+        url = MIRROR_SEPARATOR.join([self.url] + list(self.mirrors))
         if self.origin:
-            return '[%s]:\n%s %s %s' % (self.origin, self.type, self.url, ' '.join(self.tags))
+            return '[%s]:\n%s %s %s' % (self.origin, self.type, url, ' '.join(self.tags))
         else:
-            return '%s %s %s' % (self.type, self.url, ' '.join(self.tags))
+            return '%s %s %s' % (self.type, url, ' '.join(self.tags))
 
     def __repr__(self):
         return repr((self.type, self.url, self.tags, self.origin))
@@ -185,42 +333,64 @@ class RosDistroSource(DataSource):
 
 # create function we can pass in as model to parse_source_data.  The
 # function emulates the CachedDataSource constructor but does the
-# necessary full filepath calculation and loading of data.
+# necessary full filepath calculation.  The data is loaded on first
+# access, so that sources can be filtered by tags without loading them.
 
 
 def cache_data_source_loader(sources_cache_dir, verbose=False):
-    def create_model(type_, uri, tags, origin=None):
+    def create_model(type_, uri, tags, origin=None, mirrors=None):
         # compute the filename has from the URL
         filename = compute_filename_hash(uri)
         filepath = os.path.join(sources_cache_dir, filename)
-        pickle_filepath = filepath + PICKLE_CACHE_EXT
-        if os.path.exists(pickle_filepath):
-            if verbose:
-                print('loading cached data source:\n\t%s\n\t%s' % (uri, pickle_filepath), file=sys.stderr)
-            with open(pickle_filepath, 'rb') as f:
-                rosdep_data = pickle.loads(f.read())
-        elif os.path.exists(filepath):
-            if verbose:
-                print('loading cached data source:\n\t%s\n\t%s' % (uri, filepath), file=sys.stderr)
-            with open(filepath) as f:
-                rosdep_data = yaml.safe_load(f.read())
-        else:
-            rosdep_data = {}
-        return CachedDataSource(type_, uri, tags, rosdep_data, origin=filepath)
+
+        def load_data():
+            pickle_filepath = filepath + PICKLE_CACHE_EXT
+            if os.path.exists(pickle_filepath):
+                if verbose:
+                    print('loading cached data source:\n\t%s\n\t%s' % (uri, pickle_filepath), file=sys.stderr)
+                with open(pickle_filepath, 'rb') as f:
+                    return pickle.loads(decompress_cache_data(f.read()))
+            elif os.path.exists(filepath):
+                if verbose:
+                    print('loading cached data source:\n\t%s\n\t%s' % (uri, filepath), file=sys.stderr)
+                with open(filepath) as f:
+                    return yaml.safe_load(f.read())
+            return {}
+        return CachedDataSource(type_, uri, tags, None, origin=filepath, load_data=load_data)
     return create_model
 
 
 class CachedDataSource(object):
 
-    def __init__(self, type_, url, tags, rosdep_data, origin=None):
+    def __init__(self, type_, url, tags, rosdep_data, origin=None, load_data=None):
         """
         Stores data source and loaded rosdep data for that source.
 
         NOTE: this is not a subclass of DataSource, though it's API is
         duck-type compatible with the DataSource API.
+
+        :param load_data: fn() returning the rosdep data.  If set
+            instead of *rosdep_data*, it is called on the first access
+            of :attr:`rosdep_data`.
         """
         self.source = DataSource(type_, url, tags, origin=origin)
-        self.rosdep_data = rosdep_data
+        self._rosdep_data = rosdep_data
+        self._load_data = load_data
+
+    @property
+    def rosdep_data(self):
+        """
+        :returns: rosdep data of the source
+        """
+        if self._load_data is not None:
+            self._rosdep_data = self._load_data()
+            self._load_data = None
+        return self._rosdep_data
+
+    @rosdep_data.setter
+    def rosdep_data(self, rosdep_data):
+        self._rosdep_data = rosdep_data
+        self._load_data = None
 
     def __eq__(self, other):
         try:
@@ -303,18 +473,49 @@ def download_rosdep_data(url):
     :raises: :exc:`DownloadFailure` If data cannot be
         retrieved (e.g. 404, bad YAML format, server down).
     """
+    return download_rosdep_data_if_modified(url)[0]
+
+
+def download_rosdep_data_if_modified(url, cache_meta=None, stats=None):
+    """
+    Download rosdep data, sending a conditional request based on the
+    validators of a previous download.
+
+    :param cache_meta: metadata of a previous download as returned by
+        this function, or ``None`` to download unconditionally
+    :param stats: ``dict`` to add the download measurements and the
+        ``parse_time`` to, see :func:`update_sources_list`
+    :returns: (rosdep_data, cache_meta) tuple.  *rosdep_data* is
+        ``None`` if the server reports that the data has not been
+        modified since the previous download, or if the downloaded
+        content is identical to it.
+    :raises: :exc:`DownloadFailure` If data cannot be
+        retrieved (e.g. 404, bad YAML format, server down).
+    """
+    text, new_cache_meta = _download_rosdep_text_if_modified(url, cache_meta, stats)
+    if text is None:
+        return None, new_cache_meta
+    return _parse_rosdep_data(url, text, stats), new_cache_meta
+
+
+def _download_rosdep_text_if_modified(url, cache_meta, stats, mirrors=None):
     try:
-        f = urlopen(url, timeout=DOWNLOAD_TIMEOUT)
-        text = f.read()
-        f.close()
-        data = yaml.safe_load(text)
-        if type(data) != dict:
-            raise DownloadFailure('rosdep data from [%s] is not a YAML dictionary' % (url))
-        return data
+        return download_if_modified(url, cache_meta, timeout=DOWNLOAD_TIMEOUT, stats=stats, mirrors=mirrors)
     except (URLError, httplib.HTTPException) as e:
         raise DownloadFailure(str(e) + ' (%s)' % url)
+
+
+def _parse_rosdep_data(url, text, stats):
+    start = time.time()
+    try:
+        data = yaml.safe_load(text)
     except yaml.YAMLError as e:
         raise DownloadFailure(str(e))
+    finally:
+        add_stats(stats, parse_time=time.time() - start)
+    if type(data) != dict:
+        raise DownloadFailure('rosdep data from [%s] is not a YAML dictionary' % (url))
+    return data
 
 
 def download_default_sources_list(url=DEFAULT_SOURCES_LIST_URL):
@@ -352,14 +553,17 @@ def parse_sources_data(data, origin='<string>', model=None):
     Parse sources file format (tags optional)::
 
       # comments and empty lines allowed
-      <type> <uri> [tags]
+      <type> <uri>[|<mirror uri>...] [tags]
 
     e.g.::
 
       yaml http://foo/rosdep.yaml fuerte lucid ubuntu
+      yaml http://foo/rosdep.yaml|http://mirror.foo/rosdep.yaml
 
     If tags are specified, *all* tags must match the current
-    configuration for the sources data to be used.
+    configuration for the sources data to be used.  The data of an
+    entry with mirrors is downloaded from the fastest of them, and
+    cached under the first URL.
 
     :param data: data in sources file format
     :param model: model to load data into.  Defaults to :class:`DataSource`
@@ -380,10 +584,13 @@ def parse_sources_data(data, origin='<string>', model=None):
         if len(splits) < 2:
             raise InvalidData('invalid line:\n%s' % (line), origin=origin)
         type_ = splits[0]
-        url = splits[1]
+        urls = splits[1].split(MIRROR_SEPARATOR)
         tags = splits[2:]
         try:
-            sources.append(model(type_, url, tags, origin=origin))
+            if len(urls) > 1:
+                sources.append(model(type_, urls[0], tags, origin=origin, mirrors=urls[1:]))
+            else:
+                sources.append(model(type_, urls[0], tags, origin=origin))
         except ValueError as e:
             raise InvalidData('line:\n\t%s\n%s' % (line, e), origin=origin)
     return sources
@@ -438,15 +645,364 @@ def _generate_key_from_urls(urls):
     return '^'.join(urls if isinstance(urls, list) else [urls])
 
 
+def _run_update_pipeline(updates, fetch, convert, persist, jobs):
+    """
+    Pass *updates* through the fetch, convert and persist stages of
+    the update.  Up to *jobs* downloads run at the same time, while
+    the data of earlier downloads is parsed and written to the cache.
+
+    :returns: list of *updates* in the same order
+    """
+    if jobs is None:
+        jobs = DEFAULT_UPDATE_JOBS
+    stages = [(fetch, min(jobs, len(updates))), (convert, 1), (persist, 1)]
+    return run_pipeline(updates, stages, queue_size=UPDATE_QUEUE_SIZE)
+
+
+class _SourceUpdate(object):
+    """
+    State of the update of a sources list entry or rosdistro
+    distribution while it passes through the update pipeline.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.stats = {}
+        self.text = None
+        self.rosdep_data = None
+        self.cache_meta = None
+        self.cache_files = []
+        # {cache file path: rosdep data} written by the update
+        self.written_data = {}
+        self.unchanged = False
+        self.error = None
+
+
+def _fetch_source(sources_cache_dir, compression, update):
+    source = update.source
+    try:
+        if source.type == TYPE_YAML:
+            old_cache_meta = read_cache_meta(sources_cache_dir, source.url)
+            if old_cache_meta is not None and \
+                    old_cache_meta.get('compression', CACHE_COMPRESSION_NONE) != compression:
+                # download again to write the cache file with the
+                # selected compression
+                old_cache_meta = None
+            update.text, update.cache_meta = _download_rosdep_text_if_modified(
+                source.url, old_cache_meta, update.stats, mirrors=source.mirrors)
+            update.cache_meta['compression'] = compression
+            if update.text is None:
+                # unchanged: keep the existing cache file as is
+                update.unchanged = True
+                update.cache_files = [os.path.join(sources_cache_dir, compute_filename_hash(source.url))]
+                if update.cache_meta != old_cache_meta:
+                    write_cache_meta(sources_cache_dir, source.url, update.cache_meta)
+        elif source.type == TYPE_GBPDISTRO:  # DEPRECATED, do not use this file. See REP137
+            update.rosdep_data = download_gbpdistro_as_rosdep_data(source.url)
+    except DownloadFailure as e:
+        update.error = e
+    return update
+
+
+def _parse_source(update):
+    if update.text is not None:
+        try:
+            update.rosdep_data = _parse_rosdep_data(update.source.url, update.text, update.stats)
+        except DownloadFailure as e:
+            update.error = e
+        update.text = None
+    return update
+
+
+def _persist_source(sources_cache_dir, compression, update):
+    if update.rosdep_data is not None:
+        update.cache_files = [write_cache_file(
+            sources_cache_dir, update.source.url, update.rosdep_data, update.cache_meta,
+            stats=update.stats, compression=compression)]
+        update.written_data[update.cache_files[0]] = update.rosdep_data
+        update.rosdep_data = None
+    return update
+
+
+def _generate_shard_key(key, os_name):
+    # a URL fragment keeps the key a valid URL for the cache index
+    return '%s#%s' % (key, os_name)
+
+
+def split_rosdep_data_by_os(rosdep_data):
+    """
+    Split rosdep data into one shard per OS name.  Entries of a rosdep
+    key that are not OS rules, i.e. flags like ``_is_ros``, stay with
+    the key.
+
+    :returns: (keys_data, {os_name: shard_data}), where *keys_data*
+        maps every rosdep key to its flags.
+    """
+    keys_data = {}
+    shards = {}
+    for rosdep_key, data in rosdep_data.items():
+        keys_data[rosdep_key] = {}
+        for os_name, rules in data.items():
+            if os_name.startswith('_'):
+                keys_data[rosdep_key][os_name] = rules
+            else:
+                shards.setdefault(os_name, {})[rosdep_key] = {os_name: rules}
+    return keys_data, shards
+
+
+def _get_distro_generation(dist_name, platforms, shard_platforms, compression=CACHE_COMPRESSION_NONE, stats=None):
+    """
+    :returns: everything the cache files of *dist_name* are generated
+        from, ``dict``
+    """
+    return {
+        'distribution_digest': get_release_file_digest(dist_name, stats=stats),
+        'platforms': sorted(platforms) if platforms is not None else None,
+        'shard_platforms': shard_platforms,
+        'compression': compression,
+        'homebrew_tap': os.environ.get('ROSDEP_HOMEBREW_TAP', 'ros'),
+        'rosdep_version': __version__,
+    }
+
+
+def _get_distro_key(dist_name):
+    # dist_files can either be a string (single filename) or a list (list of filenames)
+    return _generate_key_from_urls(get_index().distributions[dist_name]['distribution'])
+
+
+def _fetch_distro(sources_cache_dir, platforms, shard_platforms, compression, update):
+    """
+    Download the distribution file of a rosdistro distribution and
+    check if the cache files generated from it are still up to date.
+    The *cache_files* of the update are (os_name, name of cache file)
+    pairs.  The os_name is ``None`` for the cache file of the
+    distribution, or the name of the OS of a shard if
+    *shard_platforms* is set.
+    """
+    dist_name = update.source
+    key = _get_distro_key(dist_name)
+    generation = _get_distro_generation(dist_name, platforms, shard_platforms, compression, stats=update.stats)
+    cache_meta = read_cache_meta(sources_cache_dir, key)
+    if cache_meta is not None and cache_meta.get('generation') == generation:
+        cache_files = [(None, os.path.join(sources_cache_dir, compute_filename_hash(key)))]
+        for os_name in cache_meta.get('shards', []):
+            shard_key = _generate_shard_key(key, os_name)
+            cache_files.append((os_name, os.path.join(sources_cache_dir, compute_filename_hash(shard_key))))
+        if all(os.path.exists(filepath + PICKLE_CACHE_EXT) for _, filepath in cache_files):
+            update.cache_files = cache_files
+            update.unchanged = True
+            return update
+    update.cache_meta = {'generation': generation, 'shards': []}
+    return update
+
+
+def _convert_distro(platforms, update):
+    if not update.unchanged:
+        start = time.time()
+        update.rosdep_data = get_gbprepo_as_rosdep_data(update.source, platforms=platforms)
+        add_stats(update.stats, parse_time=time.time() - start)
+    return update
+
+
+def _persist_distro(sources_cache_dir, shard_platforms, compression, update):
+    if update.unchanged:
+        return update
+    key = _get_distro_key(update.source)
+    rosdep_data, update.rosdep_data = update.rosdep_data, None
+    if not shard_platforms:
+        update.cache_files = [(None, write_cache_file(sources_cache_dir, key, rosdep_data, update.cache_meta,
+                                                      stats=update.stats, compression=compression))]
+        update.written_data[update.cache_files[0][1]] = rosdep_data
+        return update
+    keys_data, shards = split_rosdep_data_by_os(rosdep_data)
+    shard_files = []
+    for os_name in sorted(shards.keys()):
+        shard_key = _generate_shard_key(key, os_name)
+        shard_files.append((os_name, write_cache_file(sources_cache_dir, shard_key, shards[os_name],
+                                                      stats=update.stats, compression=compression)))
+        update.written_data[shard_files[-1][1]] = shards[os_name]
+    # written last, so that the shards exist if the metadata does
+    update.cache_meta['shards'] = sorted(shards.keys())
+    update.cache_files = [(None, write_cache_file(sources_cache_dir, key, keys_data, update.cache_meta,
+                                                  stats=update.stats, compression=compression))] + shard_files
+    update.written_data[update.cache_files[0][1]] = keys_data
+    return update
+
+
+def _get_dist_names(skip_eol_distros, matcher=None, not_fetched=None):
+    dist_names = []
+    for dist_name in sorted(get_index().distributions.keys()):
+        distribution = get_index().distributions[dist_name]
+        if skip_eol_distros:
+            if distribution.get('distribution_status') == 'end-of-life':
+                print('Skip end-of-life distro "%s"' % dist_name)
+                continue
+        if matcher is not None:
+            rds = RosDistroSource(dist_name)
+            if not matcher.matches(rds):
+                print('Skip non-matching distro "%s"' % dist_name)
+                not_fetched.append(rds)
+                continue
+        print('Add distro "%s"' % dist_name)
+        dist_names.append(dist_name)
+    return dist_names
+
+
+def _filter_matching_sources(sources, matcher, not_fetched):
+    """
+    :returns: the sources matching *matcher*.  The others are appended
+        to *not_fetched*.
+    """
+    matching = []
+    for source in sources:
+        if matcher.matches(source):
+            matching.append(source)
+        else:
+            print('Skip non-matching source "%s"' % source.url)
+            not_fetched.append(source)
+    return matching
+
+
+def _write_cache_index(sources_cache_dir, sources, not_fetched, system_provided=()):
+    cache_index = os.path.join(sources_cache_dir, CACHE_INDEX)
+    data = "#autogenerated by rosdep, do not edit. use 'rosdep update' instead\n"
+    system_ids = set(id(source) for source in system_provided)
+    for source in sources:
+        url = _generate_key_from_urls(source.url)
+        prefix = SYSTEM_CACHE_PREFIX if id(source) in system_ids else ''
+        data += prefix + 'yaml %s %s\n' % (url, ' '.join(source.tags))
+    # skipped sources are commented out, so that their data from an
+    # earlier update is not loaded
+    for source in not_fetched:
+        url = _generate_key_from_urls(source.url)
+        data += NOT_FETCHED_PREFIX + 'yaml %s %s\n' % (url, ' '.join(source.tags))
+    write_atomic(cache_index, data)
+
+
+def _read_system_entries(system_cache_dir):
+    """
+    :returns: entries of the cache index of the system cache by the
+        key of the source or distribution they were generated from,
+        ``{str: [DataSource]}``
+    """
+    if system_cache_dir is None:
+        return {}
+    cache_index = os.path.join(system_cache_dir, CACHE_INDEX)
+    try:
+        with open(cache_index, 'r') as f:
+            cache_data = f.read()
+    except (IOError, OSError):
+        return {}
+    entries = {}
+    for source in parse_sources_data(cache_data, origin=cache_index):
+        # without the OS of a shard
+        entries.setdefault(source.url.split('#', 1)[0], []).append(source)
+    return entries
+
+
+def _split_system_provided(sources, system_entries):
+    """
+    :returns: (sources to fetch, sources provided by the system cache)
+    """
+    fetch = []
+    provided = []
+    for source in sources:
+        if source.type == TYPE_YAML and source.url in system_entries:
+            print('Use system cache for "%s"' % source.url)
+            provided.append(source)
+        else:
+            fetch.append(source)
+    return fetch, provided
+
+
+def _load_mirror_latencies(sources_cache_dir):
+    """
+    Restore the mirror latencies measured by the last update, so that
+    the fastest mirror is used from the start.
+    """
+    try:
+        with open(os.path.join(sources_cache_dir, MIRRORS_FILE), 'r') as f:
+            state = json.loads(f.read())
+    except (IOError, OSError, ValueError):
+        return
+    if isinstance(state, dict):
+        get_mirror_selector().set_state(state)
+
+
+def _save_mirror_latencies(sources_cache_dir):
+    state = get_mirror_selector().get_state()
+    if state:
+        write_atomic(os.path.join(sources_cache_dir, MIRRORS_FILE), json.dumps(state, sort_keys=True))
+
+
+def _call_handlers(handlers, source, unchanged, error, stats):
+    """
+    Call the (success_handler, error_handler, unchanged_handler)
+    *handlers* of :func:`update_sources_list` for *source*.
+    """
+    success_handler, error_handler, unchanged_handler = handlers
+    source.stats = stats
+    if error is not None:
+        if error_handler is not None:
+            error_handler(source, error)
+        return
+    if success_handler is not None:
+        success_handler(source)
+    if unchanged and unchanged_handler is not None:
+        unchanged_handler(source)
+
+
+def _get_distro_shard_source(rds, os_name):
+    """
+    :returns: :class:`DataSource` for the cache index entry of the
+        *os_name* shard of the distribution of *rds*
+    """
+    if os_name is None:
+        return rds
+    url = _generate_shard_key(_generate_key_from_urls(rds.url), os_name)
+    return DataSource(TYPE_YAML, url, rds.tags + [os_name])
+
+
 def update_sources_list(sources_list_dir=None, sources_cache_dir=None,
                         success_handler=None, error_handler=None,
-                        skip_eol_distros=False):
+                        skip_eol_distros=False, jobs=None,
+                        unchanged_handler=None, os_override=None,
+                        platforms=None, shard_platforms=False,
+                        only_matching=False, compression=None,
+                        cache_handler=None, snapshot=True):
     """
     Re-downloaded data from remote sources and store in cache.  Also
     update the cache index based on current sources.
 
+    Sources and distributions are fetched by a pool of worker threads,
+    but *success_handler* and *error_handler* are always called from
+    the calling thread in sources list order.
+
+    Each source passed to the handlers carries the measurements of its
+    update in :attr:`DataSource.stats`: the number of ``requests``, the
+    ``bytes`` received, the ``connect_time`` (DNS lookup and connect),
+    ``transfer_time`` and ``parse_time``, and the size of the written
+    cache files (``pickle_bytes``) and the ``write_time``, all times in
+    seconds.  The handlers are also called for each rosdistro
+    distribution, as :class:`RosDistroSource`.
+
+    Where supported, the update holds a lock on the sources cache and
+    writes a new generation of it, which replaces the current one
+    atomically once complete (see :mod:`rosdep2.cache_generations`).
+    An update which had to wait for a concurrent update with the same
+    sources list and options reuses its result instead of downloading
+    everything again, and returns the cache files of that result.
+
+    If the default sources cache of the user is updated and a system
+    cache exists (see :func:`get_system_sources_cache_dir`), the
+    sources and distributions cached there are not fetched again.  The
+    cache index refers to them instead and their data is read from the
+    system cache.  An update of the system cache makes its files
+    readable by all users.
+
     :param sources_list_dir: override source list directory
-    :param sources_cache_dir: override sources cache directory
+    :param sources_cache_dir: override sources cache directory.
+        Defaults to the sources cache of the user.
     :param success_handler: fn(DataSource) to call if a particular
         source loads successfully.  This hook is mainly for printing
         errors to console.
@@ -454,80 +1010,269 @@ def update_sources_list(sources_list_dir=None, sources_cache_dir=None,
         if a particular source fails.  This hook is mainly for
         printing errors to console.
     :param skip_eol_distros: skip downloading sources for EOL distros
+    :param jobs: maximum number of sources to fetch in parallel.
+        Defaults to ``DEFAULT_UPDATE_JOBS``.
+    :param unchanged_handler: fn(DataSource) to call, after
+        *success_handler*, if the data of a particular source did not
+        change since the last update and its cache file was kept.
+    :param os_override: (os_name, os_codename) tuple to override OS
+        detection when selecting the sources for the merged snapshot
+    :param platforms: OS names to generate rosdistro rules for,
+        ``[str]``.  Defaults to all platforms of each distribution.
+    :param shard_platforms: store the rosdistro rules of each OS as a
+        separate cache index entry tagged with the OS name, so that
+        only the rules for the current OS are loaded.
+    :param only_matching: only fetch the sources and distributions
+        that match the configuration of this host (see
+        :meth:`DataSourceMatcher.create_default`).  The others are
+        marked as not fetched in the cache index and are not loaded.
+    :param compression: compression of the cache files, one of
+        :func:`get_cache_compressions`.  The selection is stored in the
+        cache and applies to later updates, which keep it by default.
+    :param cache_handler: fn(sources_cache_dir) to call with the
+        directory of the updated sources cache before it replaces the
+        current one, while the lock is held, e.g. to add files derived
+        from the cache.
+    :param snapshot: write the merged snapshot of the sources matching
+        this host, see :func:`write_cache_snapshot`.  It is only
+        rebuilt if the cache changed.
 
     :returns: list of (`DataSource`, cache_file_path) pairs for cache
         files that were updated, ``[str]``
+    :raises: :exc:`CachePermissionError` if the sources cache cannot
+        be locked
     :raises: :exc:`InvalidData` If any of the sources list files is invalid
+    :raises: :exc:`ValueError` if *compression* is not supported
     :raises: :exc:`OSError` if *sources_list_dir* cannot be read.
     :raises: :exc:`IOError` If *sources_list_dir* cannot be read or cache data cannot be written
     """
+    system_cache_dir = _get_system_cache_layer(sources_cache_dir)
     if sources_cache_dir is None:
         sources_cache_dir = get_sources_cache_dir()
+    fingerprint = _get_update_fingerprint(
+        sources_list_dir, skip_eol_distros=skip_eol_distros, os_override=os_override,
+        platforms=platforms, shard_platforms=shard_platforms, only_matching=only_matching,
+        compression=compression, snapshot=snapshot, system_cache_dir=system_cache_dir)
 
+    def update(target_dir):
+        rosdistro_cache_dir = get_rosdistro_cache_dir()
+        try:
+            retval = _update_sources_cache(target_dir, sources_list_dir, success_handler, error_handler,
+                                           skip_eol_distros, jobs, unchanged_handler, os_override,
+                                           platforms, shard_platforms, only_matching, compression,
+                                           system_cache_dir, snapshot)
+        finally:
+            # the rosdistro files are only kept in the cache being updated
+            set_cache_dir(rosdistro_cache_dir)
+        if cache_handler is not None:
+            cache_handler(target_dir)
+        write_atomic(os.path.join(target_dir, UPDATE_FINGERPRINT_FILE), fingerprint)
+        _make_readable_if_shared(sources_cache_dir, target_dir)
+        return retval
+
+    if not supports_generations():
+        return update(sources_cache_dir)
+    return _update_generation(sources_cache_dir, update, fingerprint)
+
+
+def _get_update_fingerprint(sources_list_dir, **options):
+    """
+    :returns: digest of the sources list and of the *options* of an
+        update, ``str``
+    :raises: :exc:`InvalidData` If any of the sources list files is invalid
+    """
+    sources = [str(source) for source in parse_sources_list(sources_list_dir=sources_list_dir)]
+    data = json.dumps([sources, sorted(options.items())], sort_keys=True)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def _read_update_fingerprint(sources_cache_dir):
+    try:
+        with open(os.path.join(sources_cache_dir, UPDATE_FINGERPRINT_FILE), 'r') as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def _update_generation(sources_cache_dir, update, fingerprint):
+    """
+    Run *update* on a new generation of *sources_cache_dir* and
+    publish it, holding the lock of the sources cache.
+    """
+    current_generation = get_current_generation(sources_cache_dir)
+    lock = SourcesCacheLock(sources_cache_dir)
+    try:
+        lock.acquire()
+    except OSError as e:
+        raise CachePermissionError('Failed to lock sources cache: ' + str(e))
+    try:
+        if lock.waited and get_current_generation(sources_cache_dir) != current_generation and \
+                _read_update_fingerprint(sources_cache_dir) == fingerprint:
+            print('Using the sources cache written by the concurrent update')
+            return _get_cache_files(sources_cache_dir)
+        generation_dir = create_generation(sources_cache_dir)
+        try:
+            retval = update(generation_dir)
+            publish_generation(sources_cache_dir, generation_dir)
+        except BaseException:
+            discard_generation(generation_dir)
+            raise
+    finally:
+        lock.release()
+    # the cache files as seen through the sources cache path
+    return [(source, os.path.join(sources_cache_dir, os.path.relpath(filepath, generation_dir)))
+            for source, filepath in retval]
+
+
+def _get_cache_files(sources_cache_dir):
+    """
+    :returns: list of (:class:`CachedDataSource`, cache_file_path)
+        pairs for the cache files of *sources_cache_dir* itself, like
+        :func:`update_sources_list` returns them
+    """
+    cache_index = os.path.join(sources_cache_dir, CACHE_INDEX)
+    with open(cache_index, 'r') as f:
+        cache_data = f.read()
+    return [(source, source.origin) for source in _parse_cache_index(cache_data, cache_index, sources_cache_dir)
+            if os.path.dirname(source.origin) == sources_cache_dir and
+            os.path.exists(source.origin + PICKLE_CACHE_EXT)]
+
+
+def _update_sources_cache(sources_cache_dir, sources_list_dir, success_handler, error_handler,
+                          skip_eol_distros, jobs, unchanged_handler, os_override,
+                          platforms, shard_platforms, only_matching, compression,
+                          system_cache_dir=None, snapshot=True):
+    """
+    Update the sources cache in *sources_cache_dir* in place, see
+    :func:`update_sources_list`.
+    """
     sources = parse_sources_list(sources_list_dir=sources_list_dir)
-    retval = []
     for source in list(sources):
-        try:
-            if source.type == TYPE_YAML:
-                rosdep_data = download_rosdep_data(source.url)
-            elif source.type == TYPE_GBPDISTRO:  # DEPRECATED, do not use this file. See REP137
-                if not source.tags[0] in ['electric', 'fuerte']:
-                    print('Ignore legacy gbpdistro "%s"' % source.tags[0])
-                    sources.remove(source)
-                    continue  # do not store this entry in the cache
-                rosdep_data = download_gbpdistro_as_rosdep_data(source.url)
-            retval.append((source, write_cache_file(sources_cache_dir, source.url, rosdep_data)))
-            if success_handler is not None:
-                success_handler(source)
-        except DownloadFailure as e:
-            if error_handler is not None:
-                error_handler(source, e)
+        if source.type == TYPE_GBPDISTRO and not source.tags[0] in ['electric', 'fuerte']:
+            print('Ignore legacy gbpdistro "%s"' % source.tags[0])
+            sources.remove(source)  # do not store this entry in the cache
+
+    try:
+        matcher = DataSourceMatcher.create_default(os_override=os_override)
+    except rospkg.os_detect.OsNotDetected:
+        matcher = None
+    not_fetched = []
+    if only_matching and matcher is None:
+        print('Cannot detect the OS, fetching all sources')
+    elif only_matching:
+        sources = _filter_matching_sources(sources, matcher, not_fetched)
+
+    # create the cache directory up front so that workers do not race
+    if not os.path.exists(sources_cache_dir):
+        os.makedirs(sources_cache_dir)
+    if compression is None:
+        compression = get_cache_compression(sources_cache_dir)
+    else:
+        set_cache_compression(sources_cache_dir, compression)
+    _load_mirror_latencies(sources_cache_dir)
+    system_entries = _read_system_entries(system_cache_dir)
+    fetch_sources, system_provided = _split_system_provided(sources, system_entries)
+    updates = _run_update_pipeline(
+        [_SourceUpdate(source) for source in fetch_sources],
+        lambda update: _fetch_source(sources_cache_dir, compression, update),
+        _parse_source,
+        lambda update: _persist_source(sources_cache_dir, compression, update),
+        jobs)
+    handlers = (success_handler, error_handler, unchanged_handler)
+    retval = []
+    written_data = {}
+    for update in updates:
+        if update.error is None:
+            retval.append((update.source, update.cache_files[0]))
+        written_data.update(update.written_data)
+        _call_handlers(handlers, update.source, update.unchanged, update.error, update.stats)
 
     # Additional sources for ros distros
     # In compliance with REP137 and REP143
+    rosdistro_cache_dir = os.path.join(sources_cache_dir, ROSDISTRO_CACHE_DIR)
+    if not os.path.exists(rosdistro_cache_dir):
+        os.makedirs(rosdistro_cache_dir)
+    set_cache_dir(rosdistro_cache_dir)
     print('Query rosdistro index %s' % get_index_url())
-    for dist_name in sorted(get_index().distributions.keys()):
-        distribution = get_index().distributions[dist_name]
-        if skip_eol_distros:
-            if distribution.get('distribution_status') == 'end-of-life':
-                print('Skip end-of-life distro "%s"' % dist_name)
-                continue
-        print('Add distro "%s"' % dist_name)
-        rds = RosDistroSource(dist_name)
-        rosdep_data = get_gbprepo_as_rosdep_data(dist_name)
-        # dist_files can either be a string (single filename) or a list (list of filenames)
-        dist_files = distribution['distribution']
-        key = _generate_key_from_urls(dist_files)
-        retval.append((rds, write_cache_file(sources_cache_dir, key, rosdep_data)))
-        sources.append(rds)
+    dist_names = _get_dist_names(skip_eol_distros, matcher if only_matching else None, not_fetched)
+    updates = _run_update_pipeline(
+        [_SourceUpdate(dist_name) for dist_name in dist_names if _get_distro_key(dist_name) not in system_entries],
+        lambda update: _fetch_distro(sources_cache_dir, platforms, shard_platforms, compression, update),
+        lambda update: _convert_distro(platforms, update),
+        lambda update: _persist_distro(sources_cache_dir, shard_platforms, compression, update),
+        jobs)
+    updates = dict((update.source, update) for update in updates)
+    for dist_name in dist_names:
+        if dist_name not in updates:
+            print('Use system cache for distro "%s"' % dist_name)
+            sources.extend(system_entries[_get_distro_key(dist_name)])
+            system_provided.extend(system_entries[_get_distro_key(dist_name)])
+            continue
+        update = updates[dist_name]
+        written_data.update(update.written_data)
+        rds = RosDistroSource(update.source)
+        for os_name, filepath in update.cache_files:
+            source = _get_distro_shard_source(rds, os_name)
+            retval.append((source, filepath))
+            sources.append(source)
+        _call_handlers(handlers, rds, update.unchanged, None, update.stats)
 
     # Create a combined index of *all* the sources.  We do all the
     # sources regardless of failures because a cache from a previous
     # attempt may still exist.  We have to do this cache index so that
     # loads() see consistent data.
-    if not os.path.exists(sources_cache_dir):
-        os.makedirs(sources_cache_dir)
-    cache_index = os.path.join(sources_cache_dir, CACHE_INDEX)
-    data = "#autogenerated by rosdep, do not edit. use 'rosdep update' instead\n"
-    for source in sources:
-        url = _generate_key_from_urls(source.url)
-        data += 'yaml %s %s\n' % (url, ' '.join(source.tags))
-    write_atomic(cache_index, data)
+    _write_cache_index(sources_cache_dir, sources, not_fetched, system_provided)
+    _save_mirror_latencies(sources_cache_dir)
+
+    # precompile the merged view of the sources this host will load and
+    # the per-key index used by single-key queries
+    cached_sources = _load_updated_sources(sources_cache_dir, written_data)
+    write_cache_snapshot(sources_cache_dir, matcher if snapshot else None, sources=cached_sources)
+    write_key_index(sources_cache_dir, sources=cached_sources)
     # mainly for debugging and testing
     return retval
 
 
+def _load_updated_sources(sources_cache_dir, written_data):
+    """
+    Load the cached sources after an update.  The data of the cache
+    files the update wrote, *written_data*, is used as is instead of
+    being loaded again, the other cache files are only loaded when
+    their data is accessed.
+
+    :param written_data: ``{cache file path: rosdep data}``
+    :returns: list of :class:`CachedDataSource`
+    """
+    sources = load_cached_sources_list(sources_cache_dir=sources_cache_dir)
+    for source in sources:
+        if source.origin in written_data:
+            source.rosdep_data = written_data[source.origin]
+    return sources
+
+
+def get_sources_cache_age(sources_cache_dir=None):
+    """
+    :returns: seconds since the cache index was written by the last
+        ``rosdep update``, or ``None`` if there is no cache index
+    """
+    if sources_cache_dir is None:
+        sources_cache_dir = get_sources_cache_dir()
+    try:
+        return time.time() - os.path.getmtime(os.path.join(sources_cache_dir, CACHE_INDEX))
+    except OSError:
+        return None
+
+
 def load_cached_sources_list(sources_cache_dir=None, verbose=False):
     """
     Load cached data based on the sources list.
 
-    :returns: list of :class:`CachedDataSource` instance with raw
-        rosdep data loaded.
+    :returns: list of :class:`CachedDataSource` instance, which load
+        their raw rosdep data on first access.
     :raises: :exc:`OSError` if cache cannot be read
     :raises: :exc:`IOError` if cache cannot be read
     """
-    if sources_cache_dir is None:
-        sources_cache_dir = get_sources_cache_dir()
+    sources_cache_dir = get_readable_sources_cache_dir(sources_cache_dir)
     cache_index = os.path.join(sources_cache_dir, 'index')
     if not os.path.exists(cache_index):
         if verbose:
@@ -535,9 +1280,372 @@ def load_cached_sources_list(sources_cache_dir=None, verbose=False):
         return []
     with open(cache_index, 'r') as f:
         cache_data = f.read()
+    if verbose:
+        for line in cache_data.splitlines():
+            if line.startswith(NOT_FETCHED_PREFIX):
+                print('not loading source skipped by the last update:\n\t%s' % line[len(NOT_FETCHED_PREFIX):], file=sys.stderr)
+    return _parse_cache_index(cache_data, cache_index, sources_cache_dir, verbose=verbose)
+
+
+def _parse_cache_index(cache_data, cache_index, sources_cache_dir, verbose=False):
+    """
+    Parse the cache index of *sources_cache_dir*.  The data of entries
+    provided by the system cache is loaded from its current generation,
+    in index order with the other entries.
+
+    :returns: list of :class:`CachedDataSource`
+    """
     # the loader does all the work
     model = cache_data_source_loader(sources_cache_dir, verbose=verbose)
-    return parse_sources_data(cache_data, origin=cache_index, model=model)
+    system_model = None
+    system_cache_dir = None
+    sources = []
+    for line in cache_data.splitlines():
+        if not line.startswith(SYSTEM_CACHE_PREFIX):
+            sources.extend(parse_sources_data(line, origin=cache_index, model=model))
+            continue
+        if system_model is None:
+            system_cache_dir = _get_system_cache_generation()
+            system_model = cache_data_source_loader(system_cache_dir or '', verbose=verbose)
+        if system_cache_dir is None:
+            if verbose:
+                print('system cache not available, not loading source:\n\t%s' % line[len(SYSTEM_CACHE_PREFIX):], file=sys.stderr)
+            continue
+        sources.extend(parse_sources_data(line[len(SYSTEM_CACHE_PREFIX):], origin=cache_index, model=system_model))
+    return sources
+
+
+def compute_cache_digest(sources_cache_dir):
+    """
+    Compute a digest of the current state of the sources cache, based
+    on the cache index and the size and modification time of the cache
+    files it refers to.  No rosdep data is loaded.
+
+    :returns: hex digest, ``str``, or ``None`` if there is no cache index
+    """
+    cache_index = os.path.join(sources_cache_dir, CACHE_INDEX)
+    try:
+        with open(cache_index, 'r') as f:
+            cache_data = f.read()
+    except (IOError, OSError):
+        return None
+    sha_hash = hashlib.sha1(cache_data.encode())
+    # entries provided by the system cache refer to its cache files
+    for source in _parse_cache_index(cache_data, cache_index, sources_cache_dir):
+        sha_hash.update(_get_cache_file_stamp(source.origin).encode())
+    return sha_hash.hexdigest()
+
+
+def _get_cache_file_stamp(origin):
+    """
+    :returns: names, sizes and modification times of the cache files
+        of the source with *origin*, ``str``
+    """
+    dirname, filename = os.path.split(origin)
+    stamp = ''
+    for name in (filename + PICKLE_CACHE_EXT, filename):
+        try:
+            stat = os.stat(os.path.join(dirname, name))
+        except OSError:
+            continue
+        stamp += '%s %d %r\n' % (name, stat.st_size, stat.st_mtime)
+    return stamp
+
+
+def merge_sources_data(sources):
+    """
+    Merge the rosdep data of *sources* into a single map, following
+    the rules of :meth:`rosdep2.lookup.RosdepView.merge`: the first
+    source to declare a key wins, and rules for additional OSes are
+    merged in from later sources.
+
+    :param sources: list of :class:`CachedDataSource` in precedence order
+    :returns: merged rosdep data, ``dict``
+    :raises: :exc:`InvalidData` if the data for a key is not a dictionary
+    """
+    merged = {}
+    copied = set()
+    for source in sources:
+        for key, data in source.rosdep_data.items():
+            if not isinstance(data, dict):
+                raise InvalidData('rosdep data for [%s] must be a dictionary' % (key), origin=source.origin)
+            if key not in merged:
+                merged[key] = data
+                continue
+            for os_name, rules in data.items():
+                if os_name not in merged[key]:
+                    # copy on first write, the source data is not ours
+                    if key not in copied:
+                        merged[key] = dict(merged[key])
+                        copied.add(key)
+                    merged[key][os_name] = rules
+    return merged
+
+
+def write_cache_snapshot(sources_cache_dir, matcher, sources=None):
+    """
+    Write the merged data of all cached sources matching *matcher*
+    into a single snapshot file, which can then be loaded by
+    :func:`load_cache_snapshot` instead of loading and merging the
+    sources one by one.
+
+    :param matcher: :class:`DataSourceMatcher` selecting the sources,
+        or ``None`` to only remove an existing snapshot
+    :param sources: cached sources as returned by
+        :func:`load_cached_sources_list`, if already loaded
+    :returns: path of the snapshot file, or ``None`` if no snapshot
+        was written
+    """
+    filepath = os.path.join(sources_cache_dir, SNAPSHOT_CACHE + PICKLE_CACHE_EXT)
+    digest = compute_cache_digest(sources_cache_dir)
+    if matcher is not None and _is_snapshot_current(filepath, digest, matcher):
+        # the cache has not changed since the snapshot was written
+        return filepath
+    try:
+        os.unlink(filepath)
+    except OSError:
+        pass
+    if matcher is None:
+        return None
+    if sources is None:
+        sources = load_cached_sources_list(sources_cache_dir=sources_cache_dir)
+    sources = [x for x in sources if matcher.matches(x)]
+    try:
+        rosdep_data = merge_sources_data(sources)
+    except InvalidData:
+        # leave it to the regular loading path to report the error
+        return None
+    header = {
+        'digest': digest,
+        'tags': sorted(matcher.tags),
+        'urls': [x.url for x in sources],
+    }
+    try:
+        # header and data are pickled separately so that a stale
+        # snapshot can be detected without loading its data
+        write_atomic(filepath, pickle.dumps(header, 2) + pickle.dumps(rosdep_data, 2), True)
+    except OSError as e:
+        raise CachePermissionError('Failed to write cache file: ' + str(e))
+    return filepath
+
+
+def _is_snapshot_current(filepath, digest, matcher):
+    try:
+        with open(filepath, 'rb') as f:
+            header = pickle.load(f)
+    except (IOError, OSError, pickle.UnpicklingError, EOFError, ValueError):
+        return False
+    return header['digest'] == digest and header['tags'] == sorted(matcher.tags)
+
+
+def load_cache_snapshot(sources_cache_dir, matcher, verbose=False):
+    """
+    Load the snapshot written by :func:`write_cache_snapshot`.
+
+    :returns: :class:`CachedDataSource` with the merged data of all
+        sources matching *matcher*, or ``None`` if there is no snapshot
+        or it is stale, i.e. the cache has changed since it was
+        written or it was written for different tags.
+    """
+    filepath = os.path.join(sources_cache_dir, SNAPSHOT_CACHE + PICKLE_CACHE_EXT)
+    if not os.path.exists(filepath):
+        return None
+    with open(filepath, 'rb') as f:
+        header = pickle.load(f)
+        if header['tags'] != sorted(matcher.tags) or \
+                header['digest'] != compute_cache_digest(sources_cache_dir):
+            if verbose:
+                print('ignoring stale snapshot %s' % (filepath), file=sys.stderr)
+            return None
+        if verbose:
+            print('loading snapshot of %s sources:\n\t%s' % (len(header['urls']), filepath), file=sys.stderr)
+        rosdep_data = pickle.load(f)
+    return CachedDataSource(TYPE_YAML, 'file://' + pathname2url(filepath), [], rosdep_data, origin=filepath)
+
+
+def write_key_index(sources_cache_dir, sources=None):
+    """
+    Write an index of the rosdep keys of all cached sources, which
+    :class:`SourcesKeyIndex` can query for single keys without loading
+    the sources.  The data of each key is stored per source, so that
+    the sources can be filtered by tags and merged in index order at
+    query time.  The data of sources whose cache files did not change
+    since the previous index was written is copied from it.
+
+    :param sources: cached sources as returned by
+        :func:`load_cached_sources_list`, if already loaded
+    :returns: path of the index file
+    :raises: :exc:`CachePermissionError` if the index cannot be written
+    """
+    filepath = os.path.join(sources_cache_dir, KEY_INDEX)
+    digest = compute_cache_digest(sources_cache_dir)
+    if _read_key_index_digest(filepath) == digest:
+        # the cache has not changed since the index was written
+        return filepath
+    if sources is None:
+        sources = load_cached_sources_list(sources_cache_dir=sources_cache_dir)
+    try:
+        fd, filepath_tmp = tempfile.mkstemp(prefix=KEY_INDEX + '.tmp.', dir=sources_cache_dir)
+        os.close(fd)
+    except OSError as e:
+        raise CachePermissionError('Failed to write cache file: ' + str(e))
+    try:
+        _write_key_index_db(filepath_tmp, digest, sources, sources_cache_dir, filepath)
+        os.rename(filepath_tmp, filepath)
+    except (OSError, sqlite3.Error) as e:
+        try:
+            os.unlink(filepath_tmp)
+        except OSError:
+            pass
+        raise CachePermissionError('Failed to write cache file: ' + str(e))
+    return filepath
+
+
+def _read_key_index_digest(filepath):
+    if not os.path.exists(filepath):
+        return None
+    try:
+        conn = sqlite3.connect(filepath)
+    except sqlite3.Error:
+        return None
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE name = 'digest'").fetchone()
+    except sqlite3.Error:
+        row = None
+    finally:
+        conn.close()
+    return row[0] if row is not None else None
+
+
+def _write_key_index_db(filepath, digest, sources, sources_cache_dir, previous_filepath):
+    conn = sqlite3.connect(filepath)
+    try:
+        previous_positions = _attach_previous_key_index(conn, previous_filepath)
+        conn.execute('CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT)')
+        conn.execute('CREATE TABLE sources (position INTEGER PRIMARY KEY, type TEXT, url TEXT, tags TEXT, origin TEXT, stamp TEXT)')
+        conn.execute('CREATE TABLE rosdep_data (key TEXT, position INTEGER, data BLOB, PRIMARY KEY (key, position))')
+        conn.execute('INSERT INTO meta VALUES (?, ?)', ('digest', digest))
+        for position, source in enumerate(sources):
+            # relative to the cache, so that the index stays valid in
+            # the next generation of the cache
+            origin = source.origin
+            if os.path.dirname(origin) == sources_cache_dir:
+                origin = os.path.basename(origin)
+            row = (source.type, source.url, json.dumps(source.tags), origin, _get_cache_file_stamp(source.origin))
+            conn.execute('INSERT INTO sources VALUES (?, ?, ?, ?, ?, ?)', (position,) + row)
+            if row in previous_positions:
+                conn.execute('INSERT INTO rosdep_data SELECT key, ?, data FROM previous.rosdep_data WHERE position = ?',
+                             (position, previous_positions[row]))
+                continue
+            conn.executemany('INSERT INTO rosdep_data VALUES (?, ?, ?)',
+                             ((key, position, sqlite3.Binary(pickle.dumps(data, 2)))
+                              for key, data in source.rosdep_data.items()))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _attach_previous_key_index(conn, filepath):
+    """
+    Attach the key index *filepath* as database ``previous`` to *conn*.
+
+    :returns: positions of its sources by their (type, url, tags,
+        origin, stamp) rows, ``{tuple: int}``, empty if there is no
+        usable index
+    """
+    if not os.path.exists(filepath):
+        return {}
+    try:
+        conn.execute('ATTACH DATABASE ? AS previous', (filepath,))
+        rows = conn.execute('SELECT position, type, url, tags, origin, stamp FROM previous.sources').fetchall()
+    except sqlite3.Error:
+        # e.g. an index written by an older version
+        return {}
+    return dict((tuple(row[1:]), row[0]) for row in rows)
+
+
+class SourcesKeyIndex(object):
+    """
+    Random-access view of the rosdep keys of the sources cache, as
+    written by :func:`write_key_index`.
+    """
+
+    # maximum number of keys per query, below the SQLite variable limit
+    QUERY_CHUNK_SIZE = 500
+
+    def __init__(self, conn, sources_cache_dir):
+        """
+        :param conn: :class:`sqlite3.Connection` to the index file
+        :param sources_cache_dir: directory of the index file, which
+            the origins of the sources are relative to
+        """
+        self._conn = conn
+        self._sources_cache_dir = sources_cache_dir
+
+    @staticmethod
+    def open(sources_cache_dir, verbose=False):
+        """
+        :returns: :class:`SourcesKeyIndex`, or ``None`` if there is no
+            index or it is stale, i.e. the cache has changed since it
+            was written.
+        """
+        sources_cache_dir = get_current_generation(sources_cache_dir)
+        filepath = os.path.join(sources_cache_dir, KEY_INDEX)
+        if not os.path.exists(filepath):
+            return None
+        digest = _read_key_index_digest(filepath)
+        if digest is None or digest != compute_cache_digest(sources_cache_dir):
+            if verbose:
+                print('ignoring stale key index %s' % (filepath), file=sys.stderr)
+            return None
+        try:
+            conn = sqlite3.connect(filepath)
+        except sqlite3.Error:
+            return None
+        if verbose:
+            print('using key index %s' % (filepath), file=sys.stderr)
+        return SourcesKeyIndex(conn, sources_cache_dir)
+
+    def close(self):
+        self._conn.close()
+
+    def _get_positions(self, matcher):
+        positions = []
+        for position, type_, url, tags, origin in self._conn.execute(
+                'SELECT position, type, url, tags, origin FROM sources ORDER BY position'):
+            source = DataSource(type_, url, json.loads(tags), origin=os.path.join(self._sources_cache_dir, origin))
+            if matcher.matches(source):
+                positions.append((position, source))
+        return positions
+
+    def get_sources(self, matcher, rosdep_keys):
+        """
+        :param matcher: :class:`DataSourceMatcher` selecting the sources
+        :param rosdep_keys: rosdep keys to load, ``[str]``
+        :returns: the sources matching *matcher* in index order,
+            [:class:`CachedDataSource`], with their rosdep data limited
+            to *rosdep_keys*
+        """
+        rosdep_keys = list(set(rosdep_keys))
+        data = {}  # {position: {key: data}}
+        for i in range(0, len(rosdep_keys), SourcesKeyIndex.QUERY_CHUNK_SIZE):
+            chunk = rosdep_keys[i:i + SourcesKeyIndex.QUERY_CHUNK_SIZE]
+            query = 'SELECT key, position, data FROM rosdep_data WHERE key IN (%s)' % ', '.join('?' * len(chunk))
+            for key, position, key_data in self._conn.execute(query, chunk):
+                data.setdefault(position, {})[key] = pickle.loads(bytes(key_data))
+        return [CachedDataSource(source.type, source.url, source.tags, data.get(position, {}), origin=source.origin)
+                for position, source in self._get_positions(matcher)]
+
+    def get_keys(self, matcher):
+        """
+        :param matcher: :class:`DataSourceMatcher` selecting the sources
+        :returns: rosdep keys defined by the sources matching *matcher*, ``[str]``
+        """
+        positions = [position for position, _ in self._get_positions(matcher)]
+        if not positions:
+            return []
+        query = 'SELECT DISTINCT key FROM rosdep_data WHERE position IN (%s)' % ', '.join('?' * len(positions))
+        return [row[0] for row in self._conn.execute(query, positions)]
 
 
 def compute_filename_hash(key_filenames):
@@ -550,11 +1658,185 @@ def compute_filename_hash(key_filenames):
     return sha_hash.hexdigest()
 
 
-def write_cache_file(source_cache_d, key_filenames, rosdep_data):
+def read_cache_meta(source_cache_d, key_filenames):
+    """
+    Read the metadata stored next to a cache file by
+    :func:`write_cache_file`.
+
+    :param source_cache_d: directory the cache file is stored in
+    :param key_filenames: filename (or list of filenames) used in hashing
+    :returns: metadata ``dict``, or ``None`` if there is no cache file
+        or no (valid) metadata for it.
+    """
+    filepath = os.path.join(source_cache_d, compute_filename_hash(key_filenames))
+    if not os.path.exists(filepath + PICKLE_CACHE_EXT):
+        return None
+    try:
+        with open(filepath + META_CACHE_EXT, 'r') as f:
+            cache_meta = json.loads(f.read())
+    except (IOError, OSError, ValueError):
+        return None
+    return cache_meta if isinstance(cache_meta, dict) else None
+
+
+def write_cache_meta(source_cache_d, key_filenames, cache_meta):
+    """
+    Store metadata next to the cache file for *key_filenames*.
+
+    :raises: :exc:`CachePermissionError` if the metadata cannot be written
+    """
+    filepath = os.path.join(source_cache_d, compute_filename_hash(key_filenames))
+    try:
+        write_atomic(filepath + META_CACHE_EXT, json.dumps(cache_meta))
+    except OSError as e:
+        raise CachePermissionError('Failed to write cache file: ' + str(e))
+
+
+def _share_value(value, memo, seen):
+    if id(value) in seen:
+        return seen[id(value)]
+    if isinstance(value, dict):
+        shared = dict((_share_value(k, memo, seen), _share_value(v, memo, seen)) for k, v in value.items())
+        # children are already shared, so equal containers have equal child ids
+        memo_key = (dict, frozenset((id(k), id(v)) for k, v in shared.items()))
+    elif isinstance(value, list):
+        shared = [_share_value(v, memo, seen) for v in value]
+        memo_key = (list, tuple(id(v) for v in shared))
+    else:
+        shared = value
+        memo_key = (type(value), value)
+    try:
+        shared = memo.setdefault(memo_key, shared)
+    except TypeError:
+        # unhashable leaf, leave it alone
+        pass
+    seen[id(value)] = shared
+    return shared
+
+
+def share_rosdep_data(rosdep_data):
+    """
+    Make equal strings and equal rule subtrees of *rosdep_data* the
+    same objects.  Pickle stores shared objects once and restores the
+    sharing on load, so this shrinks the cache files and the memory
+    used by the loaded data.  The map of each rosdep key is not shared
+    with other keys, as views merge the rules of other sources into it.
+
+    :returns: copy of *rosdep_data* with shared subtrees, or
+        *rosdep_data* itself if it is not a ``dict``
+    """
+    if not isinstance(rosdep_data, dict):
+        return rosdep_data
+    memo = {}  # {(type, value or child ids): shared object}
+    seen = {}  # {id(original object): shared object}
+    shared_data = {}
+    for key, data in rosdep_data.items():
+        if isinstance(data, dict):
+            data = dict((_share_value(os_name, memo, seen), _share_value(rules, memo, seen))
+                        for os_name, rules in data.items())
+        shared_data[_share_value(key, memo, seen)] = data
+    return shared_data
+
+
+def _gzip_compress(data):
+    f = io.BytesIO()
+    with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=6, mtime=0) as g:
+        g.write(data)
+    return f.getvalue()
+
+
+def _gzip_decompress(data):
+    with gzip.GzipFile(fileobj=io.BytesIO(data), mode='rb') as g:
+        return g.read()
+
+
+# {compression: (magic bytes, compress, decompress)}
+_CACHE_COMPRESSORS = {
+    'gzip': (b'\x1f\x8b', _gzip_compress, _gzip_decompress),
+    'bz2': (b'BZh', bz2.compress, bz2.decompress),
+}
+if lzma is not None:
+    _CACHE_COMPRESSORS['lzma'] = (b'\xfd7zXZ\x00', lzma.compress, lzma.decompress)
+
+
+def get_cache_compressions():
+    """
+    :returns: names of the supported compressions of cache files,
+        ``[str]``, starting with ``CACHE_COMPRESSION_NONE``
+    """
+    return [CACHE_COMPRESSION_NONE] + sorted(_CACHE_COMPRESSORS.keys())
+
+
+def compress_cache_data(data, compression):
+    """
+    :param data: pickled cache data, ``bytes``
+    :param compression: one of :func:`get_cache_compressions`
+    :returns: *data* compressed with *compression*
+    :raises: :exc:`ValueError` if *compression* is not supported
+    """
+    if compression in (None, CACHE_COMPRESSION_NONE):
+        return data
+    if compression not in _CACHE_COMPRESSORS:
+        raise ValueError('unsupported cache compression: %s' % (compression))
+    return _CACHE_COMPRESSORS[compression][1](data)
+
+
+def decompress_cache_data(data):
+    """
+    Decompress data written by :func:`compress_cache_data`.  The
+    compression is detected from the data, so cache files written
+    with any compression can be read.
+
+    :returns: pickled cache data, ``bytes``
+    """
+    for magic, _, decompress in _CACHE_COMPRESSORS.values():
+        if data.startswith(magic):
+            return decompress(data)
+    return data
+
+
+def get_cache_compression(sources_cache_dir):
+    """
+    :returns: compression selected for the cache files in
+        *sources_cache_dir* with :func:`set_cache_compression`,
+        ``CACHE_COMPRESSION_NONE`` if none was selected
+    """
+    try:
+        with open(os.path.join(sources_cache_dir, CACHE_COMPRESSION_FILE), 'r') as f:
+            compression = f.read().strip()
+    except (IOError, OSError):
+        return CACHE_COMPRESSION_NONE
+    return compression if compression in get_cache_compressions() else CACHE_COMPRESSION_NONE
+
+
+def set_cache_compression(sources_cache_dir, compression):
+    """
+    Select the compression of the cache files written to
+    *sources_cache_dir* by later updates.
+
+    :raises: :exc:`ValueError` if *compression* is not supported
+    :raises: :exc:`CachePermissionError` if the selection cannot be stored
+    """
+    if compression not in get_cache_compressions():
+        raise ValueError('unsupported cache compression: %s' % (compression))
+    try:
+        write_atomic(os.path.join(sources_cache_dir, CACHE_COMPRESSION_FILE), compression + '\n')
+    except OSError as e:
+        raise CachePermissionError('Failed to write cache file: ' + str(e))
+
+
+def write_cache_file(source_cache_d, key_filenames, rosdep_data, cache_meta=None, stats=None,
+                     compression=None):
     """
     :param source_cache_d: directory to write cache file to
     :param key_filenames: filename (or list of filenames) to be used in hashing
     :param rosdep_data: dictionary of data to serialize as YAML
+    :param cache_meta: optional metadata (e.g. HTTP validators) to
+        store next to the cache file, ``dict``
+    :param stats: ``dict`` to add the ``pickle_bytes`` and the
+        ``write_time`` to, see :func:`update_sources_list`
+    :param compression: compression of the cache file, one of
+        :func:`get_cache_compressions`.  Defaults to none.
     :returns: name of file where cache is stored
     :raises: :exc:`OSError` if cannot write to cache file/directory
     :raises: :exc:`IOError` if cannot write to cache file/directory
@@ -563,43 +1845,25 @@ def write_cache_file(source_cache_d, key_filenames, rosdep_data):
         os.makedirs(source_cache_d)
     key_hash = compute_filename_hash(key_filenames)
     filepath = os.path.join(source_cache_d, key_hash)
+    start = time.time()
+    data = compress_cache_data(pickle.dumps(share_rosdep_data(rosdep_data), 2), compression)
     try:
-        write_atomic(filepath + PICKLE_CACHE_EXT, pickle.dumps(rosdep_data, 2), True)
+        write_atomic(filepath + PICKLE_CACHE_EXT, data, True)
     except OSError as e:
         raise CachePermissionError('Failed to write cache file: ' + str(e))
-    try:
-        os.unlink(filepath)
-    except OSError:
-        pass
-    return filepath
-
-
-def write_atomic(filepath, data, binary=False):
-    # write data to new file
-    fd, filepath_tmp = tempfile.mkstemp(prefix=os.path.basename(filepath) + '.tmp.', dir=os.path.dirname(filepath))
-
-    if (binary):
-        fmode = 'wb'
-    else:
-        fmode = 'w'
-
-    with os.fdopen(fd, fmode) as f:
-        f.write(data)
-        f.close()
-
-    try:
-        # switch file atomically (if supported)
-        os.rename(filepath_tmp, filepath)
-    except OSError:
-        # fall back to non-atomic operation
+    add_stats(stats, pickle_bytes=len(data), write_time=time.time() - start)
+    if cache_meta is not None:
+        write_cache_meta(source_cache_d, key_filenames, cache_meta)
+    remove_files = [filepath]
+    if cache_meta is None:
+        # validators of a previous download no longer apply
+        remove_files.append(filepath + META_CACHE_EXT)
+    for remove_file in remove_files:
         try:
-            os.unlink(filepath)
+            os.unlink(remove_file)
         except OSError:
             pass
-        try:
-            os.rename(filepath_tmp, filepath)
-        except OSError:
-            os.unlink(filepath_tmp)
+    return filepath
 
 
 class SourcesListLoader(RosdepLoader):
@@ -626,16 +1890,39 @@ class SourcesListLoader(RosdepLoader):
         self.sources = sources
 
     @staticmethod
-    def create_default(matcher=None, sources_cache_dir=None, os_override=None, verbose=False):
+    def create_default(matcher=None, sources_cache_dir=None, os_override=None, verbose=False,
+                       use_snapshot=True, rosdep_keys=None):
         """
         :param matcher: override DataSourceMatcher.  Defaults to
             DataSourceMatcher.create_default().
         :param sources_cache_dir: override location of sources cache
+        :param use_snapshot: if ``True``, load the merged snapshot
+            written by ``rosdep update`` as a single source when it is
+            up to date.  The individual sources are loaded otherwise.
+        :param rosdep_keys: if set, only the data of these rosdep keys
+            is needed.  It is then loaded from the key index written by
+            ``rosdep update``, if that is up to date, and the sources
+            only contain the data of these keys.
         """
         if matcher is None:
             matcher = DataSourceMatcher.create_default(os_override=os_override)
         if verbose:
             print('using matcher with tags [%s]' % (', '.join(matcher.tags)), file=sys.stderr)
+        # read everything from the same generation of the cache
+        sources_cache_dir = get_readable_sources_cache_dir(sources_cache_dir)
+
+        if rosdep_keys is not None:
+            key_index = SourcesKeyIndex.open(sources_cache_dir, verbose=verbose)
+            if key_index is not None:
+                try:
+                    return SourcesListLoader(key_index.get_sources(matcher, rosdep_keys))
+                finally:
+                    key_index.close()
+
+        if use_snapshot:
+            snapshot = load_cache_snapshot(sources_cache_dir, matcher, verbose=verbose)
+            if snapshot is not None:
+                return SourcesListLoader([snapshot])
 
         sources = load_cached_sources_list(sources_cache_dir=sources_cache_dir, verbose=verbose)
         if verbose:
@@ -661,7 +1948,8 @@ class SourcesListLoader(RosdepLoader):
         if verbose:
             print('loading view [%s] with sources.list loader' % (view_name), file=sys.stderr)
         view_dependencies = self.get_view_dependencies(view_name)
-        rosdep_db.set_view_data(view_name, source.rosdep_data, view_dependencies, view_name)
+        # the cached data is not modified, share it instead of copying it
+        rosdep_db.set_view_data(view_name, read_only_mapping(source.rosdep_data), view_dependencies, view_name)
 
     def get_loadable_resources(self):
         return []
@@ -0,0 +1,96 @@
+# Copyright (c) 2019, Open Source Robotics Foundation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Willow Garage, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Sources lists and rosdistro indexes shared by the tests of
+``rosdep update`` and the caches it writes.
+"""
+
+import os
+import tempfile
+
+import yaml
+try:
+    from urllib.request import pathname2url
+except ImportError:
+    from urllib import pathname2url
+
+from mock import patch
+
+
+def create_sources_list(sources_data, missing=False):
+    """
+    Create a sources list directory with a ``file://`` source for each
+    of the rosdep data maps *sources_data*.  The sources are listed in
+    the file ``10-local.list`` of the directory.
+
+    :param missing: add a source that cannot be retrieved
+    :returns: (sources_list_dir, [url])
+    """
+    basedir = tempfile.mkdtemp()
+    urls = []
+    for i, rosdep_data in enumerate(sources_data):
+        path = os.path.join(basedir, 'source%d.yaml' % i)
+        with open(path, 'w') as f:
+            yaml.safe_dump(rosdep_data, f)
+        urls.append('file://' + pathname2url(path))
+    if missing:
+        urls.append('file://' + pathname2url(os.path.join(basedir, 'missing.yaml')))
+    sources_list_dir = os.path.join(basedir, 'sources.list.d')
+    os.makedirs(sources_list_dir)
+    with open(os.path.join(sources_list_dir, '10-local.list'), 'w') as f:
+        f.write(''.join('yaml %s\n' % url for url in urls))
+    return sources_list_dir, urls
+
+
+def create_local_sources(count, missing=True):
+    """
+    Create a sources list directory with *count* ``file://`` sources,
+    see :func:`create_sources_list`.  Source i defines the rosdep
+    names ``key<i>`` and ``shared``.
+
+    :param missing: add a source that cannot be retrieved
+    :returns: (sources_list_dir, [url])
+    """
+    return create_sources_list([{'key%d' % i: {'ubuntu': ['pkg%d' % i]}, 'shared': {'ubuntu': ['from%d' % i]}}
+                                for i in range(count)], missing=missing)
+
+
+def use_rosdistro_index(index_path):
+    """
+    :returns: patch of the environment which uses the rosdistro index
+        *index_path*, as a decorator or context manager
+    """
+    return patch.dict(os.environ, {'ROSDISTRO_INDEX_URL': 'file://' + pathname2url(index_path)})
+
+
+def use_test_rosdistro_index():
+    """
+    :returns: patch of the environment which uses the empty rosdistro
+        index of the test directory, see :func:`use_rosdistro_index`
+    """
+    return use_rosdistro_index(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rosdistro', 'index.yaml'))
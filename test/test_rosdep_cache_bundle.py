@@ -0,0 +1,137 @@
+# Copyright (c) 2019, Open Source Robotics Foundation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Willow Garage, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import io
+import json
+import os
+import tarfile
+import tempfile
+
+from .sources_list_fixtures import create_local_sources, use_test_rosdistro_index
+
+
+def _read_files(dirpath):
+    files = {}
+    for dirname, _, filenames in os.walk(dirpath):
+        for filename in filenames:
+            filepath = os.path.join(dirname, filename)
+            with open(filepath, 'rb') as f:
+                files[os.path.relpath(filepath, dirpath)] = (f.read(), os.stat(filepath).st_mtime)
+    return files
+
+
+def _write_bundle(filepath, manifest, files):
+    with tarfile.open(filepath, 'w:gz') as tar:
+        for name, data in [('bundle.json', json.dumps(manifest).encode())] + list(files.items()):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+def _list_cache_parent(sources_cache_dir):
+    """
+    :returns: names in the directory of the sources cache, apart from
+        its generations and lock file
+    """
+    return sorted(name for name in os.listdir(os.path.dirname(sources_cache_dir))
+                  if not name.endswith(('.generations', '.lock')))
+
+
+@use_test_rosdistro_index()
+def test_export_import_cache_bundle():
+    from rosdep2.cache_bundle import export_cache_bundle, import_cache_bundle
+    from rosdep2.core import InvalidData
+    from rosdep2.sources_list import update_sources_list, SourcesKeyIndex, load_cache_snapshot, \
+        DataSourceMatcher
+    sources_list_dir, _ = create_local_sources(2, missing=False)
+    sources_cache_dir = os.path.join(tempfile.mkdtemp(), 'sources.cache')
+    os_override = ('ubuntu', 'focal')
+    update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=sources_cache_dir,
+                        os_override=os_override)
+    matcher = DataSourceMatcher.create_default(os_override=os_override)
+
+    bundle = os.path.join(tempfile.mkdtemp(), 'cache.tar.gz')
+    count = export_cache_bundle(sources_cache_dir, bundle)
+    assert count == len(_read_files(sources_cache_dir))
+    try:
+        export_cache_bundle(tempfile.mkdtemp(), bundle)
+        assert False, 'should have raised'
+    except InvalidData:
+        pass
+
+    # import into a new and into an existing cache
+    target_dir = os.path.join(tempfile.mkdtemp(), 'ros', 'sources.cache')
+    for _ in range(2):
+        assert import_cache_bundle(bundle, target_dir) == count
+        assert _read_files(target_dir) == _read_files(sources_cache_dir)
+        assert _list_cache_parent(target_dir) == ['sources.cache']
+    # derived files are still valid for the imported cache
+    assert load_cache_snapshot(target_dir, matcher) is not None
+    SourcesKeyIndex.open(target_dir).close()
+
+    # invalid bundles do not touch the cache
+    files = _read_files(target_dir)
+    manifest = {'version': 1, 'files': {'index': {'sha256': '0' * 64, 'mtime': 0}}}
+    invalid_bundles = [
+        (manifest, {'index': b'corrupt'}),
+        (manifest, {}),
+        (dict(manifest, version=2), {'index': b'corrupt'}),
+        ({'version': 1, 'files': {'../outside': {'sha256': '0' * 64, 'mtime': 0}}}, {'../outside': b''}),
+    ]
+    for manifest, bundle_files in invalid_bundles:
+        _write_bundle(bundle, manifest, bundle_files)
+        try:
+            import_cache_bundle(bundle, target_dir)
+            assert False, 'should have raised'
+        except InvalidData:
+            pass
+        assert _read_files(target_dir) == files
+        assert not os.path.exists(os.path.join(os.path.dirname(target_dir), 'outside'))
+    with open(bundle, 'wb') as f:
+        f.write(b'not a bundle')
+    for filepath in [bundle, bundle + '.missing']:
+        try:
+            import_cache_bundle(filepath, target_dir)
+            assert False, 'should have raised'
+        except InvalidData:
+            pass
+    assert _list_cache_parent(target_dir) == ['sources.cache']
+
+
+def test_export_cache_bundle_system_entries():
+    from rosdep2.cache_bundle import export_cache_bundle
+    from rosdep2.core import InvalidData
+    from rosdep2.sources_list import CACHE_INDEX, SYSTEM_CACHE_PREFIX
+    sources_cache_dir = tempfile.mkdtemp()
+    with open(os.path.join(sources_cache_dir, CACHE_INDEX), 'w') as f:
+        f.write('yaml file:///tmp/private.yaml\n%syaml file:///tmp/base.yaml\n' % SYSTEM_CACHE_PREFIX)
+    # the files of the system cache would be missing in the bundle
+    try:
+        export_cache_bundle(sources_cache_dir, os.path.join(tempfile.mkdtemp(), 'cache.tar.gz'))
+        assert False, 'should have raised'
+    except InvalidData:
+        pass
@@ -0,0 +1,124 @@
+# Copyright (c) 2019, Open Source Robotics Foundation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Willow Garage, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import tempfile
+import threading
+
+from .sources_list_fixtures import create_local_sources, use_test_rosdistro_index
+
+
+@use_test_rosdistro_index()
+def test_update_sources_list_generations():
+    from rosdep2.cache_generations import supports_generations, get_current_generation, GENERATIONS_SUFFIX
+    from rosdep2.sources_list import update_sources_list, load_cached_sources_list
+    if not supports_generations():
+        return
+    sources_list_dir, _ = create_local_sources(2, missing=False)
+    # an existing cache directory is migrated
+    sources_cache_dir = tempfile.mkdtemp()
+    retval = update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=sources_cache_dir)
+    assert os.path.islink(sources_cache_dir)
+    assert all(filepath.startswith(sources_cache_dir) for _, filepath in retval)
+    assert all(os.path.exists(filepath + '.pickle') for _, filepath in retval)
+    sources = load_cached_sources_list(sources_cache_dir=sources_cache_dir)
+    filename = os.path.basename(sources[0].origin) + '.pickle'
+
+    previous_generation = get_current_generation(sources_cache_dir)
+    for i in range(2):
+        update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=sources_cache_dir)
+        generation = get_current_generation(sources_cache_dir)
+        assert generation != previous_generation
+        # unchanged cache files are shared with the previous generation
+        assert os.path.samefile(os.path.join(previous_generation, filename), os.path.join(generation, filename))
+        # the current and the previous generation are kept
+        assert len(os.listdir(sources_cache_dir + GENERATIONS_SUFFIX)) == 2
+        if i == 0:
+            # sources loaded from the previous generation are still readable
+            assert sources[0].rosdep_data
+        previous_generation = generation
+
+
+@use_test_rosdistro_index()
+def test_update_sources_list_concurrent():
+    from rosdep2.cache_generations import supports_generations, get_current_generation, \
+        SourcesCacheLock, create_generation, publish_generation
+    from rosdep2.sources_list import update_sources_list
+    if not supports_generations():
+        return
+    sources_list_dir, _ = create_local_sources(1, missing=False)
+    sources_cache_dir = os.path.join(tempfile.mkdtemp(), 'sources.cache')
+    retval = update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=sources_cache_dir)
+
+    results = []
+    with SourcesCacheLock(sources_cache_dir) as lock:
+        assert not lock.waited
+        thread = threading.Thread(target=lambda: results.append(
+            update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=sources_cache_dir)))
+        thread.start()
+        thread.join(0.5)
+        # the update waits for the lock
+        assert thread.is_alive()
+        # publish the result of this "concurrent" update
+        generation_dir = create_generation(sources_cache_dir)
+        publish_generation(sources_cache_dir, generation_dir)
+    thread.join()
+    # the waiting update reused it and returns its cache files
+    assert [[(source.url, filepath) for source, filepath in result] for result in results] == \
+        [[(source.url, filepath) for source, filepath in retval]]
+    assert get_current_generation(sources_cache_dir) == generation_dir
+
+    # an update with other options does not reuse it
+    results = []
+    with SourcesCacheLock(sources_cache_dir):
+        thread = threading.Thread(target=lambda: results.append(
+            update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=sources_cache_dir,
+                                skip_eol_distros=True)))
+        thread.start()
+        thread.join(0.5)
+        assert thread.is_alive()
+        generation_dir = create_generation(sources_cache_dir)
+        publish_generation(sources_cache_dir, generation_dir)
+    thread.join()
+    assert len(results) == 1 and results[0] is not None
+    assert get_current_generation(sources_cache_dir) != generation_dir
+
+
+def test_replace_in_place():
+    from rosdep2.cache_generations import _replace_in_place
+    generation_dir = tempfile.mkdtemp()
+    target_dir = tempfile.mkdtemp()
+    for name in ('kept', 'removed'):
+        with open(os.path.join(target_dir, name), 'w') as f:
+            f.write('old')
+    os.mkdir(os.path.join(target_dir, 'removed_dir'))
+    with open(os.path.join(generation_dir, 'kept'), 'w') as f:
+        f.write('new')
+    _replace_in_place(generation_dir, target_dir)
+    assert os.listdir(target_dir) == ['kept']
+    with open(os.path.join(target_dir, 'kept')) as f:
+        assert f.read() == 'new'
@@ -0,0 +1,306 @@
+# Copyright (c) 2019, Open Source Robotics Foundation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Willow Garage, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import tempfile
+import threading
+import time
+
+from mock import patch
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.error import HTTPError, URLError
+    from urllib.request import pathname2url
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib2 import HTTPError, URLError
+    from urllib import pathname2url
+
+
+class _KeepAliveServer(object):
+    """
+    Serve a dictionary of {path: bytes} over HTTP/1.1 on localhost.
+    Paths in *redirects* answer with a redirect, paths in *drop* are
+    served and then the connection is closed without notice.  Paths in
+    *encoded* are served with the given {path: (content encoding,
+    encoded bytes)} if the client accepts the encoding.  Responses of
+    paths in *delays* are sent after the given number of seconds.
+    """
+
+    def __init__(self, files, redirects=None, drop=None, encoded=None, delays=None):
+        server = self
+        self.files = files
+        self.redirects = redirects or {}
+        self.drop = drop or set()
+        self.encoded = encoded or {}
+        self.delays = delays or {}
+        self.connections = set()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.connections.add(self.client_address)
+                time.sleep(server.delays.get(self.path, 0))
+                if self.path in server.redirects:
+                    self.send_response(302)
+                    self.send_header('Location', server.redirects[self.path])
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if self.path not in server.files:
+                    self.send_error(404)
+                    return
+                data = server.files[self.path]
+                self.send_response(200)
+                encoding, encoded_data = server.encoded.get(self.path, (None, None))
+                if encoding and encoding in self.headers.get('Accept-Encoding', ''):
+                    data = encoded_data
+                    self.send_header('Content-Encoding', encoding)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                if self.path in server.drop:
+                    self.close_connection = True
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self.httpd = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def test_ConnectionPool_reuse():
+    from rosdep2.downloader import ConnectionPool
+    server = _KeepAliveServer({'/a.yaml': b'a: []\n', '/b.yaml': b'b: []\n'})
+    pool = ConnectionPool()
+    try:
+        for path in ['/a.yaml', '/b.yaml', '/a.yaml']:
+            f = pool.request(server.url + path)
+            assert f.getcode() == 200
+            assert f.read() == server.files[path]
+            assert f.info().get('Content-Length') == str(len(server.files[path]))
+        assert pool.get_stats() == {'requests': 3, 'connections': 1, 'reused': 2}
+        assert len(server.connections) == 1
+    finally:
+        pool.close()
+        server.shutdown()
+
+
+def test_ConnectionPool_errors():
+    from rosdep2.downloader import ConnectionPool
+    server = _KeepAliveServer(
+        {'/a.yaml': b'a: []\n'},
+        redirects={'/old.yaml': '/a.yaml', '/loop.yaml': '/loop.yaml'})
+    pool = ConnectionPool()
+    try:
+        f = pool.request(server.url + '/old.yaml')
+        assert f.read() == b'a: []\n'
+        assert f.geturl() == server.url + '/a.yaml'
+        for path, code in [('/missing.yaml', 404), ('/loop.yaml', 302)]:
+            try:
+                pool.request(server.url + path)
+                assert False, 'should have raised'
+            except HTTPError as e:
+                assert e.code == code
+    finally:
+        pool.close()
+        server.shutdown()
+
+
+def test_ConnectionPool_stale_connection():
+    from rosdep2.downloader import ConnectionPool
+    server = _KeepAliveServer({'/a.yaml': b'a: []\n', '/b.yaml': b'b: []\n'}, drop={'/a.yaml'})
+    pool = ConnectionPool()
+    try:
+        assert pool.request(server.url + '/a.yaml').read() == b'a: []\n'
+        # the pooled connection has been closed by the server
+        assert pool.request(server.url + '/b.yaml').read() == b'b: []\n'
+        assert pool.get_stats()['connections'] == 2
+    finally:
+        pool.close()
+        server.shutdown()
+
+
+def test_ConnectionPool_compression():
+    import gzip
+    import io
+    import zlib
+    from rosdep2.downloader import ConnectionPool
+    text = b''.join(b'key%d:\n  ubuntu: [libkey%d-dev]\n' % (i, i) for i in range(1000))
+    f = io.BytesIO()
+    with gzip.GzipFile(fileobj=f, mode='wb') as g:
+        g.write(text)
+    raw_deflate = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    encoded = {
+        '/gzip.yaml': ('gzip', f.getvalue()),
+        '/deflate.yaml': ('deflate', zlib.compress(text)),
+        '/raw-deflate.yaml': ('deflate', raw_deflate.compress(text) + raw_deflate.flush()),
+        '/broken.yaml': ('gzip', b'\x1f\x8b not gzip'),
+        '/unknown.yaml': ('br', b'?'),
+    }
+    server = _KeepAliveServer(dict((path, text) for path in encoded), encoded=encoded)
+    pool = ConnectionPool()
+    try:
+        for path in ['/gzip.yaml', '/deflate.yaml', '/raw-deflate.yaml']:
+            stats = {}
+            assert pool.request(server.url + path, stats=stats).read() == text
+            # the compressed size is received
+            assert stats['bytes'] == len(encoded[path][1])
+        for path in ['/broken.yaml', '/unknown.yaml']:
+            try:
+                pool.request(server.url + path, headers={'Accept-Encoding': 'gzip, br'})
+                assert False, 'should have raised'
+            except URLError:
+                pass
+    finally:
+        pool.close()
+        server.shutdown()
+
+
+def test_DeflateDecompressor():
+    import zlib
+    from rosdep2.downloader import _DeflateDecompressor
+    text = b''.join(b'key%d:\n  ubuntu: [libkey%d-dev]\n' % (i, i) for i in range(100))
+    raw_deflate = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    for data in [zlib.compress(text), raw_deflate.compress(text) + raw_deflate.flush()]:
+        # in one piece and split before the end of the zlib header
+        for chunk_size in [len(data), 1]:
+            decompressor = _DeflateDecompressor()
+            chunks = [decompressor.decompress(data[i:i + chunk_size]) for i in range(0, len(data), chunk_size)]
+            assert b''.join(chunks) + decompressor.flush() == text
+
+
+def test_urlopen_file():
+    from rosdep2.downloader import urlopen
+    fd, filepath = tempfile.mkstemp()
+    os.write(fd, b'foo: []\n')
+    os.close(fd)
+    f = urlopen('file://' + pathname2url(filepath))
+    assert f.read() == b'foo: []\n'
+    f.close()
+
+
+def test_MirrorSelector():
+    from rosdep2.downloader import MirrorSelector, DEFAULT_HEDGE_DELAY, MIN_HEDGE_DELAY
+    selector = MirrorSelector()
+    urls = ['https://a.example.com/base.yaml', 'https://b.example.com/base.yaml', 'file:///tmp/base.yaml']
+    assert selector.order(urls) == urls
+    assert selector.get_hedge_delay(urls[0]) == DEFAULT_HEDGE_DELAY
+    selector.record('https://a.example.com/other.yaml', 0.5)
+    selector.record(urls[1], 0.2)
+    assert selector.get_latency(urls[0]) == 0.5
+    # mirrors which were not measured yet are tried first
+    assert selector.order(urls) == [urls[2], urls[1], urls[0]]
+    for _ in range(50):
+        selector.record(urls[1], 0.01)
+    assert selector.get_latency(urls[1]) < 0.02
+    assert selector.get_hedge_delay(urls[1]) == MIN_HEDGE_DELAY
+    assert selector.get_hedge_delay(urls[0], timeout=0.3) == 0.3
+
+    restored = MirrorSelector()
+    restored.set_state(dict(selector.get_state(), invalid='x'))
+    assert restored.get_state() == selector.get_state()
+
+
+def test_urlopen_mirrors():
+    import rosdep2.downloader
+    from rosdep2.downloader import MirrorSelector, urlopen_mirrors
+    slow = _KeepAliveServer({'/a.yaml': b'a: []\n'}, delays={'/a.yaml': 1.0})
+    fast = _KeepAliveServer({'/a.yaml': b'a: []\n'})
+    broken = _KeepAliveServer({})
+    selector = rosdep2.downloader._mirror_selector
+    rosdep2.downloader._mirror_selector = MirrorSelector()
+    try:
+        urls = [slow.url + '/a.yaml', fast.url + '/a.yaml']
+        # the slow mirror is known to answer more quickly than the
+        # other one, so it is asked first and a hedged request is sent
+        # to the other mirror after a short delay
+        rosdep2.downloader._mirror_selector.record(slow.url, 0.05)
+        rosdep2.downloader._mirror_selector.record(fast.url, 0.2)
+        stats = {}
+        start = time.time()
+        f = urlopen_mirrors(urls, stats=stats)
+        assert f.read() == b'a: []\n'
+        assert f.geturl() == fast.url + '/a.yaml'
+        assert time.time() - start < 0.9
+        assert stats['hedged'] == 1
+        assert rosdep2.downloader._mirror_selector.get_latency(fast.url) < 0.2
+
+        # failing mirrors are skipped
+        missing = [fast.url + '/missing.yaml', fast.url + '/a.yaml']
+        assert urlopen_mirrors(missing).geturl() == missing[1]
+        try:
+            urlopen_mirrors([fast.url + '/missing.yaml', fast.url + '/missing2.yaml'])
+            assert False, 'should have raised'
+        except HTTPError as e:
+            assert e.code == 404
+
+        # a mirror which quickly answers with errors is not preferred
+        broken_urls = [broken.url + '/a.yaml', fast.url + '/a.yaml']
+        assert urlopen_mirrors(broken_urls).geturl() == broken_urls[1]
+        assert rosdep2.downloader._mirror_selector.order(broken_urls) == [broken_urls[1], broken_urls[0]]
+    finally:
+        rosdep2.downloader._mirror_selector = selector
+        slow.shutdown()
+        fast.shutdown()
+        broken.shutdown()
+
+
+def test_download_if_modified_mirrors():
+    from rosdep2.downloader import download_if_modified, Response
+    urls = ['https://a.example.com/base.yaml', 'https://b.example.com/base.yaml']
+    with patch('rosdep2.downloader.urlopen_mirrors') as urlopen_mock:
+        response = Response(urls[1], 200, {'ETag': '"b"'}, b'data')
+        response.mirror_url = urls[1]
+        urlopen_mock.return_value = response
+        data, cache_meta = download_if_modified(urls[0], mirrors=urls[1:])
+        assert data == b'data'
+        assert cache_meta['mirror'] == 'https://b.example.com'
+
+        # the validators are only sent to the mirror which produced them
+        response = Response(urls[0], 200, {'ETag': '"a"'}, b'data')
+        response.mirror_url = urls[0]
+        urlopen_mock.return_value = response
+        data, new_cache_meta = download_if_modified(urls[0], cache_meta, mirrors=urls[1:])
+        assert urlopen_mock.call_args[1]['mirror_headers'] == {urls[1]: {'If-None-Match': '"b"'}}
+        # and the content of the other mirror is compared by digest
+        assert data is None
+        assert new_cache_meta['etag'] == '"a"'
@@ -268,6 +268,42 @@ def test_RosdepView_merge():
     str(view)
 
 
+def test_RosdepView_merge_lazy():
+    from rosdep2.model import RosdepDatabaseEntry
+    from rosdep2.lookup import RosdepView, RosdepDefinition
+
+    first = dict(a=dict(ubuntu='a-deb'), b=dict(ubuntu='b-deb'))
+    second = dict(c=dict(ubuntu='c-deb'), a=dict(osx='a-brew', ubuntu='ignored'))
+    view = RosdepView('common')
+    view.merge(RosdepDatabaseEntry(first, [], 'first'))
+    view.merge(RosdepDatabaseEntry(second, [], 'second'))
+
+    # first declaration wins the position and the rules
+    assert view.keys() == ['a', 'b', 'c']
+    definition = view.lookup('a')
+    assert definition.data == dict(ubuntu='a-deb', osx='a-brew')
+    assert definition.origin == 'first'
+    # definitions are memoized and the merged data is not modified
+    assert view.lookup('a') is definition
+    assert first['a'] == dict(ubuntu='a-deb')
+    assert view.lookup('b').data is first['b']
+
+    # merging invalidates definitions which were already built
+    view.merge(RosdepDatabaseEntry(dict(a=dict(fedora='a-rpm')), [], 'third'))
+    assert view.lookup('a') is not definition
+    assert view.lookup('a').data == dict(ubuntu='a-deb', osx='a-brew', fedora='a-rpm')
+    assert set(view.rosdep_defs.keys()) == set(['a', 'b', 'c'])
+    # the definitions are only built once
+    assert view.rosdep_defs is view.rosdep_defs
+
+    # setting the definitions replaces the contents of the view
+    view.rosdep_defs = {'d': RosdepDefinition('d', dict(ubuntu='d-deb'), 'set')}
+    assert view.keys() == ['d']
+    view.merge(RosdepDatabaseEntry(dict(d=dict(ubuntu='other'), e=dict(ubuntu='e-deb')), [], 'fourth'))
+    assert view.lookup('d').data == dict(ubuntu='d-deb')
+    assert sorted(view.rosdep_defs.keys()) == ['d', 'e']
+
+
 def test_RosdepLookup_get_rosdeps():
     from rosdep2.loader import RosdepLoader
     from rosdep2.lookup import RosdepLookup
@@ -516,6 +552,86 @@ def test_RosdepLookup_resolve():
         assert [] == dependencies
 
 
+def test_RosdepLookup_resolve_cache():
+    from rosdep2 import create_default_installer_context
+    from rosdep2.lookup import RosdepLookup
+    rospack, rosstack = get_test_rospkgs()
+
+    sources_loader = create_test_SourcesListLoader()
+    lookup = RosdepLookup.create_from_rospkg(rospack=rospack, rosstack=rosstack,
+                                             sources_loader=sources_loader)
+    installer_context = create_default_installer_context()
+
+    # alternating platforms does not evict the results of the other one
+    for count in range(0, 2):
+        for os_name, os_version in [('ubuntu', 'lucid'), ('debian', 'squeeze')]:
+            installer_context.set_os_override(os_name, os_version)
+            installer_key, resolution, dependencies = lookup.resolve('testtinyxml', 'rospack_fake', installer_context)
+            assert 'apt' == installer_key
+            assert ['libtinyxml-dev'] == resolution
+    stats = lookup.resolve_cache.get_stats()
+    assert stats['size'] == 2
+    assert stats['misses'] == 2
+    assert stats['hits'] == 2
+    assert stats['evictions'] == 0
+
+
+def test_ResolveCache():
+    from rosdep2.lookup import ResolveCache
+
+    cache = ResolveCache(max_size=2)
+    assert cache.get('a') is None
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    # 'b' is the least recently used entry
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+    assert cache.get_stats() == dict(size=2, max_size=2, hits=3, misses=2, evictions=1)
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_RosdepLookup_resolve_all_shared_depends():
+    from mock import patch
+    from rosdep2 import create_default_installer_context
+    from rosdep2.lookup import RosdepLookup
+    from rosdep2.sources_list import CachedDataSource, SourcesListLoader, share_rosdep_data
+    try:
+        import cPickle as pickle
+    except ImportError:
+        import pickle
+    rospack, rosstack = get_test_rospkgs()
+
+    rule = {'ubuntu': {'pip': {'packages': ['p'], 'depends': ['c']}}}
+    rosdep_data = {
+        'a': dict(rule),
+        'b': dict(rule),
+        'c': {'ubuntu': {'pip': {'packages': ['q']}}},
+    }
+    # round trip through a cache file, which shares equal rules
+    rosdep_data = pickle.loads(pickle.dumps(share_rosdep_data(rosdep_data), 2))
+    assert rosdep_data['a']['ubuntu'] is rosdep_data['b']['ubuntu']
+    source = CachedDataSource('yaml', 'file:///shared.yaml', [], rosdep_data)
+    lookup = RosdepLookup.create_from_rospkg(rospack=rospack, rosstack=rosstack,
+                                             sources_loader=SourcesListLoader([source]))
+    installer_context = create_default_installer_context()
+    installer_context.set_os_override('ubuntu', 'lucid')
+
+    with patch.object(lookup, 'get_rosdeps', return_value=['a', 'b']):
+        resolutions, errors = lookup.resolve_all(['rospack_fake'], installer_context)
+    assert not errors, errors
+    assert [('pip', ['q', 'p'])] == resolutions
+    # resolving does not modify the rules
+    assert rosdep_data['b']['ubuntu']['pip'] == {'packages': ['p'], 'depends': ['c']}
+    for key in ['a', 'b']:
+        installer_key, resolution, dependencies = lookup.resolve(key, 'rospack_fake', installer_context)
+        assert ['c'] == dependencies
+
+
 def test_RosdepLookup_resolve_all():
     from rosdep2 import create_default_installer_context
     from rosdep2.lookup import RosdepLookup
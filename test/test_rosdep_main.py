@@ -287,3 +287,113 @@ class TestRosdepMain(unittest.TestCase):
             assert len(output) == 2
             assert test_package_dir in output[0]
             assert 'Package version ":{version}" does not follow version conventions' in output[1]
+
+    def test_parse_age(self):
+        from rosdep2.main import parse_age
+        assert parse_age(None) is None
+        assert parse_age('90') == 90
+        assert parse_age('1.5m') == 90
+        assert parse_age('6h') == 6 * 60 * 60
+        assert parse_age('2d') == 2 * 24 * 60 * 60
+        for age in ['', 'h', '-1', '6 hours', '1w']:
+            try:
+                parse_age(age)
+                assert False, 'should have raised'
+            except ValueError:
+                pass
+
+    def test_update_if_older_than(self):
+        import tempfile
+        ros_home = tempfile.mkdtemp()
+        sources_cache = os.path.join(ros_home, 'rosdep', 'sources.cache')
+        os.makedirs(sources_cache)
+        with open(os.path.join(sources_cache, 'index'), 'w') as f:
+            f.write('')
+        with patch.dict('os.environ', {'ROS_HOME': ros_home}):
+            with patch('rosdep2.main.update_sources_list') as update_mock:
+                with fakeout() as b:
+                    rosdep_main(['update', '--if-older-than', '1h'])
+                assert 'skipping update' in b[0].getvalue(), b[0].getvalue()
+                assert not update_mock.called
+
+                # an outdated cache is updated
+                os.utime(os.path.join(sources_cache, 'index'), (0, 0))
+                with fakeout() as b:
+                    try:
+                        rosdep_main(['update', '--if-older-than', '1h'])
+                    except SystemExit:
+                        pass
+                assert 'skipping update' not in b[0].getvalue(), b[0].getvalue()
+
+    def test_update_if_older_than_other_cache(self):
+        import tempfile
+        ros_home = tempfile.mkdtemp()
+        # the sources cache of the user is outdated
+        sources_cache = os.path.join(ros_home, 'rosdep', 'sources.cache')
+        os.makedirs(sources_cache)
+        with open(os.path.join(sources_cache, 'index'), 'w') as f:
+            f.write('')
+        os.utime(os.path.join(sources_cache, 'index'), (0, 0))
+        # but the updated caches are fresh
+        other_cache = os.path.join(ros_home, 'other.cache')
+        system_cache = os.path.join(ros_home, 'system.cache')
+        for cache in [other_cache, system_cache]:
+            os.makedirs(cache)
+            with open(os.path.join(cache, 'index'), 'w') as f:
+                f.write('')
+        env = {'ROS_HOME': ros_home, 'ROSDEP_SYSTEM_CACHE_DIR': system_cache}
+        with patch.dict('os.environ', env):
+            with patch('rosdep2.main.update_sources_list') as update_mock:
+                for args in [['-c', other_cache], ['--system-cache']]:
+                    with fakeout() as b:
+                        rosdep_main(['update', '--if-older-than', '1h'] + args)
+                    assert 'skipping update' in b[0].getvalue(), b[0].getvalue()
+                assert not update_mock.called
+
+    def test_format_update_stats(self):
+        from rosdep2.main import format_update_stats, _get_update_stats_record
+        from rosdep2.sources_list import DataSource
+        source = DataSource('yaml', 'https://example.com/base.yaml', ['ubuntu'])
+        source.stats = {'requests': 2, 'bytes': 1000, 'connect_time': 0.01, 'transfer_time': 0.02,
+                        'parse_time': 0.5, 'pickle_bytes': 300, 'write_time': 0.001}
+        failed = DataSource('yaml', 'https://example.com/missing.yaml', [])
+        records = [_get_update_stats_record(source), _get_update_stats_record(failed, 'not found')]
+        assert records[1]['error'] == 'not found'
+        assert records[1]['bytes'] == 0
+        lines = format_update_stats(records).splitlines()
+        assert len(lines) == 4
+        assert lines[1].split() == ['2', '1000', '0.010s', '0.020s', '0.500s', '300', '0.001s',
+                                    'https://example.com/base.yaml']
+        assert lines[3].split()[:2] == ['2', '1000']
+        assert lines[3].endswith('total')
+
+    @patch('rosdep2.main.subprocess.Popen')
+    def test_revalidate_sources_cache(self, mock_popen):
+        import tempfile
+        from rosdep2.main import revalidate_sources_cache
+
+        class Options(object):
+            os_override = 'ubuntu:focal'
+            include_eol_distros = False
+            stale_while_revalidate = 60 * 60
+            verbose = False
+        ros_home = tempfile.mkdtemp()
+        sources_cache = os.path.join(ros_home, 'rosdep', 'sources.cache')
+        os.makedirs(sources_cache)
+        with open(os.path.join(sources_cache, 'index'), 'w') as f:
+            f.write('')
+        options = Options()
+        options.sources_cache_dir = sources_cache
+        with patch.dict('os.environ', {'ROS_HOME': ros_home}):
+            revalidate_sources_cache(options)
+            assert not mock_popen.called
+            os.utime(os.path.join(sources_cache, 'index'), (0, 0))
+            options.sources_cache_dir = get_cache_dir()
+            revalidate_sources_cache(options)
+            assert not mock_popen.called
+            options.sources_cache_dir = sources_cache
+            revalidate_sources_cache(options)
+            assert mock_popen.call_count == 1
+            command = mock_popen.call_args[0][0]
+            assert command[0] == sys.executable
+            assert command[3:] == ['update', '--if-older-than', '3600', '--os', 'ubuntu:focal']
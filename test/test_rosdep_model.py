@@ -71,6 +71,32 @@ def test_RosdepDatabase():
     assert set(entry.view_dependencies) == set(['baz', 'blah'])
 
 
+def test_RosdepDatabase_read_only_data():
+    from rosdep2.model import RosdepDatabase, MappingProxyType, read_only_mapping
+    if MappingProxyType is None:
+        return  # py2 has no read-only views
+
+    db = RosdepDatabase()
+    data = {'a': {'ubuntu': 'a'}}
+    read_only = read_only_mapping(data)
+    assert read_only_mapping(read_only) is read_only
+    db.set_view_data('foo', read_only, [], 'origin')
+    entry = db.get_view_data('foo')
+    # read-only data is shared instead of copied
+    assert entry.rosdep_data is read_only
+    assert entry.rosdep_data['a'] is data['a']
+    try:
+        entry.rosdep_data['b'] = {}
+        assert False, 'should have raised TypeError'
+    except TypeError:
+        pass
+
+    # plain dicts are still copied for callers which modify them later
+    db.set_view_data('bar', data, [], 'origin')
+    data['b'] = {}
+    assert 'b' not in db.get_view_data('bar').rosdep_data
+
+
 def test_RosdepDatabase_get_view_dependencies():
     from rosdep2.model import RosdepDatabase
 
@@ -91,3 +117,47 @@ def test_RosdepDatabase_get_view_dependencies():
     retval = db.get_view_dependencies('fad')
     assert set(['baz', 'rad', 'foo', 'bar']) == set(retval), retval
     assert len(retval) == 4
+
+
+def test_RosdepDatabase_get_view_dependencies_order():
+    from rosdep2.model import RosdepDatabase
+
+    db = RosdepDatabase()
+    db.set_view_data('a', {}, [], 'origin')
+    db.set_view_data('b', {}, ['a'], 'origin')
+    db.set_view_data('c', {}, ['a'], 'origin')
+    db.set_view_data('d', {}, ['c', 'b', 'a'], 'origin')
+    assert ['a', 'c', 'b'] == db.get_view_dependencies('d')
+    # result can be modified without affecting the database
+    db.get_view_dependencies('d').append('x')
+    assert ['a', 'c', 'b'] == db.get_view_dependencies('d')
+
+    # cached closures are invalidated by new view data
+    db.set_view_data('a', {}, ['e'], 'origin')
+    try:
+        db.get_view_dependencies('d')
+        assert False, 'should have raised KeyError'
+    except KeyError:
+        pass
+    db.mark_loaded('e')
+    assert ['e', 'a', 'c', 'b'] == db.get_view_dependencies('d')
+
+    db.set_view_data('e', {}, ['d'], 'origin')
+    try:
+        db.get_view_dependencies('d')
+        assert False, 'should have raised RuntimeError'
+    except RuntimeError:
+        pass
+
+
+def test_RosdepDatabase_get_view_dependencies_deep():
+    import sys
+    from rosdep2.model import RosdepDatabase
+
+    db = RosdepDatabase()
+    depth = sys.getrecursionlimit() * 2
+    db.set_view_data('view0', {}, [], 'origin')
+    for i in range(1, depth):
+        db.set_view_data('view%d' % i, {}, ['view%d' % (i - 1)], 'origin')
+    retval = db.get_view_dependencies('view%d' % (depth - 1))
+    assert ['view%d' % i for i in range(depth - 1)] == retval
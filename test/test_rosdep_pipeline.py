@@ -0,0 +1,131 @@
+# Copyright (c) 2019, Open Source Robotics Foundation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Willow Garage, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import threading
+import time
+
+
+def test_run_pipeline():
+    from rosdep2.pipeline import run_pipeline
+    assert run_pipeline([], [(str, 2)]) == []
+    # results keep the order of the items, even if stages with
+    # several workers finish them out of order
+    retval = run_pipeline(list(range(20)), [
+        (lambda i: (time.sleep(0.001 * (i % 3)), i)[1], 4),
+        (lambda i: i * 2, 1),
+        (str, 2),
+    ])
+    assert retval == [str(i * 2) for i in range(20)]
+
+
+def test_run_pipeline_overlap():
+    from rosdep2.pipeline import run_pipeline
+    second_fetched = threading.Event()
+    written = []
+
+    def fetch(i):
+        if i == 1:
+            second_fetched.set()
+        return i
+
+    def persist(i):
+        # the next item is fetched while the first one is written,
+        # processing one item after the other would time out here
+        if i == 0:
+            assert second_fetched.wait(5)
+        written.append(i)
+        return i
+
+    assert run_pipeline(list(range(4)), [(fetch, 1), (lambda i: i, 1), (persist, 1)]) == list(range(4))
+    assert written == list(range(4))
+
+
+def test_run_pipeline_bounded():
+    from rosdep2.pipeline import run_pipeline
+    lock = threading.Lock()
+    in_flight = [0, 0]
+
+    def fetch(i):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        return i
+
+    def persist(i):
+        time.sleep(0.002)
+        with lock:
+            in_flight[0] -= 1
+        return i
+
+    run_pipeline(list(range(30)), [(fetch, 4), (persist, 1)], queue_size=2)
+    # at most queue_size items wait for the slow stage, one is
+    # processed by it and each fetch worker holds one more
+    assert in_flight[1] <= 2 + 1 + 4
+
+
+def test_run_pipeline_error():
+    from rosdep2.pipeline import run_pipeline
+    processed = []
+
+    def fail(i):
+        if i == 1:
+            raise ValueError('item %d' % i)
+        return i
+
+    try:
+        run_pipeline(list(range(5)), [(fail, 2), (processed.append, 1)])
+        assert False, 'should have raised'
+    except ValueError as e:
+        assert str(e) == 'item 1'
+    # the other items are still processed
+    assert sorted(processed) == [0, 2, 3, 4]
+
+
+def test_run_pipeline_interrupt():
+    from rosdep2.pipeline import run_pipeline
+    processed = []
+    raised = []
+
+    def interrupt(i):
+        if i == 1:
+            raise KeyboardInterrupt()
+        return i
+
+    def run():
+        try:
+            run_pipeline(list(range(20)), [(interrupt, 1), (processed.append, 1)], queue_size=1)
+        except KeyboardInterrupt as e:
+            raised.append(e)
+    # run in a thread, a pipeline which does not finish must not block the tests
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive(), 'pipeline did not finish'
+    assert len(raised) == 1
+    # no further items are processed
+    assert processed in ([], [0])
@@ -0,0 +1,145 @@
+# Copyright (c) 2019, Open Source Robotics Foundation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Willow Garage, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import tempfile
+
+from .sources_list_fixtures import create_sources_list, use_test_rosdistro_index
+
+
+def _create_installer_context(os_name, os_version):
+    from rosdep2 import create_default_installer_context
+    installer_context = create_default_installer_context()
+    installer_context.set_os_override(os_name, os_version)
+    return installer_context
+
+
+@use_test_rosdistro_index()
+def test_platform_table():
+    from rosdep2.lookup import RosdepLookup
+    from rosdep2.platform_tables import write_platform_table, load_platform_table, \
+        apply_platform_table, get_platform_table_path
+    from rosdep2.rospkg_loader import DEFAULT_VIEW_KEY
+    from rosdep2.sources_list import update_sources_list, SourcesListLoader, \
+        DataSourceMatcher, compute_filename_hash, write_atomic, PICKLE_CACHE_EXT
+    try:
+        import cPickle as pickle
+    except ImportError:
+        import pickle
+    sources_list_dir, urls = create_sources_list([
+        {'key0': {'ubuntu': ['pkg0']}, 'shared': {'ubuntu': ['from0']}},
+        {'key1': {'ubuntu': {'apt': {'packages': ['pkg1']}}}, 'shared': {'ubuntu': ['from1']}},
+        {'key2': {'ubuntu': {'lucid': ['pkg2']}}}])
+    tempdir = tempfile.mkdtemp()
+    os_override = ('ubuntu', 'lucid')
+    update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir,
+                        os_override=os_override)
+    matcher = DataSourceMatcher.create_default(os_override=os_override)
+    installer_context = _create_installer_context(*os_override)
+
+    assert load_platform_table(tempdir, matcher, installer_context) is None
+    filepath = write_platform_table(tempdir, matcher, installer_context)
+    assert filepath == get_platform_table_path(tempdir, installer_context)
+    rules = load_platform_table(tempdir, matcher, installer_context)
+    assert sorted(rules.keys()) == ['key0', 'key1', 'key2', 'shared']
+
+    # the table matches the regular resolution
+    sources_loader = SourcesListLoader.create_default(matcher, sources_cache_dir=tempdir)
+    lookup = RosdepLookup.create_from_rospkg(sources_loader=sources_loader)
+    view = lookup.get_rosdep_view(DEFAULT_VIEW_KEY)
+    os_name, os_version = os_override
+    installer_keys = installer_context.get_os_installer_keys(os_name)
+    default_key = installer_context.get_default_os_installer_key(os_name)
+    for rosdep_key, rule in rules.items():
+        assert view.lookup(rosdep_key).get_rule_for_platform(os_name, os_version, installer_keys, default_key) == rule
+
+    # the view uses the table
+    assert apply_platform_table(view, tempdir, matcher, installer_context)
+    assert view._platform_rules[1] == rules
+    view.set_platform_rules(os_name, os_version, installer_keys, default_key, {'key0': ('apt', ['from-table'])})
+    assert view.lookup('key0').get_rule_for_platform(os_name, os_version, installer_keys, default_key) == ('apt', ['from-table'])
+
+    # tables are only used for the platform they were computed for
+    other_context = _create_installer_context('ubuntu', 'trusty')
+    assert load_platform_table(tempdir, matcher, other_context) is None
+    assert not apply_platform_table(view, tempdir, matcher, _create_installer_context('nonexistent', 'os'))
+
+    # a changed sources cache makes the table stale
+    pickle_path = os.path.join(tempdir, compute_filename_hash(urls[0]) + PICKLE_CACHE_EXT)
+    write_atomic(pickle_path, pickle.dumps({'changed': {}}, 2), True)
+    os.utime(pickle_path, (0, 0))
+    assert load_platform_table(tempdir, matcher, installer_context) is None
+    # and is removed when the next table is written
+    write_platform_table(tempdir, matcher, other_context)
+    assert not os.path.exists(filepath)
+
+
+@use_test_rosdistro_index()
+def test_platform_table_corrupt():
+    from rosdep2.platform_tables import write_platform_table, load_platform_table
+    from rosdep2.sources_list import update_sources_list, DataSourceMatcher
+    sources_list_dir, urls = create_sources_list([{'key0': {'ubuntu': ['pkg0']}}])
+    tempdir = tempfile.mkdtemp()
+    os_override = ('ubuntu', 'lucid')
+    update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir,
+                        os_override=os_override)
+    matcher = DataSourceMatcher.create_default(os_override=os_override)
+    installer_context = _create_installer_context(*os_override)
+    filepath = write_platform_table(tempdir, matcher, installer_context)
+
+    for data in [b'', b'not a pickle', b'\x80\x02}q\x00']:
+        with open(filepath, 'wb') as f:
+            f.write(data)
+        # a corrupt table is treated as missing
+        assert load_platform_table(tempdir, matcher, installer_context) is None
+        # and is replaced by the next table
+        assert write_platform_table(tempdir, matcher, installer_context) == filepath
+        assert load_platform_table(tempdir, matcher, installer_context) is not None
+
+
+@use_test_rosdistro_index()
+def test_platform_table_written_by_update():
+    from rosdep2.cache_generations import get_current_generation
+    from rosdep2.platform_tables import write_platform_table, load_platform_table
+    from rosdep2.sources_list import update_sources_list, DataSourceMatcher
+    sources_list_dir, urls = create_sources_list([{'key0': {'ubuntu': ['pkg0']}}])
+    sources_cache_dir = os.path.join(tempfile.mkdtemp(), 'sources.cache')
+    os_override = ('ubuntu', 'lucid')
+    matcher = DataSourceMatcher.create_default(os_override=os_override)
+    installer_context = _create_installer_context(*os_override)
+    new_cache_dirs = []
+
+    def cache_handler(new_cache_dir):
+        # the table is written before the new cache is published
+        assert get_current_generation(sources_cache_dir) != get_current_generation(new_cache_dir)
+        new_cache_dirs.append(new_cache_dir)
+        write_platform_table(new_cache_dir, matcher, installer_context)
+    for count in range(0, 2):
+        update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=sources_cache_dir,
+                            os_override=os_override, cache_handler=cache_handler)
+        assert get_current_generation(sources_cache_dir) == get_current_generation(new_cache_dirs[-1])
+        assert load_platform_table(sources_cache_dir, matcher, installer_context) is not None
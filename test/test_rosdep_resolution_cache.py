@@ -0,0 +1,141 @@
+# Copyright (c) 2019, Open Source Robotics Foundation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Willow Garage, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from mock import patch
+
+from rosdep2.lookup import RosdepDefinition
+from rosdep2.resolution_cache import ResolutionCache, get_resolution_cache_path, prune_resolution_cache
+
+from .test_rosdep_lookup import create_test_SourcesListLoader, get_test_rospkgs
+
+
+def create_sources_cache(index='yaml file:///tmp/base.yaml\n'):
+    sources_cache_dir = tempfile.mkdtemp()
+    with open(os.path.join(sources_cache_dir, 'index'), 'w') as f:
+        f.write(index)
+    return sources_cache_dir
+
+
+def test_ResolutionCache():
+    sources_cache_dir = create_sources_cache()
+    try:
+        definition = RosdepDefinition('foo', {'ubuntu': ['foo-dev']})
+        cache = ResolutionCache.open(sources_cache_dir)
+        assert cache.get(definition, 'ubuntu', 'focal', 'apt') is None
+        cache.set(definition, 'ubuntu', 'focal', 'apt', ['foo-dev'], [])
+        assert cache.get(definition, 'ubuntu', 'focal', 'apt') == (['foo-dev'], [])
+        assert cache.get(definition, 'ubuntu', 'jammy', 'apt') is None
+        assert cache.hits == 1
+        assert cache.misses == 2
+        cache.close()
+        # the cache file is not part of the sources cache
+        assert os.path.exists(get_resolution_cache_path(sources_cache_dir))
+        assert os.listdir(sources_cache_dir) == ['index']
+
+        # entries are kept for later invocations
+        cache = ResolutionCache.open(sources_cache_dir)
+        assert cache.get(definition, 'ubuntu', 'focal', 'apt') == (['foo-dev'], [])
+        # but not for changed definitions
+        changed = RosdepDefinition('foo', {'ubuntu': ['foo2-dev']})
+        assert cache.get(changed, 'ubuntu', 'focal', 'apt') is None
+        cache.close()
+
+        # or after the sources cache changed
+        with open(os.path.join(sources_cache_dir, 'index'), 'w') as f:
+            f.write('yaml file:///tmp/other.yaml\n')
+        cache = ResolutionCache.open(sources_cache_dir)
+        assert cache.get(definition, 'ubuntu', 'focal', 'apt') is None
+        cache.set(definition, 'ubuntu', 'focal', 'apt', ['foo-dev', 'bar-dev'], [])
+        cache.close()
+
+        # pruning only keeps the entries of the current sources cache
+        prune_resolution_cache(sources_cache_dir)
+        conn = sqlite3.connect(get_resolution_cache_path(sources_cache_dir))
+        assert [(['foo-dev', 'bar-dev'], [])] == [pickle.loads(bytes(row[0])) for row in conn.execute('SELECT value FROM resolutions')]
+        conn.close()
+    finally:
+        shutil.rmtree(sources_cache_dir)
+        os.unlink(get_resolution_cache_path(sources_cache_dir))
+
+
+def test_ResolutionCache_no_sources_cache():
+    sources_cache_dir = tempfile.mkdtemp()
+    try:
+        assert ResolutionCache.open(os.path.join(sources_cache_dir, 'missing')) is None
+    finally:
+        shutil.rmtree(sources_cache_dir)
+
+
+def test_RosdepLookup_resolve_persistent():
+    from rosdep2 import create_default_installer_context
+    from rosdep2.lookup import RosdepLookup
+    rospack, rosstack = get_test_rospkgs()
+    sources_cache_dir = create_sources_cache()
+    try:
+        installer_context = create_default_installer_context()
+        installer_context.set_os_override('ubuntu', 'lucid')
+        installer = installer_context.get_installer('apt')
+        for count in range(0, 2):
+            # a new lookup does not share the in-memory resolve cache
+            lookup = RosdepLookup.create_from_rospkg(rospack=rospack, rosstack=rosstack,
+                                                     sources_loader=create_test_SourcesListLoader())
+            lookup.persistent_resolve_cache = ResolutionCache.open(sources_cache_dir)
+            with patch.object(installer, 'resolve', wraps=installer.resolve) as mock_resolve:
+                installer_key, resolution, dependencies = lookup.resolve('testtinyxml', 'rospack_fake', installer_context)
+                assert mock_resolve.called == (count == 0)
+            assert 'apt' == installer_key
+            assert ['libtinyxml-dev'] == resolution
+            assert [] == dependencies
+            lookup.persistent_resolve_cache.close()
+    finally:
+        shutil.rmtree(sources_cache_dir)
+        os.unlink(get_resolution_cache_path(sources_cache_dir))
+
+
+def test_command_resolve_persistent():
+    from rosdep2.main import rosdep_main
+    sources_cache_dir = os.path.join(tempfile.mkdtemp(), 'sources.cache')
+    shutil.copytree(os.path.join(os.path.dirname(__file__), 'sources_cache'), sources_cache_dir)
+    try:
+        rosdep_main(['resolve', 'testtinyxml', '-c', sources_cache_dir, '--os', 'ubuntu:lucid', '--resolution-cache'])
+        conn = sqlite3.connect(get_resolution_cache_path(sources_cache_dir))
+        try:
+            assert conn.execute('SELECT COUNT(*) FROM resolutions').fetchone()[0] == 1
+        finally:
+            conn.close()
+    finally:
+        shutil.rmtree(os.path.dirname(sources_cache_dir))
@@ -0,0 +1,92 @@
+# Copyright (c) 2019, Open Source Robotics Foundation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the Willow Garage, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import socket
+import tempfile
+
+from mock import patch
+
+try:
+    from urllib.error import HTTPError, URLError
+except ImportError:
+    from urllib2 import HTTPError, URLError
+
+
+def _http_error(code):
+    return HTTPError('http://example.com/index.yaml', code, 'error', {}, None)
+
+
+@patch('rosdep2.rosdistrohelper.DOWNLOAD_RETRY_PERIOD', 0)
+def test_load_url_retries():
+    from rosdep2.rosdistrohelper import _load_url, set_cache_dir
+    set_cache_dir(None)
+    url = 'http://example.com/index.yaml'
+    # transient errors are retried
+    for error in [_http_error(503), URLError(socket.timeout())]:
+        with patch('rosdep2.rosdistrohelper.download_if_modified') as download_mock:
+            download_mock.side_effect = [error, (b'data', {'digest': 'abc'})]
+            assert _load_url(url) == (b'data', 'abc')
+            assert download_mock.call_count == 2
+
+    # but not indefinitely
+    with patch('rosdep2.rosdistrohelper.download_if_modified') as download_mock:
+        download_mock.side_effect = _http_error(500)
+        try:
+            _load_url(url)
+            assert False, 'should have raised'
+        except HTTPError:
+            pass
+        assert download_mock.call_count == 3
+
+    # other errors are not retried
+    with patch('rosdep2.rosdistrohelper.download_if_modified') as download_mock:
+        download_mock.side_effect = _http_error(404)
+        try:
+            _load_url(url)
+            assert False, 'should have raised'
+        except HTTPError:
+            pass
+        assert download_mock.call_count == 1
+
+
+def test_failed_update_resets_cache_dir():
+    from rosdep2.rosdistrohelper import get_cache_dir, set_cache_dir
+    from rosdep2.sources_list import update_sources_list, ROSDISTRO_CACHE_DIR
+
+    def failing_update(sources_cache_dir, *args):
+        set_cache_dir(os.path.join(sources_cache_dir, ROSDISTRO_CACHE_DIR))
+        raise IOError('failed')
+    sources_cache_dir = os.path.join(tempfile.mkdtemp(), 'sources.cache')
+    with patch('rosdep2.sources_list._update_sources_cache', side_effect=failing_update):
+        try:
+            update_sources_list(sources_cache_dir=sources_cache_dir)
+            assert False, 'should have raised'
+        except IOError:
+            pass
+    # the generation was discarded, so its directory is not used anymore
+    assert get_cache_dir() is None
@@ -216,6 +216,11 @@ def test_SourceInstaller_resolve():
     # test for reinstall (to check the depends in rdmanifest)
     dependencies = installer.get_depends(dict(uri=url, md5sum=md5sum_good))
     assert dependencies == ['checkinstall'], 'Dependencies should resolve to checkinstall listed in the rdmanifest.'
+    # the depends of the rule itself must not be modified
+    rule = dict(uri=url, md5sum=md5sum_good, depends=['foo'])
+    assert installer.get_depends(rule) == ['foo', 'checkinstall']
+    assert installer.get_depends(rule) == ['foo', 'checkinstall']
+    assert rule['depends'] == ['foo']
     resolved = resolved[0]
 
     assert resolved.install_command == rep122_install_command
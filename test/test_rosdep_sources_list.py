@@ -25,6 +25,7 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import hashlib
 import os
 import tempfile
 import yaml
@@ -35,9 +36,13 @@ except ImportError:
     from urllib2 import urlopen
     from urllib2 import URLError
 
+from mock import patch
+
 import rospkg.distro
 import rosdep2.sources_list
 
+from .sources_list_fixtures import create_local_sources, use_rosdistro_index, use_test_rosdistro_index
+
 GITHUB_BASE_URL = 'https://raw.githubusercontent.com/ros/rosdistro/master/rosdep/base.yaml'
 
 
@@ -379,6 +384,45 @@ def test_parse_sources_data():
             pass
 
 
+def test_parse_sources_data_mirrors():
+    from rosdep2.sources_list import parse_sources_data, InvalidData
+    mirror_url = 'https://mirror.example.com/rosdistro/rosdep/base.yaml'
+    retval = parse_sources_data('yaml %s|%s fuerte ubuntu' % (GITHUB_URL, mirror_url))
+    assert len(retval) == 1
+    sd = retval[0]
+    assert sd.url == GITHUB_URL
+    assert sd.mirrors == [mirror_url]
+    assert sd.tags == ['fuerte', 'ubuntu']
+    assert str(sd) == '[<string>]:\nyaml %s|%s fuerte ubuntu' % (GITHUB_URL, mirror_url)
+    assert parse_sources_data(EXAMPLE_SOURCES_DATA_NO_TAGS)[0].mirrors == []
+    for bad in ['yaml %s|' % GITHUB_URL, 'yaml %s|https://mirror.example.com' % GITHUB_URL]:
+        try:
+            parse_sources_data(bad)
+            assert False, 'should have raised: %s' % (bad)
+        except InvalidData:
+            pass
+
+
+@use_test_rosdistro_index()
+def test_update_sources_list_mirrors():
+    from rosdep2.sources_list import update_sources_list, load_cached_sources_list, MIRRORS_FILE
+    sources_list_dir, urls = create_local_sources(1)
+    # the missing source is mirrored by the existing one
+    with open(os.path.join(sources_list_dir, '10-local.list'), 'w') as f:
+        f.write('yaml %s|%s\n' % (urls[1], urls[0]))
+    tempdir = tempfile.mkdtemp()
+    failed = []
+    retval = update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir,
+                                 error_handler=lambda source, e: failed.append(source))
+    assert not failed
+    # cached under the first URL
+    assert retval[0][0].url == urls[1]
+    sources = load_cached_sources_list(sources_cache_dir=tempdir)
+    assert sources[0].url == urls[1]
+    assert 'key0' in sources[0].rosdep_data
+    assert os.path.exists(os.path.join(tempdir, MIRRORS_FILE))
+
+
 def test_DataSourceMatcher_create_default():
     distro_name = rospkg.distro.current_distro_codename()
     os_detect = rospkg.os_detect.OsDetect()
@@ -496,3 +540,662 @@ def test_unpickle_same_results():
     with open(os.path.join('test', 'fixtures', 'python3cache.pickle'), 'rb') as py3_cache:
         py3_result = pickle.loads(py3_cache.read())
     assert py2_result == py3_result
+
+
+@use_test_rosdistro_index()
+def test_update_sources_list_jobs():
+    from rosdep2.sources_list import update_sources_list, load_cached_sources_list
+    sources_list_dir, urls = create_local_sources(6)
+    for jobs in [1, 3, 16]:
+        tempdir = os.path.join(tempfile.mkdtemp(), 'cache')
+        calls = []
+        retval = update_sources_list(sources_list_dir=sources_list_dir,
+                                     sources_cache_dir=tempdir,
+                                     success_handler=lambda s: calls.append(('ok', s.url)),
+                                     error_handler=lambda s, e: calls.append(('error', s.url)),
+                                     jobs=jobs)
+        # results and callbacks are reported in sources list order
+        assert [s.url for s, _ in retval] == urls[:-1]
+        assert calls == [('ok', url) for url in urls[:-1]] + [('error', urls[-1])], calls
+        sources = load_cached_sources_list(sources_cache_dir=tempdir)
+        assert [s.url for s in sources] == urls
+        assert sources[2].rosdep_data['shared'] == {'ubuntu': ['from2']}
+        assert sources[-1].rosdep_data == {}
+
+
+class _LocalHTTPServer(object):
+    """
+    Serve a dictionary of {path: bytes} over HTTP on localhost,
+    answering conditional requests based on ETag.
+    """
+
+    def __init__(self, files):
+        try:
+            from http.server import BaseHTTPRequestHandler, HTTPServer
+        except ImportError:
+            from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+        import threading
+        server = self
+        self.files = files
+        self.requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                server.requests.append((self.path, dict(self.headers.items())))
+                if self.path not in server.files:
+                    self.send_error(404)
+                    return
+                data = server.files[self.path]
+                etag = '"%s"' % hashlib.sha1(data).hexdigest()
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@use_test_rosdistro_index()
+def test_update_sources_list_not_modified():
+    from rosdep2.sources_list import update_sources_list, compute_filename_hash, \
+        read_cache_meta, write_atomic, PICKLE_CACHE_EXT
+    try:
+        import cPickle as pickle
+    except ImportError:
+        import pickle
+    server = _LocalHTTPServer({'/base.yaml': b'foo:\n  ubuntu: [libfoo]\n'})
+    try:
+        sources_list_dir = tempfile.mkdtemp()
+        url = server.url + '/base.yaml'
+        with open(os.path.join(sources_list_dir, '10-http.list'), 'w') as f:
+            f.write('yaml %s\n' % url)
+        tempdir = tempfile.mkdtemp()
+        update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir)
+        cache_meta = read_cache_meta(tempdir, url)
+        assert cache_meta['etag']
+        assert 'If-None-Match' not in server.requests[-1][1]
+
+        # replace the cached data to detect a rewrite
+        pickle_path = os.path.join(tempdir, compute_filename_hash(url)) + PICKLE_CACHE_EXT
+        write_atomic(pickle_path, pickle.dumps({'sentinel': {}}, 2), True)
+        retval = update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir)
+        assert server.requests[-1][1].get('If-None-Match') == cache_meta['etag']
+        assert len(retval) == 1
+        with open(pickle_path, 'rb') as f:
+            assert pickle.loads(f.read()) == {'sentinel': {}}
+
+        # changed upstream data is downloaded again
+        server.files['/base.yaml'] = b'bar:\n  ubuntu: [libbar]\n'
+        update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir)
+        with open(pickle_path, 'rb') as f:
+            assert 'bar' in pickle.loads(f.read())
+        assert read_cache_meta(tempdir, url)['etag'] != cache_meta['etag']
+    finally:
+        server.close()
+
+
+@use_test_rosdistro_index()
+def test_update_sources_list_unchanged():
+    from rosdep2.sources_list import update_sources_list, compute_filename_hash, \
+        read_cache_meta, write_atomic, PICKLE_CACHE_EXT
+    try:
+        import cPickle as pickle
+    except ImportError:
+        import pickle
+    sources_list_dir, urls = create_local_sources(3)
+    tempdir = tempfile.mkdtemp()
+    unchanged = []
+    update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir,
+                        unchanged_handler=unchanged.append)
+    assert unchanged == []
+    assert read_cache_meta(tempdir, urls[0])['digest']
+
+    # file:// sources have no validators, so only the digest can tell
+    # that the content is the same
+    pickle_path = os.path.join(tempdir, compute_filename_hash(urls[0])) + PICKLE_CACHE_EXT
+    write_atomic(pickle_path, pickle.dumps({'sentinel': {}}, 2), True)
+    update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir,
+                        unchanged_handler=unchanged.append)
+    assert [s.url for s in unchanged] == urls[:-1]
+    with open(pickle_path, 'rb') as f:
+        assert pickle.loads(f.read()) == {'sentinel': {}}
+
+    # a missing cache file is downloaded again even with a known digest
+    os.remove(pickle_path)
+    del unchanged[:]
+    update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir,
+                        unchanged_handler=unchanged.append)
+    assert [s.url for s in unchanged] == urls[1:-1]
+    with open(pickle_path, 'rb') as f:
+        assert 'key0' in pickle.loads(f.read())
+
+
+@use_test_rosdistro_index()
+def test_cache_snapshot():
+    from rosdep2.sources_list import update_sources_list, SourcesListLoader, \
+        DataSourceMatcher, compute_filename_hash, write_atomic, PICKLE_CACHE_EXT
+    from rosdep2.lookup import RosdepLookup
+    from rosdep2.model import RosdepDatabase
+    try:
+        import cPickle as pickle
+    except ImportError:
+        import pickle
+    sources_list_dir, urls = create_local_sources(3)
+    tempdir = tempfile.mkdtemp()
+    os_override = ('fubuntu', 'flucid')
+    update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir,
+                        os_override=os_override)
+    matcher = DataSourceMatcher.create_default(os_override=os_override)
+
+    loader = SourcesListLoader.create_default(matcher, sources_cache_dir=tempdir)
+    assert len(loader.sources) == 1
+    snapshot_data = loader.sources[0].rosdep_data
+    full_loader = SourcesListLoader.create_default(matcher, sources_cache_dir=tempdir, use_snapshot=False)
+    assert [s.url for s in full_loader.sources] == urls
+
+    # the snapshot resolves keys the same way as merging the sources
+    for key in ['key0', 'key2', 'shared']:
+        views = []
+        for sources_loader in [loader, full_loader]:
+            lookup = RosdepLookup(RosdepDatabase(), sources_loader)
+            lookup._load_all_views(sources_loader)
+            views.append(lookup.create_rosdep_view('test', sources_loader.get_loadable_views()))
+        assert views[0].lookup(key).data == views[1].lookup(key).data
+    assert snapshot_data['shared'] == {'ubuntu': ['from0']}
+
+    # snapshots are only used for the tags they were written for
+    other = SourcesListLoader.create_default(DataSourceMatcher(['ubuntu']), sources_cache_dir=tempdir)
+    assert [s.url for s in other.sources] == urls
+
+    # a changed cache file makes the snapshot stale
+    pickle_path = os.path.join(tempdir, compute_filename_hash(urls[0]) + PICKLE_CACHE_EXT)
+    write_atomic(pickle_path, pickle.dumps({'changed': {}}, 2), True)
+    os.utime(pickle_path, (0, 0))
+    loader = SourcesListLoader.create_default(matcher, sources_cache_dir=tempdir)
+    assert [s.url for s in loader.sources] == urls
+    assert 'changed' in loader.sources[0].rosdep_data
+
+
+@use_test_rosdistro_index()
+def test_cache_snapshot_unchanged():
+    from rosdep2.sources_list import update_sources_list, SNAPSHOT_CACHE, PICKLE_CACHE_EXT
+    sources_list_dir, urls = create_local_sources(2)
+    tempdir = os.path.join(tempfile.mkdtemp(), 'sources.cache')
+    os_override = ('fubuntu', 'flucid')
+    update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir,
+                        os_override=os_override)
+    snapshot_path = os.path.join(tempdir, SNAPSHOT_CACHE + PICKLE_CACHE_EXT)
+    stat = os.stat(snapshot_path)
+
+    # the snapshot is not rebuilt if the cache did not change
+    update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir,
+                        os_override=os_override)
+    assert os.stat(snapshot_path).st_ino == stat.st_ino
+
+    # the data of updated sources is not loaded again from their cache files
+    with patch('rosdep2.sources_list.decompress_cache_data') as decompress_cache_data:
+        update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=os.path.join(tempfile.mkdtemp(), 'cache'),
+                            os_override=os_override)
+    assert not decompress_cache_data.called
+
+    # nor written at all if disabled
+    update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir,
+                        os_override=os_override, snapshot=False)
+    assert not os.path.exists(snapshot_path)
+
+
+@use_test_rosdistro_index()
+def test_key_index():
+    from rosdep2.sources_list import update_sources_list, SourcesListLoader, SourcesKeyIndex, \
+        DataSourceMatcher, compute_filename_hash, write_atomic, PICKLE_CACHE_EXT, KEY_INDEX
+    from rosdep2.lookup import RosdepLookup
+    from rosdep2.model import RosdepDatabase
+    try:
+        import cPickle as pickle
+    except ImportError:
+        import pickle
+    sources_list_dir, urls = create_local_sources(3)
+    tempdir = tempfile.mkdtemp()
+    assert SourcesKeyIndex.open(tempdir) is None
+    update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir)
+    assert os.path.exists(os.path.join(tempdir, KEY_INDEX))
+    matcher = DataSourceMatcher(['ubuntu'])
+
+    # the index is not rebuilt if the cache did not change
+    stat = os.stat(os.path.join(tempdir, KEY_INDEX))
+    update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir)
+    assert os.stat(os.path.join(tempdir, KEY_INDEX)).st_ino == stat.st_ino
+
+    key_index = SourcesKeyIndex.open(tempdir)
+    try:
+        assert sorted(key_index.get_keys(matcher)) == ['key0', 'key1', 'key2', 'shared']
+        sources = key_index.get_sources(matcher, ['key1', 'shared', 'undefined'])
+    finally:
+        key_index.close()
+    full_sources = SourcesListLoader.create_default(matcher, sources_cache_dir=tempdir, use_snapshot=False).sources
+    assert [s.source for s in sources] == [s.source for s in full_sources]
+    for source, full_source in zip(sources, full_sources):
+        assert source.rosdep_data == dict((k, v) for k, v in full_source.rosdep_data.items() if k in ['key1', 'shared'])
+
+    # the sources loaded from the index resolve keys like the full sources
+    loader = SourcesListLoader.create_default(matcher, sources_cache_dir=tempdir, rosdep_keys=['shared', 'key1'])
+    assert [s.rosdep_data for s in loader.sources] == [s.rosdep_data for s in sources]
+    for key in ['key1', 'shared']:
+        views = []
+        for sources_loader in [loader, SourcesListLoader(full_sources)]:
+            lookup = RosdepLookup(RosdepDatabase(), sources_loader)
+            lookup._load_all_views(sources_loader)
+            views.append(lookup.create_rosdep_view('test', sources_loader.get_loadable_views()))
+        assert views[0].lookup(key).data == views[1].lookup(key).data
+    assert views[0].lookup('shared').data == {'ubuntu': ['from0']}
+
+    # the view on the index keeps the definitions of the keys already looked up
+    from rosdep2.rospack import _KeyIndexView
+    key_index = SourcesKeyIndex.open(tempdir)
+    try:
+        view = _KeyIndexView('test', key_index, matcher)
+        definition = view.lookup('shared')
+        assert view.lookup('key1').data == views[1].lookup('key1').data
+        assert view.lookup('shared') is definition
+        # the sources have one layer each, whatever the number of lookups
+        assert len(view._layers) == len(sources)
+    finally:
+        key_index.close()
+
+    # a changed cache file makes the index stale
+    pickle_path = os.path.join(tempdir, compute_filename_hash(urls[0]) + PICKLE_CACHE_EXT)
+    write_atomic(pickle_path, pickle.dumps({'changed': {}}, 2), True)
+    os.utime(pickle_path, (0, 0))
+    assert SourcesKeyIndex.open(tempdir) is None
+    loader = SourcesListLoader.create_default(matcher, sources_cache_dir=tempdir, use_snapshot=False,
+                                              rosdep_keys=['shared'])
+    assert 'changed' in loader.sources[0].rosdep_data
+
+
+@use_test_rosdistro_index()
+def test_key_index_incremental():
+    from rosdep2.sources_list import update_sources_list, SourcesKeyIndex, DataSourceMatcher
+    sources_list_dir, urls = create_local_sources(3)
+    tempdir = tempfile.mkdtemp()
+    update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir, snapshot=False)
+    with open(os.path.join(os.path.dirname(sources_list_dir), 'source1.yaml'), 'w') as f:
+        yaml.safe_dump({'key1': {'ubuntu': ['changed']}}, f)
+
+    # only the data of the changed source is written to the index again
+    with patch('rosdep2.sources_list.decompress_cache_data') as decompress_cache_data:
+        update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir, snapshot=False)
+    assert not decompress_cache_data.called
+    key_index = SourcesKeyIndex.open(tempdir)
+    try:
+        sources = key_index.get_sources(DataSourceMatcher(['ubuntu']), ['key0', 'key1', 'shared'])
+    finally:
+        key_index.close()
+    assert [s.rosdep_data for s in sources] == [
+        {'key0': {'ubuntu': ['pkg0']}, 'shared': {'ubuntu': ['from0']}},
+        {'key1': {'ubuntu': ['changed']}},
+        {'shared': {'ubuntu': ['from2']}},
+        {},
+    ]
+
+
+def test_load_cached_sources_list_lazy():
+    from rosdep2.sources_list import load_cached_sources_list, SourcesListLoader, \
+        DataSourceMatcher, compute_filename_hash, write_cache_file, PICKLE_CACHE_EXT, CACHE_INDEX
+    tempdir = tempfile.mkdtemp()
+    urls = ['https://example.com/ubuntu.yaml', 'https://example.com/fedora.yaml']
+    with open(os.path.join(tempdir, CACHE_INDEX), 'w') as f:
+        f.write('yaml %s ubuntu\nyaml %s fedora\n' % tuple(urls))
+    write_cache_file(tempdir, urls[0], {'foo': {'ubuntu': ['libfoo']}})
+    # a source that does not match must not even be read
+    with open(os.path.join(tempdir, compute_filename_hash(urls[1]) + PICKLE_CACHE_EXT), 'wb') as f:
+        f.write(b'not a pickle')
+
+    sources = load_cached_sources_list(sources_cache_dir=tempdir)
+    assert [s.url for s in sources] == urls
+    loader = SourcesListLoader.create_default(DataSourceMatcher(['ubuntu']), sources_cache_dir=tempdir,
+                                              use_snapshot=False)
+    assert [s.url for s in loader.sources] == urls[:1]
+    assert loader.sources[0].rosdep_data == {'foo': {'ubuntu': ['libfoo']}}
+    try:
+        sources[1].rosdep_data
+        assert False, 'should have raised'
+    except Exception:
+        pass
+
+
+def _use_local_rosdistro_index():
+    """
+    Create a rosdistro index with a single distribution 'testdistro'
+    released for ubuntu and debian.
+
+    :returns: patch of the environment which uses the index, see
+        :func:`use_rosdistro_index`
+    """
+    try:
+        from urllib.request import pathname2url
+    except ImportError:
+        from urllib import pathname2url
+    basedir = tempfile.mkdtemp()
+    with open(os.path.join(basedir, 'distribution.yaml'), 'w') as f:
+        yaml.safe_dump({
+            'type': 'distribution', 'version': 2,
+            'release_platforms': {'debian': ['buster'], 'ubuntu': ['bionic', 'focal']},
+            'repositories': {
+                'foo': {'release': {'packages': ['foo', 'foo_msgs'], 'tags': {'release': 'release/{package}/{version}'}, 'url': 'https://example.com/foo-release.git', 'version': '1.0.0-1'}},
+                'bar': {'release': {'tags': {'release': 'release/{package}/{version}'}, 'url': 'https://example.com/bar-release.git', 'version': '2.0.0-1'}},
+            },
+        }, f)
+    with open(os.path.join(basedir, 'index.yaml'), 'w') as f:
+        yaml.safe_dump({
+            'type': 'index', 'version': 4,
+            'distributions': {'testdistro': {
+                'distribution': ['file://' + pathname2url(os.path.join(basedir, 'distribution.yaml'))],
+                'distribution_status': 'active', 'distribution_type': 'ros1', 'python_version': 3,
+            }},
+        }, f)
+    return use_rosdistro_index(os.path.join(basedir, 'index.yaml'))
+
+
+def test_update_sources_list_shard_platforms():
+    from rosdep2.sources_list import update_sources_list, load_cached_sources_list, \
+        SourcesListLoader, DataSourceMatcher, merge_sources_data
+    with _use_local_rosdistro_index():
+        sources_list_dir, urls = create_local_sources(1)
+        matcher = DataSourceMatcher(['testdistro', 'ubuntu', 'focal'])
+
+        tempdir = tempfile.mkdtemp()
+        update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir)
+        full_data = merge_sources_data(SourcesListLoader.create_default(matcher, sources_cache_dir=tempdir).sources)
+        assert sorted(full_data['foo_msgs'].keys()) == ['_is_ros', 'debian', 'osx', 'ubuntu']
+
+        sharded_dir = tempfile.mkdtemp()
+        retval = update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=sharded_dir, shard_platforms=True)
+        assert [s.tags for s, _ in retval if 'testdistro' in s.tags] == \
+            [['testdistro'], ['testdistro', 'debian'], ['testdistro', 'osx'], ['testdistro', 'ubuntu']]
+        assert len(load_cached_sources_list(sources_cache_dir=sharded_dir)) == len(retval) + 1
+        sources = SourcesListLoader.create_default(matcher, sources_cache_dir=sharded_dir, use_snapshot=False).sources
+        assert [s.tags for s in sources if 'testdistro' in s.tags] == [['testdistro'], ['testdistro', 'ubuntu']]
+        sharded_data = merge_sources_data(sources)
+        assert sorted(sharded_data.keys()) == sorted(full_data.keys())
+        for key, data in full_data.items():
+            assert sharded_data[key] == dict((os_name, rules) for os_name, rules in data.items()
+                                             if os_name in ['_is_ros', 'ubuntu'])
+
+        # limit the generated platforms
+        update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir, platforms=['ubuntu'])
+        data = merge_sources_data(SourcesListLoader.create_default(matcher, sources_cache_dir=tempdir).sources)
+        assert data['foo_msgs'] == sharded_data['foo_msgs']
+        assert data['foo_msgs']['ubuntu']['focal'] == {'apt': {'packages': ['ros-testdistro-foo-msgs']}}
+
+
+def test_update_sources_list_unchanged_distro():
+    from rosdep2.sources_list import update_sources_list, SourcesListLoader, DataSourceMatcher, \
+        merge_sources_data, ROSDISTRO_CACHE_DIR
+    with _use_local_rosdistro_index():
+        sources_list_dir, urls = create_local_sources(1)
+        matcher = DataSourceMatcher(['testdistro', 'ubuntu', 'focal'])
+        generated = []
+        get_gbprepo_as_rosdep_data = rosdep2.sources_list.get_gbprepo_as_rosdep_data
+
+        def counting_get_gbprepo_as_rosdep_data(dist_name, platforms=None):
+            generated.append(dist_name)
+            return get_gbprepo_as_rosdep_data(dist_name, platforms=platforms)
+
+        rosdep2.sources_list.get_gbprepo_as_rosdep_data = counting_get_gbprepo_as_rosdep_data
+        try:
+            tempdir = tempfile.mkdtemp()
+            for shard_platforms in [False, True]:
+                del generated[:]
+                retval = update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir,
+                                             shard_platforms=shard_platforms)
+                assert generated == ['testdistro']
+                assert len(os.listdir(os.path.join(tempdir, ROSDISTRO_CACHE_DIR))) == 4
+                data = merge_sources_data(SourcesListLoader.create_default(matcher, sources_cache_dir=tempdir).sources)
+
+                # the distribution file did not change
+                assert update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir,
+                                           shard_platforms=shard_platforms) == retval
+                assert generated == ['testdistro']
+                assert merge_sources_data(SourcesListLoader.create_default(matcher, sources_cache_dir=tempdir).sources) == data
+
+            # a changed distribution file is processed again
+            index = yaml.safe_load(open(os.environ['ROSDISTRO_INDEX_URL'][len('file://'):]))
+            dist_path = index['distributions']['testdistro']['distribution'][0][len('file://'):]
+            dist_data = yaml.safe_load(open(dist_path))
+            dist_data['repositories']['baz'] = dist_data['repositories'].pop('bar')
+            with open(dist_path, 'w') as f:
+                yaml.safe_dump(dist_data, f)
+            update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir, shard_platforms=True)
+            assert generated == ['testdistro', 'testdistro']
+            data = merge_sources_data(SourcesListLoader.create_default(matcher, sources_cache_dir=tempdir).sources)
+            assert 'baz' in data and 'bar' not in data
+        finally:
+            rosdep2.sources_list.get_gbprepo_as_rosdep_data = get_gbprepo_as_rosdep_data
+
+
+def test_update_sources_list_rosdistro_cache_dir():
+    from rosdep2.rosdistrohelper import get_cache_dir, set_cache_dir, get_release_file_digest, get_release_file
+    from rosdep2.sources_list import update_sources_list
+    with _use_local_rosdistro_index():
+        sources_list_dir, urls = create_local_sources(1)
+        set_cache_dir(None)
+        update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempfile.mkdtemp())
+        # the update does not leave the cache directory pointing into the sources cache
+        assert get_cache_dir() is None
+
+        # the distribution file is not kept in memory after its digest
+        # was computed, but read again from the cache directory
+        set_cache_dir(tempfile.mkdtemp())
+        try:
+            with patch('rosdep2.rosdistrohelper.download_if_modified',
+                       wraps=rosdep2.rosdistrohelper.download_if_modified) as download_mock:
+                get_release_file_digest('testdistro')
+                assert download_mock.call_count == 2
+                assert 'foo' in get_release_file('testdistro').repositories
+                assert download_mock.call_count == 2
+        finally:
+            set_cache_dir(None)
+
+
+def test_update_sources_list_only_matching():
+    from rosdep2.sources_list import update_sources_list, load_cached_sources_list, \
+        compute_filename_hash, CACHE_INDEX, NOT_FETCHED_PREFIX, PICKLE_CACHE_EXT
+    with _use_local_rosdistro_index():
+        sources_list_dir, urls = create_local_sources(2)
+        with open(os.path.join(sources_list_dir, '10-local.list'), 'w') as f:
+            f.write('yaml %s\nyaml %s debian\nyaml %s debian buster\n' % tuple(urls))
+        tempdir = tempfile.mkdtemp()
+        ros_distro = os.environ.pop('ROS_DISTRO', None)
+        errors = []
+        try:
+            # without a ROS distro, no distribution is used
+            retval = update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir,
+                                         error_handler=lambda source, e: errors.append(source),
+                                         os_override=('ubuntu', 'focal'), only_matching=True)
+            assert [source.url for source, _ in retval] == [urls[0]]
+            assert not errors
+            assert not os.path.exists(os.path.join(tempdir, compute_filename_hash(urls[1])) + PICKLE_CACHE_EXT)
+            with open(os.path.join(tempdir, CACHE_INDEX)) as f:
+                index = f.read()
+            assert index.count(NOT_FETCHED_PREFIX) == 3
+            assert [source.url for source in load_cached_sources_list(sources_cache_dir=tempdir)] == [urls[0]]
+
+            os.environ['ROS_DISTRO'] = 'testdistro'
+            retval = update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir,
+                                         error_handler=lambda source, e: errors.append(source),
+                                         os_override=('ubuntu', 'focal'), only_matching=True)
+            assert [source.tags for source, _ in retval] == [[], ['testdistro']]
+            with open(os.path.join(tempdir, CACHE_INDEX)) as f:
+                assert f.read().count(NOT_FETCHED_PREFIX) == 2
+            assert len(load_cached_sources_list(sources_cache_dir=tempdir)) == 2
+        finally:
+            if ros_distro is None:
+                os.environ.pop('ROS_DISTRO', None)
+            else:
+                os.environ['ROS_DISTRO'] = ros_distro
+
+
+def test_update_sources_list_stats():
+    from rosdep2.sources_list import update_sources_list, RosDistroSource
+    with _use_local_rosdistro_index():
+        sources_list_dir, urls = create_local_sources(2)
+        tempdir = tempfile.mkdtemp()
+        for i in range(2):
+            updated = []
+            failed = []
+            update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir,
+                                success_handler=updated.append,
+                                error_handler=lambda source, e: failed.append(source))
+            assert [source.url for source in updated[:2]] == urls[:2]
+            assert isinstance(updated[2], RosDistroSource)
+            for source in updated:
+                assert source.stats['requests'] >= 1
+                assert source.stats['bytes'] > 0
+                assert source.stats['transfer_time'] >= 0
+                # unchanged sources are not parsed and written again
+                assert (source.stats.get('pickle_bytes', 0) > 0) == (i == 0)
+                assert (source.stats.get('parse_time') is not None) == (i == 0)
+            assert [source.url for source in failed] == [urls[2]]
+            assert not failed[0].stats.get('bytes')
+
+
+def test_compress_cache_data():
+    import pickle
+    from rosdep2.sources_list import compress_cache_data, decompress_cache_data, get_cache_compressions
+    data = pickle.dumps({'foo': {'ubuntu': ['libfoo-dev']}}, 2)
+    assert get_cache_compressions()[0] == 'none'
+    for compression in get_cache_compressions():
+        compressed = compress_cache_data(data, compression)
+        assert (compressed == data) == (compression == 'none')
+        assert decompress_cache_data(compressed) == data
+    try:
+        compress_cache_data(data, 'zip')
+        assert False, 'should have raised'
+    except ValueError:
+        pass
+
+
+def test_update_sources_list_compression():
+    from rosdep2.sources_list import update_sources_list, load_cached_sources_list, \
+        get_cache_compression, PICKLE_CACHE_EXT
+    with _use_local_rosdistro_index():
+        sources_list_dir, urls = create_local_sources(2)
+        tempdir = tempfile.mkdtemp()
+        expected = None
+        selected = 'none'
+        for compression, written in [(None, True), ('bz2', True), (None, False), ('none', True)]:
+            updated = []
+            retval = update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=tempdir,
+                                         compression=compression, success_handler=updated.append,
+                                         unchanged_handler=updated.remove)
+            # changing the compression writes all cache files again
+            assert bool(updated) == written
+            selected = compression or selected
+            assert get_cache_compression(tempdir) == selected
+            for _, filepath in retval:
+                with open(filepath + PICKLE_CACHE_EXT, 'rb') as f:
+                    assert f.read(3).startswith(b'BZh') == (selected == 'bz2')
+            data = [(s.url, s.rosdep_data) for s in load_cached_sources_list(sources_cache_dir=tempdir)]
+            assert data == (expected or data)
+            expected = data
+
+
+def test_update_sources_list_system_cache():
+    import stat
+    try:
+        from urllib.request import pathname2url
+    except ImportError:
+        from urllib import pathname2url
+    from rosdep2.sources_list import update_sources_list, load_cached_sources_list, SourcesListLoader, DataSourceMatcher, CACHE_INDEX, SYSTEM_CACHE_ENV
+    with _use_local_rosdistro_index():
+        sources_list_dir, urls = create_local_sources(2)
+        old_environ = dict(os.environ)
+        os.environ['ROS_HOME'] = tempfile.mkdtemp()
+        system_cache_dir = os.path.join(tempfile.mkdtemp(), 'sources.cache')
+        os.environ[SYSTEM_CACHE_ENV] = system_cache_dir
+        try:
+            update_sources_list(sources_list_dir=sources_list_dir, sources_cache_dir=system_cache_dir)
+            cache_file = os.path.realpath(os.path.join(system_cache_dir, CACHE_INDEX))
+            assert stat.S_IMODE(os.stat(cache_file).st_mode) == 0o644
+            # the system cache is read until the user updates
+            system_sources = load_cached_sources_list()
+            assert [source.url for source in system_sources[:3]] == urls
+            assert 'key1' in system_sources[1].rosdep_data
+
+            # a private source of the user, listed before the shared ones
+            private_dir = tempfile.mkdtemp()
+            private_path = os.path.join(private_dir, 'private.yaml')
+            with open(private_path, 'w') as f:
+                yaml.safe_dump({'private': {'ubuntu': ['libprivate']}}, f)
+            private_urls = ['file://' + pathname2url(private_path)]
+            with open(os.path.join(private_dir, '05-private.list'), 'w') as f:
+                f.write('yaml %s\n' % private_urls[0])
+            for filename in os.listdir(sources_list_dir):
+                with open(os.path.join(private_dir, filename), 'w') as f:
+                    f.write(open(os.path.join(sources_list_dir, filename)).read())
+            updated = []
+            update_sources_list(sources_list_dir=private_dir, success_handler=updated.append)
+            # only the private source is fetched
+            assert [source.url for source in updated] == [private_urls[0]]
+            sources = load_cached_sources_list()
+            assert [source.url for source in sources] == private_urls[:1] + [source.url for source in system_sources]
+            # the data of the shared sources is not copied
+            assert os.path.realpath(os.path.dirname(sources[1].origin)) == os.path.realpath(system_cache_dir)
+            assert sources[1].rosdep_data == system_sources[0].rosdep_data
+
+            matcher = DataSourceMatcher([])
+            loader = SourcesListLoader.create_default(matcher=matcher, rosdep_keys=['key0', 'key1'])
+            assert [source.url for source in loader.sources][:3] == private_urls[:1] + urls[:2]
+            assert loader.sources[1].rosdep_data == {'key0': {'ubuntu': ['pkg0']}}
+        finally:
+            os.environ.clear()
+            os.environ.update(old_environ)
+
+
+def test_share_rosdep_data():
+    from rosdep2.sources_list import share_rosdep_data, write_cache_file, PICKLE_CACHE_EXT
+    try:
+        import cPickle as pickle
+    except ImportError:
+        import pickle
+    rosdep_data = {
+        'foo': {'ubuntu': {'bionic': {'apt': {'packages': ['foo']}}, 'focal': {'apt': {'packages': ['foo']}}},
+                'debian': {'buster': {'apt': {'packages': ['foo']}}}, '_is_ros': True},
+        'bar': {'ubuntu': {'bionic': {'apt': {'packages': ['foo']}}}, '_is_ros': True},
+        'baz': {'ubuntu': ['baz', 1, 1.0, True]},
+    }
+    shared = share_rosdep_data(rosdep_data)
+    assert shared == rosdep_data
+    assert share_rosdep_data(['not', 'a', 'dict']) == ['not', 'a', 'dict']
+
+    tempdir = tempfile.mkdtemp()
+    filepath = write_cache_file(tempdir, 'https://example.com/foo.yaml', rosdep_data)
+    with open(filepath + PICKLE_CACHE_EXT, 'rb') as f:
+        loaded = pickle.loads(f.read())
+    assert loaded == rosdep_data
+    assert [type(x) for x in loaded['baz']['ubuntu']] == [str, int, float, bool]
+    for data in [shared, loaded]:
+        # equal subtrees are shared, also across keys and OSes
+        rule = data['foo']['ubuntu']['bionic']
+        assert rule is data['foo']['ubuntu']['focal']
+        assert rule is data['foo']['debian']['buster']
+        assert rule is data['bar']['ubuntu']['bionic']
+        # but the map of each key is not
+        assert data['foo'] is not data['bar']